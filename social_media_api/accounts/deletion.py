@@ -0,0 +1,254 @@
+"""
+Batched account deletion.
+
+Deleting a user in one go runs the cascade collector over every post,
+comment, like, notification and follow they own, inside a single
+transaction that keeps SQLite locked for as long as that takes. Instead,
+`request_deletion` deactivates the account and revokes its token at once,
+and the owned rows are removed afterwards, ACCOUNT_DELETION_BATCH_SIZE at a
+time, each batch in its own short transaction with a pause in between so
+other writers get their turn.
+
+Steps run in a fixed order, dependents before the rows they point at, so a
+batch never cascades into an unbounded number of rows. Every batch records
+its step and running total on the AccountDeletion row in the same
+transaction, and every step deletes "whatever is left", so an interrupted
+deletion simply resumes: `manage.py run_account_deletions` finishes any that
+a restart cut short.
+"""
+import logging
+import threading
+import time
+from collections import Counter
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import connection, transaction
+from django.db.models import F, Q
+from django.utils import timezone
+from rest_framework.authtoken.models import Token
+
+from notifications.models import Notification
+from notifications.utils import delete_notifications
+from posts import changelog, counters, timeline, trending
+from posts.models import Comment, Like, Post, TimelineEntry
+from posts.signals import forget_comments
+
+from .models import AccountDeletion
+
+logger = logging.getLogger(__name__)
+
+DONE = "done"
+
+
+def _batch_size():
+    return getattr(settings, "ACCOUNT_DELETION_BATCH_SIZE", 200)
+
+
+def _pause():
+    return getattr(settings, "ACCOUNT_DELETION_PAUSE", 0.05)
+
+
+def _background():
+    return getattr(settings, "ACCOUNT_DELETION_BACKGROUND", True)
+
+
+def _delete_first(queryset, batch_size, order=("pk",)):
+    ids = list(queryset.order_by(*order).values_list("pk", flat=True)[:batch_size])
+    if ids:
+        queryset.model.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _delete_likes(user, batch_size):
+    likes = list(
+        Like.objects.filter(user=user).order_by("pk").values_list("pk", "post_id", "created_at")[:batch_size]
+    )
+    Like.objects.filter(pk__in=[pk for pk, _, _ in likes]).delete()
+    counters.decrement_many("like_count", Counter(post_id for _, post_id, _ in likes))
+    changelog.record_many(changelog.LIKE, changelog.DELETE, [(user.pk, post_id) for _, post_id, _ in likes])
+    trending.record_unlikes([(post_id, created_at) for _, post_id, created_at in likes])
+    return len(likes)
+
+
+def _delete_comments(user, batch_size):
+    # Replies go with the user's comments; deepest first, so nothing cascades
+    roots = list(Comment.objects.filter(author=user).order_by("pk").values_list("post_id", "path")[:batch_size])
+    if not roots:
+        return 0
+    subtrees = Q()
+    for post_id, path in roots:
+        subtrees |= Q(post_id=post_id, path__gte=path, path__lt=path + "~")
+    comments = list(
+        Comment.objects.filter(subtrees).order_by("-depth", "-pk")
+        .values_list("pk", "post_id", "created_at")[:batch_size]
+    )
+    authors = dict(Post.objects.filter(pk__in={post_id for _, post_id, _ in comments}).values_list("pk", "author_id"))
+    forget_comments([(pk, authors[post_id]) for pk, post_id, _ in comments])
+    trending.record_comment_deletes([(post_id, created_at) for _, post_id, created_at in comments])
+    Comment.objects.filter(pk__in=[pk for pk, _, _ in comments]).delete()
+    counters.decrement_many("comment_count", Counter(post_id for _, post_id, _ in comments))
+    return len(comments)
+
+
+def _delete_post_likes(user, batch_size):
+    likes = list(Like.objects.filter(post__author=user).order_by("pk").values_list("pk", "user_id", "post_id")[:batch_size])
+    Like.objects.filter(pk__in=[pk for pk, _, _ in likes]).delete()
+    changelog.record_many(changelog.LIKE, changelog.DELETE, [(liker, post_id) for _, liker, post_id in likes])
+    return len(likes)
+
+
+def _delete_post_comments(user, batch_size):
+    ids = list(
+        Comment.objects.filter(post__author=user).order_by("-depth", "-pk").values_list("pk", flat=True)[:batch_size]
+    )
+    forget_comments([(pk, user.pk) for pk in ids])
+    Comment.objects.filter(pk__in=ids).delete()
+    return len(ids)
+
+
+def _delete_timeline(user, batch_size):
+    return _delete_first(TimelineEntry.objects.filter(user=user), batch_size)
+
+
+def _delete_post_timeline(user, batch_size):
+    return _delete_first(TimelineEntry.objects.filter(post__author=user), batch_size)
+
+
+def _delete_posts(user, batch_size):
+    # Only hashtag links and trending rows are left to cascade by now
+    return _delete_first(Post.objects.filter(author=user), batch_size)
+
+
+def _delete_notifications(user, batch_size):
+    return delete_notifications(Notification.objects.filter(Q(recipient=user) | Q(actor=user)).order_by("pk")[:batch_size])
+
+
+def _delete_follows(user, batch_size):
+    Follow = get_user_model().following.through
+    follows = list(
+        Follow.objects.filter(Q(from_customuser=user) | Q(to_customuser=user))
+        .order_by("pk").values_list("pk", "from_customuser_id", "to_customuser_id")[:batch_size]
+    )
+    Follow.objects.filter(pk__in=[pk for pk, _, _ in follows]).delete()
+    # Deleting follow rows directly sends no m2m_changed, so log them for sync here
+    changelog.record_many(changelog.FOLLOW, changelog.DELETE,
+                          [(follower, followed) for _, follower, followed in follows])
+    # Authors the user followed may drop back below the pull threshold
+    timeline.backfill_followers({followed for _, follower, followed in follows if follower == user.pk})
+    return len(follows)
+
+
+STEPS = [
+    ("likes", _delete_likes),
+    ("comments", _delete_comments),
+    ("post_likes", _delete_post_likes),
+    ("post_comments", _delete_post_comments),
+    ("timeline", _delete_timeline),
+    ("post_timeline", _delete_post_timeline),
+    ("posts", _delete_posts),
+    ("notifications", _delete_notifications),
+    ("follows", _delete_follows),
+]
+STEP_NAMES = [name for name, _ in STEPS]
+
+
+def request_deletion(user):
+    """
+    Deactivate `user` and schedule the removal of everything they own.
+    Returns the AccountDeletion tracking it.
+    """
+    with transaction.atomic():
+        user.is_active = False
+        user.save(update_fields=["is_active"])
+        Token.objects.filter(user=user).delete()
+        deletion, _ = AccountDeletion.objects.get_or_create(user=user, defaults={"username": user.username})
+        if _background():
+            transaction.on_commit(deletion_worker.wake, robust=True)
+    return deletion
+
+
+def run_deletion(deletion, batch_size=None, pause=None):
+    """
+    Delete everything the user of `deletion` owns, then the user, one batch
+    per transaction, picking up at the step recorded by an earlier run.
+    """
+    batch_size = batch_size or _batch_size()
+    pause = _pause() if pause is None else pause
+    user = deletion.user
+    if deletion.finished_at is not None or user is None:
+        return deletion
+
+    start = STEP_NAMES.index(deletion.step) if deletion.step in STEP_NAMES else 0
+    for name, step in STEPS[start:]:
+        while True:
+            with transaction.atomic():
+                deleted = step(user, batch_size)
+                AccountDeletion.objects.filter(pk=deletion.pk).update(
+                    step=name, deleted_rows=F("deleted_rows") + deleted, updated_at=timezone.now()
+                )
+            if not deleted:
+                break
+            if pause:
+                time.sleep(pause)
+
+    with transaction.atomic():
+        user.delete()
+        AccountDeletion.objects.filter(pk=deletion.pk).update(
+            step=DONE, deleted_rows=F("deleted_rows") + 1, finished_at=timezone.now(), updated_at=timezone.now()
+        )
+    deletion.refresh_from_db()
+    return deletion
+
+
+def run_pending(batch_size=None):
+    """
+    Run every unfinished deletion, oldest first. Returns the number finished.
+    """
+    finished = 0
+    for deletion in AccountDeletion.objects.filter(finished_at__isnull=True).order_by("pk"):
+        try:
+            run_deletion(deletion, batch_size=batch_size)
+        except Exception:
+            logger.exception("Failed to delete account %s; it will be resumed", deletion.username)
+            continue
+        finished += 1
+    return finished
+
+
+class DeletionWorker:
+    """
+    Runs pending deletions in a daemon thread of the web process. A wake-up
+    while it is busy makes it check for pending deletions once more.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._thread = None
+        self._wanted = False
+
+    def wake(self):
+        with self._lock:
+            self._wanted = True
+            if self._thread is None:
+                self._thread = threading.Thread(target=self._run, name="account-deletion", daemon=True)
+                self._thread.start()
+
+    def _run(self):
+        try:
+            while True:
+                with self._lock:
+                    if not self._wanted:
+                        self._thread = None
+                        return
+                    self._wanted = False
+                run_pending()
+        except Exception:
+            logger.exception("Account deletion worker stopped")
+            with self._lock:
+                self._thread = None
+        finally:
+            connection.close()
+
+
+deletion_worker = DeletionWorker()
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from accounts.deletion import run_pending
+
+
+class Command(BaseCommand):
+    help = "Finish pending account deletions, resuming any that were interrupted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=None,
+                            help="Rows deleted per transaction (default: ACCOUNT_DELETION_BATCH_SIZE).")
+
+    def handle(self, *args, **options):
+        finished = run_pending(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Finished {finished} account deletions."))
@@ -17,3 +17,21 @@ class CustomUser(AbstractUser):
     def __str__(self):
         return self.username
     
+
+
+class AccountDeletion(models.Model):
+    """
+    Progress of a batched account deletion, see accounts.deletion. The row
+    outlives the user so a finished deletion can still be looked up.
+    """
+    user = models.OneToOneField(CustomUser, on_delete=models.SET_NULL, null=True, related_name="deletion")
+    username = models.CharField(max_length=150)
+    requested_at = models.DateTimeField(auto_now_add=True)
+    updated_at = models.DateTimeField(auto_now=True)
+    finished_at = models.DateTimeField(null=True, blank=True)
+    # Name of the step in progress; steps run in accounts.deletion.STEPS order
+    step = models.CharField(max_length=32, blank=True)
+    deleted_rows = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"Deletion of {self.username}"
@@ -3,12 +3,22 @@ from django.contrib.auth import authenticate, get_user_model
 from rest_framework.authtoken.models import Token
 
 from .models import CustomUser
+from posts.fields import DynamicFieldsMixin
 
 
-class CustomUserSerializer(serializers.ModelSerializer):
+class UserSummarySerializer(serializers.ModelSerializer):
+    class Meta:
+        model = CustomUser
+        fields = ['id', 'username', 'bio', 'profile_picture']
+
+
+class CustomUserSerializer(DynamicFieldsMixin, serializers.ModelSerializer):
     class Meta:
         model = CustomUser
         fields = ['id', 'username', 'email', 'bio', 'profile_picture', 'followers']
+        expandable_fields = {
+            'following': lambda: serializers.PrimaryKeyRelatedField(many=True, read_only=True),
+        }
 
 
 class RegisterSerializer(serializers.ModelSerializer):
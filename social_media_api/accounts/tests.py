@@ -1,3 +1,171 @@
-from django.test import TestCase
+import io
+import json
+import os
+import zipfile
+from unittest import mock
+
+from django.contrib.auth import get_user_model
+from django.core.management import call_command
+from django.urls import reverse
+from rest_framework.authtoken.models import Token
+from rest_framework.test import APITestCase
+
+from notifications.models import Notification
+from posts.models import Comment, Hashtag, Like, Post, TimelineEntry
+
+from . import deletion, export
+from .models import AccountDeletion
+
+User = get_user_model()
+
+
+class UserDetailFieldsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='testpass')
+        self.other = User.objects.create_user(username='bob', password='testpass')
+        self.other.following.add(self.user)
+        self.client.force_authenticate(self.user)
+
+    def test_default_fields_include_followers(self):
+        response = self.client.get(reverse('user-detail', args=[self.user.pk]))
+        self.assertEqual(response.data['followers'], [self.other.pk])
+        self.assertNotIn('following', response.data)
+
+    def test_followers_are_not_loaded_unless_requested(self):
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-detail', args=[self.user.pk]), {'fields': 'id,username'})
+        self.assertEqual(response.data, {'id': self.user.pk, 'username': 'alice'})
+
+    def test_expand_following(self):
+        response = self.client.get(reverse('user-detail', args=[self.other.pk]), {'expand': 'following'})
+        self.assertEqual(response.data['following'], [self.user.pk])
+
+    def test_multi_get_keeps_requested_order(self):
+        ids = f'{self.other.pk},999999,{self.user.pk}'
+        with self.assertNumQueries(1):
+            response = self.client.get(reverse('user-multi-get'), {'ids': ids, 'fields': 'id,username'})
+        self.assertEqual(response.data['results'], [
+            {'id': self.other.pk, 'username': 'bob'},
+            {'id': self.user.pk, 'username': 'alice'},
+        ])
+        self.assertEqual(self.client.get(reverse('user-multi-get')).status_code, 400)
+
+
+class ExportTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='testpass')
+        self.other = User.objects.create_user(username='bob', password='testpass')
+        self.user.following.add(self.other)
+        self.post = Post.objects.create(author=self.user, title='Mine', content='hello')
+        self.theirs = Post.objects.create(author=self.other, title='Theirs', content='hi')
+        Comment.objects.create(post=self.theirs, author=self.user, content='nice')
+        Like.objects.create(post=self.theirs, user=self.user)
+        Notification.objects.create(recipient=self.user, actor=self.other, verb='followed you')
+        self.client.force_authenticate(self.user)
+
+    def read_archive(self, response):
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(response.streaming_content)))
+        return {
+            name: [json.loads(line) for line in archive.read(name).splitlines()]
+            for name in archive.namelist()
+        }
+
+    def test_export_contains_every_section(self):
+        response = self.client.get(reverse('account-export'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response['Content-Type'], 'application/zip')
+        self.assertIn('alice-export.zip', response['Content-Disposition'])
+        files = self.read_archive(response)
+        self.assertEqual(files['profile.json'][0]['username'], 'alice')
+        self.assertEqual([row['title'] for row in files['posts.ndjson']], ['Mine'])
+        self.assertEqual([row['content'] for row in files['comments.ndjson']], ['nice'])
+        self.assertEqual([row['post_id'] for row in files['likes.ndjson']], [self.theirs.pk])
+        self.assertEqual([row['verb'] for row in files['notifications.ndjson']], ['followed you'])
+        self.assertEqual(files['following.ndjson'], [{'id': self.other.pk, 'username': 'bob'}])
+        self.assertEqual(files['followers.ndjson'], [])
+
+    def test_export_requires_authentication(self):
+        self.client.force_authenticate(None)
+        response = self.client.get(reverse('account-export'))
+        self.assertEqual(response.status_code, 403)
+
+    def test_large_export_is_streamed_in_bounded_chunks(self):
+        Post.objects.bulk_create([
+            Post(author=self.user, title=f'Post {i}', content=os.urandom(200).hex()) for i in range(1500)
+        ])
+        with mock.patch.object(export, 'FLUSH_BYTES', 16 * 1024), self.settings(EXPORT_CHUNK_SIZE=100):
+            chunks = list(export.export_archive(self.user))
+        # Chunk size is set by the flush threshold and the compressor's block size, not the export size
+        self.assertGreater(sum(len(chunk) for chunk in chunks), 256 * 1024)
+        self.assertLess(max(len(chunk) for chunk in chunks), 64 * 1024)
+        archive = zipfile.ZipFile(io.BytesIO(b''.join(chunks)))
+        self.assertEqual(len(archive.read('posts.ndjson').splitlines()), 1501)
+
+
+class AccountDeletionTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='alice', password='testpass')
+        self.other = User.objects.create_user(username='bob', password='testpass')
+        self.user.following.add(self.other)
+        self.other.following.add(self.user)
+
+        self.posts = [Post.objects.create(author=self.user, title=f'Mine {i}', content='#tag') for i in range(3)]
+        comment = Comment.objects.create(post=self.posts[0], author=self.other, content='hi')
+        Comment.objects.create(post=self.posts[0], author=self.other, parent=comment, content='again')
+        Like.objects.create(post=self.posts[0], user=self.other)
+        TimelineEntry.objects.create(user=self.other, post=self.posts[0], created_at=self.posts[0].created_at)
+
+        self.theirs = Post.objects.create(author=self.other, title='Theirs', content='x', like_count=1, comment_count=3)
+        Like.objects.create(post=self.theirs, user=self.user)
+        mine = Comment.objects.create(post=self.theirs, author=self.user, content='mine')
+        Comment.objects.create(post=self.theirs, author=self.other, parent=mine, content='reply')
+        self.kept = Comment.objects.create(post=self.theirs, author=self.other, content='kept')
+        Notification.objects.create(recipient=self.user, actor=self.other, verb='followed you')
+        Notification.objects.create(recipient=self.other, actor=self.user, verb='followed you')
+        Token.objects.create(user=self.user)
+        self.client.force_authenticate(self.user)
+
+    def assert_everything_deleted(self):
+        self.assertFalse(User.objects.filter(pk=self.user.pk).exists())
+        self.assertFalse(Post.objects.filter(author=self.other).exclude(pk=self.theirs.pk).exists())
+        self.assertEqual(list(Comment.objects.values_list('pk', flat=True)), [self.kept.pk])
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+        self.assertFalse(TimelineEntry.objects.exists())
+        self.assertFalse(self.other.following.exists())
+        self.assertEqual(Hashtag.objects.get(name='tag').post_count, 0)
+        self.theirs.refresh_from_db()
+        self.assertEqual((self.theirs.like_count, self.theirs.comment_count), (0, 1))
+        record = AccountDeletion.objects.get(username='alice')
+        self.assertIsNotNone(record.finished_at)
+        self.assertEqual(record.step, deletion.DONE)
+
+    def test_delete_deactivates_at_once_and_schedules_the_rest(self):
+        with self.captureOnCommitCallbacks() as callbacks:
+            response = self.client.delete(reverse('account-delete'))
+        self.assertEqual(response.status_code, 202)
+        self.assertEqual(len(callbacks), 1)
+        self.user.refresh_from_db()
+        self.assertFalse(self.user.is_active)
+        self.assertFalse(Token.objects.filter(user=self.user).exists())
+        self.assertEqual(Post.objects.filter(author=self.user).count(), 3)
+
+    def test_run_deletion_removes_owned_rows_in_batches(self):
+        record = deletion.request_deletion(self.user)
+        record = deletion.run_deletion(record, batch_size=2, pause=0)
+        self.assert_everything_deleted()
+        self.assertGreater(record.deleted_rows, 10)
+
+    def test_interrupted_deletion_resumes_where_it_stopped(self):
+        record = deletion.request_deletion(self.user)
+        with mock.patch.object(deletion.time, 'sleep', side_effect=RuntimeError('killed')):
+            with self.assertRaises(RuntimeError):
+                deletion.run_deletion(record, batch_size=1, pause=1)
+        record.refresh_from_db()
+        self.assertEqual(record.step, 'likes')
+        self.assertEqual(record.deleted_rows, 1)
+        self.assertTrue(Post.objects.filter(author=self.user).exists())
+
+        call_command('run_account_deletions', stdout=io.StringIO())
+        self.assert_everything_deleted()
 
-# Create your tests here.
@@ -5,7 +5,10 @@ from . import views
 urlpatterns = [
     path("register/", views.RegisterView.as_view(), name="register"),
     path("login/", views.LoginView.as_view(), name="login"),
+    path("user/", views.UserDetailView.as_view(), name="user-multi-get"),
     path("user/<int:pk>/", views.UserDetailView.as_view(), name="user-detail"),
-    path('follow/<int:user_id>/', views.follow_user, name='follow_user'),
-    path('unfollow/<int:user_id>/', views.unfollow_user, name='unfollow_user'),
+    path('follow/<int:pk>/', views.FollowUserView.as_view(), name='follow_user'),
+    path('unfollow/<int:pk>/', views.UnfollowUserView.as_view(), name='unfollow_user'),
+    path('export/', views.ExportView.as_view(), name='account-export'),
+    path('delete/', views.DeleteAccountView.as_view(), name='account-delete'),
 ]
\ No newline at end of file
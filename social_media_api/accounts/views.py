@@ -1,3 +1,4 @@
+from django.http import StreamingHttpResponse
 from django.shortcuts import render, get_object_or_404
 from django.contrib.auth import get_user_model
 from rest_framework.views import APIView
@@ -7,7 +8,12 @@ from rest_framework.response import Response
 from rest_framework import generics, status, permissions
 from rest_framework.decorators import api_view, permission_classes
 from rest_framework.permissions import IsAuthenticated
+from .deletion import request_deletion
+from .export import export_archive
 from .models import CustomUser
+from posts.batch import MultiGetMixin
+from posts.fields import SparseFieldsViewMixin
+from posts.timeline import backfill_followers, backfill_timeline, trim_timeline
 
 # Create your views here.
 
@@ -28,10 +34,22 @@ class LoginView(APIView):
         return Response({"token": token.key, "user_id": user.id, "username": user.username})
 
 
-class UserDetailView(generics.RetrieveAPIView):
+class UserDetailView(MultiGetMixin, SparseFieldsViewMixin, generics.RetrieveAPIView):
     queryset = User.objects.all()
     serializer_class = CustomUserSerializer
 
+    def get_queryset(self):
+        # Follower and following id lists are only loaded when rendered
+        queryset = super().get_queryset()
+        relations = [name for name in ('followers', 'following') if self.wants(name)]
+        return queryset.prefetch_related(*relations) if relations else queryset
+
+    def get(self, request, *args, **kwargs):
+        # user/?ids=1,2,3 returns several users
+        if 'pk' not in kwargs:
+            return self.multi_get(request)
+        return super().get(request, *args, **kwargs)
+
 
 class FollowUserView(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
@@ -43,6 +61,7 @@ class FollowUserView(generics.GenericAPIView):
             return Response({"error": "You cannot follow yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
         request.user.following.add(user_to_follow)
+        backfill_timeline(request.user, user_to_follow)
         return Response({"success": f"You are now following {user_to_follow.username}"}, status=status.HTTP_200_OK)
 
 
@@ -56,6 +75,27 @@ class UnfollowUserView(generics.GenericAPIView):
             return Response({"error": "You cannot unfollow yourself."}, status=status.HTTP_400_BAD_REQUEST)
 
         request.user.following.remove(user_to_unfollow)
+        trim_timeline(request.user, user_to_unfollow)
+        # Losing a follower may bring the author back below the pull threshold
+        backfill_followers([user_to_unfollow.pk])
         return Response({"success": f"You have unfollowed {user_to_unfollow.username}"}, status=status.HTTP_200_OK)
 
 
+class ExportView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        # Streamed as it is built; see accounts/export.py
+        response = StreamingHttpResponse(export_archive(request.user), content_type='application/zip')
+        response['Content-Disposition'] = f'attachment; filename="{request.user.username}-export.zip"'
+        return response
+
+
+class DeleteAccountView(APIView):
+    permission_classes = [permissions.IsAuthenticated]
+
+    def delete(self, request, *args, **kwargs):
+        # The account is deactivated now; its rows are removed in the background
+        deletion = request_deletion(request.user)
+        return Response({"detail": "Account deactivated, its data is being deleted.", "deletion": deletion.pk},
+                        status=status.HTTP_202_ACCEPTED)
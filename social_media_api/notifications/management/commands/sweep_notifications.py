@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from notifications.utils import sweep_orphaned_notifications
+
+
+class Command(BaseCommand):
+    help = "Delete notifications whose target (post, comment, ...) no longer exists, in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="Notifications deleted per transaction (default: 500).")
+
+    def handle(self, *args, **options):
+        stdout = self.stdout if options["verbosity"] > 1 else None
+        removed = sweep_orphaned_notifications(batch_size=options["batch_size"], stdout=stdout)
+        self.stdout.write(self.style.SUCCESS(f"Swept notifications: {removed} orphans removed."))
@@ -18,5 +18,14 @@ class Notification(models.Model):
     timestamp = models.DateTimeField(auto_now_add=True)
     read = models.BooleanField(default=False)
 
+    class Meta:
+        indexes = [
+            # Looks up recent identical notifications for deduplication
+            models.Index(fields=["actor", "target_content_type", "target_object_id", "-timestamp"],
+                         name="notification_dedupe_idx"),
+            # Finds the notifications of a target, and lets the orphan sweep walk one target type in order
+            models.Index(fields=["target_content_type", "target_object_id"], name="notification_target_idx"),
+        ]
+
     def __str__(self):
         return f"{self.actor} {self.verb} {self.target} → {self.recipient}"
\ No newline at end of file
@@ -1,3 +1,85 @@
-from django.test import TestCase
+import io
+from datetime import timedelta
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.management import call_command
+from django.test import TestCase, override_settings
+from django.urls import reverse
+from rest_framework.test import APITestCase
+
+from posts.models import Comment, Post
+
+from .models import Notification
+from .utils import create_notifications, sweep_orphaned_notifications
+
+User = get_user_model()
+
+
+class CreateNotificationsTestCase(TestCase):
+    def setUp(self):
+        self.actor = User.objects.create_user(username='actor', password='testpass')
+        self.users = [User.objects.create_user(username=f'user{i}', password='testpass') for i in range(3)]
+
+    def test_skips_the_actor_and_recent_duplicates(self):
+        ids = [user.pk for user in self.users]
+        created = create_notifications(ids[:2] + [self.actor.pk], self.actor, 'waved at you', self.users[0])
+        self.assertEqual(len(created), 2)
+
+        created = create_notifications(ids, self.actor, 'waved at you', self.users[0])
+        self.assertEqual([notification.recipient_id for notification in created], [ids[2]])
+        # A different target is not a duplicate
+        self.assertEqual(len(create_notifications(ids, self.actor, 'waved at you', self.users[1])), 3)
+
+    @override_settings(NOTIFICATION_DEDUPE_WINDOW=60)
+    def test_old_notifications_do_not_deduplicate(self):
+        create_notifications([self.users[0].pk], self.actor, 'waved at you')
+        Notification.objects.update(timestamp=Notification.objects.get().timestamp - timedelta(minutes=5))
+        self.assertEqual(len(create_notifications([self.users[0].pk], self.actor, 'waved at you')), 1)
+
+
+class NotificationListTestCase(APITestCase):
+    def test_lists_own_notifications(self):
+        actor = User.objects.create_user(username='actor', password='testpass')
+        user = User.objects.create_user(username='user', password='testpass')
+        create_notifications([user.pk], actor, 'waved at you')
+        self.client.force_authenticate(user)
+        response = self.client.get(reverse('notifications'))
+        self.assertEqual([item['verb'] for item in response.data['results']], ['waved at you'])
+
+
+class OrphanedNotificationTestCase(TestCase):
+    def setUp(self):
+        self.actor = User.objects.create_user(username='actor', password='testpass')
+        self.user = User.objects.create_user(username='user', password='testpass')
+        self.post = Post.objects.create(author=self.user, title='Post', content='x')
+
+    def test_deleting_a_target_deletes_its_notifications(self):
+        comment = Comment.objects.create(post=self.post, author=self.actor, content='hi')
+        create_notifications([self.user.pk], self.actor, 'liked your post', self.post)
+        create_notifications([self.user.pk], self.actor, 'mentioned you in a comment', comment)
+        create_notifications([self.user.pk], self.actor, 'waved at you')
+        self.post.delete()
+        self.assertEqual(list(Notification.objects.values_list('verb', flat=True)), ['waved at you'])
+
+    def test_sweep_removes_only_orphans_in_batches(self):
+        post_type = ContentType.objects.get_for_model(Post)
+        Notification.objects.bulk_create([
+            Notification(recipient=self.user, actor=self.actor, verb='liked your post',
+                         target_content_type=post_type, target_object_id=target_id)
+            for target_id in [self.post.pk, self.post.pk + 100, self.post.pk + 100, self.post.pk + 200]
+        ])
+        create_notifications([self.user.pk], self.actor, 'waved at you')
+        self.assertEqual(sweep_orphaned_notifications(batch_size=2), 3)
+        self.assertEqual(
+            sorted(Notification.objects.values_list('target_object_id', flat=True), key=str),
+            [self.post.pk, None],
+        )
+        call_command('sweep_notifications', stdout=io.StringIO())
+        self.assertEqual(Notification.objects.count(), 2)
+
+    def test_sweep_walks_the_target_index(self):
+        post_type = ContentType.objects.get_for_model(Post)
+        plan = Notification.objects.filter(target_content_type=post_type).order_by('target_object_id').explain()
+        self.assertIn('notification_target_idx', plan)
 
-# Create your tests here.
@@ -1,5 +1,13 @@
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Exists, OuterRef
+from django.utils import timezone
+
 from .models import Notification
 from django.contrib.contenttypes.models import ContentType
+from posts import changelog
 
 def create_notification(recipient, actor, verb, target=None):
     notification = Notification.objects.create(
@@ -10,3 +18,107 @@ def create_notification(recipient, actor, verb, target=None):
         target_object_id=target.id if target else None
     )
     return notification
+
+
+def create_notifications(recipient_ids, actor, verb, target=None):
+    """
+    Notify many recipients of the same action with one lookup and one bulk_create.
+
+    Recipients who already got an identical notification (same actor, verb
+    and target) within NOTIFICATION_DEDUPE_WINDOW seconds are skipped, as is
+    the actor. Returns the created notifications.
+    """
+    target_type = ContentType.objects.get_for_model(target) if target else None
+    target_id = target.id if target else None
+    recipient_ids = set(recipient_ids) - {actor.pk}
+    if not recipient_ids:
+        return []
+
+    since = timezone.now() - timedelta(seconds=getattr(settings, 'NOTIFICATION_DEDUPE_WINDOW', 3600))
+    recent = Notification.objects.filter(
+        actor=actor,
+        target_content_type=target_type,
+        target_object_id=target_id,
+        verb=verb,
+        recipient_id__in=recipient_ids,
+        timestamp__gte=since,
+    ).values_list('recipient_id', flat=True)
+    recipient_ids -= set(recent)
+
+    notifications = Notification.objects.bulk_create([
+        Notification(
+            recipient_id=recipient_id,
+            actor=actor,
+            verb=verb,
+            target_content_type=target_type,
+            target_object_id=target_id,
+        )
+        for recipient_id in sorted(recipient_ids)
+    ])
+    # bulk_create skips post_save, so log the changes for sync here
+    changelog.record_many(changelog.NOTIFICATION, changelog.UPSERT,
+                          [(notification.recipient_id, notification.pk) for notification in notifications])
+    return notifications
+
+
+def delete_notifications(notifications):
+    """
+    Delete the notifications in the `notifications` queryset and log the
+    deletes for sync, in one query each. Returns the number removed.
+    """
+    rows = list(notifications.values_list("pk", "recipient_id"))
+    if rows:
+        Notification.objects.filter(pk__in=[pk for pk, _ in rows]).delete()
+        changelog.record_many(changelog.NOTIFICATION, changelog.DELETE,
+                              [(recipient_id, pk) for pk, recipient_id in rows])
+    return len(rows)
+
+
+def delete_target_notifications(model, target_ids):
+    """
+    Remove the notifications pointing at the `model` rows in `target_ids`,
+    which are being deleted; the generic foreign key does not cascade.
+    """
+    if target_ids:
+        delete_notifications(Notification.objects.filter(
+            target_content_type=ContentType.objects.get_for_model(model),
+            target_object_id__in=target_ids,
+        ))
+
+
+def sweep_orphaned_notifications(batch_size=500, stdout=None):
+    """
+    Delete notifications whose target no longer exists, in batches.
+
+    Each target type is walked in target id order along the
+    (target_content_type, target_object_id) index, probing the target table
+    by primary key, so the sweep is an anti-join over two indexes. Returns
+    the number of notifications removed.
+    """
+    removed = 0
+    type_ids = (
+        Notification.objects.filter(target_content_type__isnull=False)
+        .order_by().values_list("target_content_type", flat=True).distinct()
+    )
+    for content_type in ContentType.objects.filter(pk__in=list(type_ids)).order_by("pk"):
+        orphans = Notification.objects.filter(target_content_type=content_type)
+        model = content_type.model_class()
+        if model is not None:
+            # A type whose model is gone leaves every one of its notifications orphaned
+            targets = model._base_manager.filter(pk=OuterRef("target_object_id"))
+            orphans = orphans.filter(~Exists(targets))
+
+        last_target_id = None
+        while True:
+            batch = orphans if last_target_id is None else orphans.filter(target_object_id__gte=last_target_id)
+            rows = list(batch.order_by("target_object_id", "pk").values_list("pk", "target_object_id")[:batch_size])
+            if not rows:
+                break
+            with transaction.atomic():
+                delete_notifications(Notification.objects.filter(pk__in=[pk for pk, _ in rows]))
+            removed += len(rows)
+            last_target_id = rows[-1][1]
+            if stdout is not None:
+                stdout.write(f"Swept {content_type.app_label}.{content_type.model} targets up to id "
+                             f"{last_target_id}, {removed} removed so far.")
+    return removed
@@ -8,4 +8,10 @@ class NotificationListView(generics.ListAPIView):
     permission_classes = [IsAuthenticated]
 
     def get_queryset(self):
-        return Notification.objects.filter(recipient=self.request.user).order_by("-timestamp")
+        # Targets are fetched with one query per target type instead of one per notification
+        return (
+            Notification.objects.filter(recipient=self.request.user)
+            .select_related("actor")
+            .prefetch_related("target")
+            .order_by("-timestamp")
+        )
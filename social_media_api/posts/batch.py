@@ -0,0 +1,142 @@
+"""
+Fewer round trips for clients rendering a screen.
+
+`?ids=3,1,2` on a view mixing in MultiGetMixin returns those objects, in
+that order, loaded with one `IN` query over the view's own queryset, so the
+view's joins, prefetches and sparse fields apply as for a single object.
+
+`run_batch` serves several read-only sub-requests from one HTTP request. Each
+path is resolved with the URL resolver and its view called directly: the
+sub-requests share the outer request's authenticated user, so no token is
+looked up again, and run on the same thread and database connection.
+"""
+import json
+import logging
+from urllib.parse import urlsplit
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.http import Http404, HttpRequest, QueryDict
+from django.urls import Resolver404, resolve
+from rest_framework import status
+from rest_framework.exceptions import ValidationError
+from rest_framework.response import Response
+
+logger = logging.getLogger(__name__)
+
+# Largest id a BigAutoField can hold
+MAX_ID = 2 ** 63 - 1
+# The outer request's body belongs to the batch, not to its GET sub-requests
+BODY_META = ("CONTENT_LENGTH", "CONTENT_TYPE", "wsgi.input")
+
+
+def max_ids():
+    return getattr(settings, "MULTI_GET_MAX_IDS", 100)
+
+
+def max_requests():
+    return getattr(settings, "BATCH_MAX_REQUESTS", 20)
+
+
+def parse_ids(value):
+    """
+    Turn "3,1,3,2" into [3, 1, 2]; raise ValidationError for anything else.
+    """
+    try:
+        ids = list(dict.fromkeys(int(part) for part in value.split(",") if part.strip()))
+    except ValueError:
+        raise ValidationError({"ids": "Must be a comma-separated list of ids."})
+    if not ids:
+        raise ValidationError({"ids": "Must name at least one id."})
+    if not all(1 <= pk <= MAX_ID for pk in ids):
+        raise ValidationError({"ids": f"Ids must be between 1 and {MAX_ID}."})
+    if len(ids) > max_ids():
+        raise ValidationError({"ids": f"At most {max_ids()} ids can be requested at once."})
+    return ids
+
+
+class MultiGetMixin:
+    """
+    Answer `?ids=` list requests with `{'results': [...]}` in the requested
+    order. Ids that do not exist, or that the view's queryset excludes, are
+    left out.
+    """
+
+    def multi_get(self, request):
+        ids = parse_ids(request.query_params.get("ids", ""))
+        objects = self.get_queryset().in_bulk(ids)
+        serializer = self.get_serializer([objects[pk] for pk in ids if pk in objects], many=True)
+        return Response({"results": serializer.data})
+
+    def list(self, request, *args, **kwargs):
+        if "ids" in request.query_params:
+            return self.multi_get(request)
+        return super().list(request, *args, **kwargs)
+
+
+def _subrequest(request, path):
+    url = urlsplit(path)
+    sub = HttpRequest()
+    sub.method = "GET"
+    sub.path = sub.path_info = url.path
+    sub.META = {key: value for key, value in request.META.items() if key not in BODY_META}
+    sub.META.update({"REQUEST_METHOD": "GET", "PATH_INFO": url.path, "QUERY_STRING": url.query})
+    sub.GET = QueryDict(url.query)
+    sub.COOKIES = request.COOKIES
+    # Reuse the outer authentication instead of authenticating every sub-request again
+    sub.user = request.user
+    sub._force_auth_user = request.user
+    sub._force_auth_token = request.auth
+    return sub
+
+
+def _body(response):
+    if hasattr(response, "data"):
+        return response.data
+    try:
+        return json.loads(response.content or b"null")
+    except ValueError:
+        return {"detail": "Response is not JSON."}
+
+
+def run_one(request, path, forbidden=()):
+    """
+    Serve GET `path` as the user of `request`. Returns `(status, body)`.
+    """
+    if not isinstance(path, str) or not path.startswith("/api/"):
+        return status.HTTP_400_BAD_REQUEST, {"detail": "Path must start with /api/."}
+    try:
+        match = resolve(urlsplit(path).path)
+    except Resolver404:
+        return status.HTTP_404_NOT_FOUND, {"detail": "Not found."}
+    if getattr(match.func, "view_class", None) in forbidden:
+        return status.HTTP_400_BAD_REQUEST, {"detail": "This path cannot be batched."}
+    try:
+        response = match.func(_subrequest(request, path), *match.args, **match.kwargs)
+    except Http404:
+        return status.HTTP_404_NOT_FOUND, {"detail": "Not found."}
+    except PermissionDenied:
+        return status.HTTP_403_FORBIDDEN, {"detail": "You do not have permission to perform this action."}
+    except Exception:
+        # One broken sub-request must not take the rest of the batch down
+        logger.exception("Batched request to %s failed", path)
+        return status.HTTP_500_INTERNAL_SERVER_ERROR, {"detail": "A server error occurred."}
+    if response.streaming:
+        return status.HTTP_400_BAD_REQUEST, {"detail": "Streaming responses cannot be batched."}
+    return response.status_code, _body(response)
+
+
+def run_batch(request, paths, forbidden=()):
+    """
+    Serve every path in `paths` in order. Views in `forbidden` (e.g. the
+    batch view itself) are refused.
+    """
+    if not isinstance(paths, list) or not paths:
+        raise ValidationError({"requests": "Must be a non-empty list of paths."})
+    if len(paths) > max_requests():
+        raise ValidationError({"requests": f"At most {max_requests()} requests can be batched."})
+    responses = []
+    for path in paths:
+        code, body = run_one(request, path, forbidden)
+        responses.append({"path": path, "status": code, "body": body})
+    return responses
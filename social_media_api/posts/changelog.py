@@ -0,0 +1,178 @@
+"""
+Append-only change log behind the delta-sync endpoint.
+
+Every create, update or delete of a post, comment, like, follow or
+notification appends a Change row: from the signal handlers in
+posts.signals, or explicitly by the code paths that write with bulk_create.
+Comments, likes and notifications are deleted in bulk, so their deletes are
+always logged explicitly, in one INSERT per batch: comments through
+posts.signals.forget_comments, notifications through
+notifications.utils.delete_notifications.
+The row is written in the same transaction as the mutation: the views run
+each write and its follow-up work (fan-out, notifications) in one, so a
+failed log insert rolls the mutation back.
+
+A client keeps the cursor returned by its last sync (the id of the last log
+row it has seen) and asks for what happened after it. Only the rows that
+concern the user are read, through an (owner_id, id) index, and they are
+compacted to the last operation per object before the surviving objects are
+loaded in one query per kind.
+
+A follow or unfollow changes which authors are in scope, and the log rows of
+their older posts are not read again. A follow therefore also upserts the
+author's latest FEED_BACKFILL_LIMIT posts, as their timeline backfill does,
+and an unfollow deletes every post of the author; comments travel inside
+their posts.
+
+Cursors rely on ids growing in commit order, which holds on SQLite: writers
+are serialized and ids come from AUTOINCREMENT. Rows older than
+SYNC_RETENTION_DAYS are pruned; a cursor from before the pruned range is
+expired and the client has to reload.
+"""
+from datetime import timedelta
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import transaction
+from django.db.models import Q
+from django.utils import timezone
+
+from .models import Change, Post
+
+POST = "post"
+COMMENT = "comment"
+LIKE = "like"
+FOLLOW = "follow"
+NOTIFICATION = "notification"
+# Kinds synced to everyone following the owner; the others only to the owner
+FEED_KINDS = (POST, COMMENT)
+
+UPSERT = "upsert"
+DELETE = "delete"
+
+
+def page_size():
+    return getattr(settings, "SYNC_PAGE_SIZE", 500)
+
+
+def retention_days():
+    return getattr(settings, "SYNC_RETENTION_DAYS", 30)
+
+
+def follow_backfill_limit():
+    return getattr(settings, "FEED_BACKFILL_LIMIT", 500)
+
+
+def record(kind, op, owner_id, object_id):
+    Change.objects.create(kind=kind, op=op, owner_id=owner_id, object_id=object_id)
+
+
+def record_many(kind, op, pairs):
+    """
+    Append one row per `(owner_id, object_id)` pair with a single INSERT.
+    """
+    Change.objects.bulk_create([
+        Change(kind=kind, op=op, owner_id=owner_id, object_id=object_id) for owner_id, object_id in pairs
+    ])
+
+
+def latest_cursor():
+    return Change.objects.order_by("-pk").values_list("pk", flat=True).first() or 0
+
+
+def cursor_expired(since):
+    """
+    Whether rows after `since` have been pruned. Ids only have gaps where
+    rows were pruned, so this is a look at the oldest row left.
+    """
+    oldest = Change.objects.order_by("pk").values_list("pk", flat=True).first()
+    return oldest is not None and since < oldest - 1
+
+
+def changes_since(user, since, limit=None):
+    """
+    Return `(changes, cursor, has_more)` for the log rows after `since` that
+    concern `user`: posts and comments of the authors they follow and their
+    own, and their own likes, follows and notifications.
+
+    `changes` holds `(kind, object_id, op)` with only the last operation of
+    each object, in log order. A follow or unfollow is preceded by upserts
+    or deletes of the posts it brings into or out of scope. At most `limit`
+    rows are read; `cursor` is where the next call should continue.
+    """
+    limit = limit or page_size()
+    latest = latest_cursor()
+    Follow = get_user_model().following.through
+    followed = Follow.objects.filter(from_customuser=user).values("to_customuser_id")
+    rows = list(
+        Change.objects.filter(pk__gt=since, pk__lte=latest)
+        .filter(Q(owner_id=user.pk) | Q(kind__in=FEED_KINDS, owner_id__in=followed))
+        .order_by("pk")
+        .values_list("pk", "kind", "object_id", "op")[:limit + 1]
+    )
+    has_more = len(rows) > limit
+    if has_more:
+        rows = rows[:limit]
+        cursor = rows[-1][0]
+    else:
+        # Nothing else concerns this user up to `latest`, so skip past it
+        cursor = max(latest, since)
+
+    last = {}
+    for pk, kind, object_id, op in rows:
+        last.pop((kind, object_id), None)
+        last[(kind, object_id)] = op
+
+    scoped = _posts_brought_into_scope(last)
+    changes = {}
+    for (kind, object_id), op in last.items():
+        for post_id in scoped.get((kind, object_id), ()):
+            changes.pop((POST, post_id), None)
+            changes[(POST, post_id)] = op
+        # Later rows of the same object still win over the posts added above
+        changes.pop((kind, object_id), None)
+        changes[(kind, object_id)] = op
+    return [(kind, object_id, op) for (kind, object_id), op in changes.items()], cursor, has_more
+
+
+def _posts_brought_into_scope(last):
+    """
+    Map each follow change in `last` to the ids of the author's posts it
+    brings into (upsert) or out of (delete) the user's feed.
+    """
+    followed = [author_id for (kind, author_id), op in last.items() if kind == FOLLOW and op == UPSERT]
+    unfollowed = [author_id for (kind, author_id), op in last.items() if kind == FOLLOW and op == DELETE]
+    scoped = {}
+    for author_id in followed:
+        scoped[(FOLLOW, author_id)] = list(
+            Post.objects.filter(author_id=author_id)
+            .order_by("-created_at", "-id")
+            .values_list("pk", flat=True)[:follow_backfill_limit()]
+        )
+    if unfollowed:
+        posts = Post.objects.filter(author_id__in=unfollowed).order_by("pk").values_list("pk", "author_id")
+        for post_id, author_id in posts:
+            scoped.setdefault((FOLLOW, author_id), []).append(post_id)
+    return scoped
+
+
+def prune_changes(now=None, batch_size=1000):
+    """
+    Delete rows older than SYNC_RETENTION_DAYS in batches, always keeping the
+    newest row so cursors can still be told apart from expired ones.
+    Returns the number of rows removed.
+    """
+    cutoff = (now or timezone.now()) - timedelta(days=retention_days())
+    keep = latest_cursor()
+    removed = 0
+    while True:
+        # Ids and creation times grow together, so old rows are a prefix of the table
+        ids = list(
+            Change.objects.filter(created_at__lt=cutoff, pk__lt=keep)
+            .order_by("pk").values_list("pk", flat=True)[:batch_size]
+        )
+        if not ids:
+            return removed
+        with transaction.atomic():
+            Change.objects.filter(pk__in=ids).delete()
+        removed += len(ids)
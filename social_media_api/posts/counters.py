@@ -0,0 +1,101 @@
+"""
+Denormalized engagement counters on posts.Post.
+
+`like_count` and `comment_count` are adjusted with F() expressions in the same
+transaction as the row that changes them, so concurrent writers never
+overwrite each other. `reconcile_counters` repairs any drift in batches.
+"""
+from django.db import transaction
+from django.db.models import Case, Count, F, OuterRef, Subquery, Value, When
+from django.db.models.functions import Coalesce, Greatest
+
+from .models import Comment, Like, Post
+
+COUNTER_FIELDS = ("like_count", "comment_count")
+
+
+def increment(post_id, field, amount=1):
+    Post.objects.filter(pk=post_id).update(**{field: F(field) + amount})
+
+
+def decrement(post_id, field, amount=1):
+    # Never go below zero, even if the counter had already drifted
+    Post.objects.filter(pk=post_id, **{f"{field}__gte": amount}).update(**{field: F(field) - amount})
+
+
+def decrement_many(field, amounts):
+    """
+    Lower `field` by `{post_id: amount}` in a single UPDATE, never below zero.
+    """
+    if not amounts:
+        return
+    Post.objects.filter(pk__in=amounts).update(**{
+        field: Greatest(
+            F(field) - Case(
+                *[When(pk=post_id, then=Value(amount)) for post_id, amount in amounts.items()],
+                default=Value(0),
+            ),
+            Value(0),
+        )
+    })
+
+
+def _actual_counts(model, post_ids):
+    return dict(
+        model.objects.filter(post_id__in=post_ids)
+        .order_by()
+        .values("post_id")
+        .annotate(total=Count("id"))
+        .values_list("post_id", "total")
+    )
+
+
+def _count_subquery(model):
+    counts = (
+        model.objects.filter(post=OuterRef("pk"))
+        .order_by()
+        .values("post")
+        .annotate(total=Count("id"))
+        .values("total")
+    )
+    return Coalesce(Subquery(counts), 0)
+
+
+def reconcile_counters(batch_size=500, stdout=None):
+    """
+    Recount likes and comments for every post and fix the rows that drifted.
+
+    Posts are walked in primary key order, one short transaction per batch,
+    so no lock is held for longer than a single batch. Returns the number of
+    posts repaired.
+    """
+    repaired = 0
+    last_pk = 0
+    while True:
+        with transaction.atomic():
+            batch = list(
+                Post.objects.filter(pk__gt=last_pk)
+                .order_by("pk")
+                .values_list("pk", *COUNTER_FIELDS)[:batch_size]
+            )
+            if not batch:
+                break
+            post_ids = [row[0] for row in batch]
+            likes = _actual_counts(Like, post_ids)
+            comments = _actual_counts(Comment, post_ids)
+
+            drifted = [
+                pk for pk, like_count, comment_count in batch
+                if (like_count, comment_count) != (likes.get(pk, 0), comments.get(pk, 0))
+            ]
+            if drifted:
+                # Recount inside the UPDATE itself so writes racing with the check are not lost
+                Post.objects.filter(pk__in=drifted).update(
+                    like_count=_count_subquery(Like),
+                    comment_count=_count_subquery(Comment),
+                )
+                repaired += len(drifted)
+        last_pk = post_ids[-1]
+        if stdout is not None:
+            stdout.write(f"Checked posts up to id {last_pk}, {repaired} repaired so far.")
+    return repaired
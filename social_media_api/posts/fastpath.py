@@ -0,0 +1,151 @@
+"""
+Read-only serialization fast path.
+
+DRF's Serializer.to_representation resolves every field of every row through
+the generic Field.get_attribute()/to_representation() machinery. FastReadMixin
+compiles a serializer's readable fields once per serializer instance into
+plain accessors - ids, counters, text, timestamps, foreign key ids and
+method fields - and leaves every other field to its own methods. The
+resulting dicts are the same, key for key, so the rendered JSON does not
+change.
+
+API_FAST_SERIALIZATION = False switches back to the stock DRF path.
+"""
+from operator import attrgetter
+
+from django.conf import settings
+from django.core.exceptions import FieldDoesNotExist
+from django.db import models
+from django.utils import timezone
+from rest_framework import ISO_8601, fields, relations
+from rest_framework.fields import SkipField
+from rest_framework.relations import PKOnlyObject
+from rest_framework.settings import api_settings
+
+# Field classes whose to_representation is a plain type conversion
+_CONVERTERS = {
+    fields.IntegerField: int,
+    fields.CharField: str,
+}
+
+
+def fast_read_enabled():
+    return getattr(settings, 'API_FAST_SERIALIZATION', True)
+
+
+def _concrete_path(model, attrs):
+    """
+    Whether `attrs` walks forward foreign keys of `model` to a concrete,
+    non-relational column, so plain attribute access matches DRF's lookup.
+    """
+    for index, attr in enumerate(attrs):
+        try:
+            field = model._meta.get_field(attr)
+        except FieldDoesNotExist:
+            return False
+        if index == len(attrs) - 1:
+            return field.concrete and not field.is_relation
+        if not (field.many_to_one or field.one_to_one) or not field.concrete:
+            return False
+        model = field.related_model
+    return False
+
+
+def _reader(attrs):
+    if len(attrs) == 1:
+        return attrgetter(attrs[0])
+
+    def read(instance):
+        for attr in attrs:
+            if instance is None:
+                return None
+            instance = getattr(instance, attr)
+        return instance
+    return read
+
+
+def _identity(value):
+    return value
+
+
+def _datetime_converter(field):
+    """
+    DateTimeField.to_representation for ISO 8601 output, with the output
+    timezone resolved once instead of once per value. Returns None when the
+    field is configured in a way this does not cover.
+    """
+    output_format = getattr(field, 'format', api_settings.DATETIME_FORMAT)
+    field_timezone = field.timezone if hasattr(field, 'timezone') else field.default_timezone()
+    if output_format is None or output_format.lower() != ISO_8601 or field_timezone is None:
+        return None
+
+    def convert(value):
+        if isinstance(value, str) or timezone.is_naive(value):
+            return field.to_representation(value)
+        value = value.astimezone(field_timezone).isoformat()
+        if value.endswith('+00:00'):
+            value = value[:-6] + 'Z'
+        return value
+    return convert
+
+
+def compile_readers(serializer, model):
+    """
+    Return `(name, read, convert)` per readable field. `read` is None for
+    fields left to DRF, in which case `convert` is the field itself.
+    """
+    readers = []
+    for field in serializer._readable_fields:
+        kind = type(field)
+        attrs = field.source_attrs
+        simple_column = bool(attrs) and _concrete_path(model, attrs)
+        to_datetime = simple_column and kind is fields.DateTimeField and _datetime_converter(field)
+        if kind is fields.SerializerMethodField:
+            readers.append((field.field_name, _identity, getattr(serializer, field.method_name)))
+        elif (kind is relations.PrimaryKeyRelatedField and field.pk_field is None
+              and len(attrs) == 1 and _is_forward_relation(model, attrs[0])):
+            attname = model._meta.get_field(attrs[0]).attname
+            readers.append((field.field_name, attrgetter(attname), _identity))
+        elif simple_column and kind in _CONVERTERS:
+            readers.append((field.field_name, _reader(attrs), _CONVERTERS[kind]))
+        elif to_datetime:
+            readers.append((field.field_name, _reader(attrs), to_datetime))
+        else:
+            readers.append((field.field_name, None, field))
+    return readers
+
+
+def _is_forward_relation(model, attr):
+    try:
+        field = model._meta.get_field(attr)
+    except FieldDoesNotExist:
+        return False
+    return field.concrete and (field.many_to_one or field.one_to_one)
+
+
+class FastReadMixin:
+    """
+    ModelSerializer mixin rendering model instances through compiled readers.
+    """
+
+    def to_representation(self, instance):
+        if not isinstance(instance, models.Model) or not fast_read_enabled():
+            return super().to_representation(instance)
+        readers = self.__dict__.get('_fast_readers')
+        if readers is None:
+            readers = self._fast_readers = compile_readers(self, type(instance))
+
+        ret = {}
+        for name, read, convert in readers:
+            if read is None:
+                # Same steps as Serializer.to_representation
+                try:
+                    attribute = convert.get_attribute(instance)
+                except SkipField:
+                    continue
+                check_for_none = attribute.pk if isinstance(attribute, PKOnlyObject) else attribute
+                ret[name] = None if check_for_none is None else convert.to_representation(attribute)
+            else:
+                value = read(instance)
+                ret[name] = None if value is None else convert(value)
+        return ret
@@ -0,0 +1,81 @@
+"""
+Sparse fieldsets (`?fields=`) and opt-in expansion (`?expand=`) for the API.
+
+`?fields=id,title,comments.content` keeps only the listed fields; a dotted
+name selects fields of a nested serializer. `?expand=author` adds the
+fields a serializer lists in `Meta.expandable_fields`. Both only apply to
+safe (read) requests so writes always see the full serializer.
+
+Views mixing in SparseFieldsViewMixin can ask `wants(name)` before building
+their queryset, so relations nobody asked for are never joined or prefetched.
+"""
+from rest_framework import permissions
+from rest_framework.serializers import ListSerializer
+
+
+def parse_field_spec(value):
+    """
+    Turn "a,b.c,b.d" into {'a': {}, 'b': {'c': {}, 'd': {}}}.
+    """
+    spec = {}
+    for name in (value or '').split(','):
+        parts = [part.strip() for part in name.split('.') if part.strip()]
+        node = spec
+        for part in parts:
+            node = node.setdefault(part, {})
+    return spec
+
+
+def _requested(context, param):
+    request = context.get('request')
+    if request is None or request.method not in permissions.SAFE_METHODS:
+        return None
+    value = request.query_params.get(param)
+    return parse_field_spec(value) if value else None
+
+
+def prune_fields(serializer, spec):
+    """
+    Drop every field of `serializer` that `spec` does not name, recursing
+    into nested serializers for dotted names.
+    """
+    if isinstance(serializer, ListSerializer):
+        serializer = serializer.child
+    for name in list(serializer.fields):
+        if name not in spec:
+            serializer.fields.pop(name)
+        elif spec[name]:
+            nested = serializer.fields[name]
+            if hasattr(nested, 'fields') or isinstance(nested, ListSerializer):
+                prune_fields(nested, spec[name])
+
+
+class DynamicFieldsMixin:
+    """
+    Serializer mixin applying `?fields=` and `?expand=` from the request.
+
+    `Meta.expandable_fields` maps a name to a zero-argument callable that
+    returns the field to add when the name is in `?expand=`.
+    """
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        expand = _requested(self.context, 'expand') or {}
+        for name, factory in getattr(self.Meta, 'expandable_fields', {}).items():
+            if name in expand:
+                self.fields[name] = factory()
+        fields = _requested(self.context, 'fields')
+        if fields:
+            # Expanded fields are kept even when not listed in ?fields=
+            prune_fields(self, {**{name: {} for name in expand}, **fields})
+
+
+class SparseFieldsViewMixin:
+    """
+    View mixin exposing the pruned field tree before any queryset work.
+    """
+
+    def wants(self, *names):
+        if not hasattr(self, '_wanted_fields'):
+            self._wanted_fields = set(self.get_serializer().fields)
+        return any(name in self._wanted_fields for name in names)
@@ -0,0 +1,140 @@
+"""
+Hashtags parsed from post content.
+
+Each post's tags are kept in PostHashtag, a posting list indexed by
+(hashtag, created_at), so a tag's posts are a range scan rather than a
+`LIKE '%#tag%'` over every post. Hashtag.post_count and the time-bucketed
+HashtagActivity counts are adjusted with F() updates as tags are added or
+removed, so trending tags are read from a handful of small rows instead of
+being recounted.
+"""
+import re
+from datetime import timedelta
+
+from django.db import transaction
+from django.db.models import F, Q, Sum
+from django.utils import timezone
+
+from .models import Hashtag, HashtagActivity, PostHashtag
+from .trending import WINDOWS
+
+# A "#" not preceded by a word character, followed by up to 100 word characters
+HASHTAG_PATTERN = re.compile(r"(?<![\w#])#(\w{1,100})\b")
+BUCKET_MINUTES = 5
+
+
+def normalize(tag):
+    return tag.lstrip("#").casefold()
+
+
+def extract_hashtags(text):
+    """
+    Return the distinct normalized hashtags of `text`, in order of appearance.
+    """
+    return list(dict.fromkeys(normalize(tag) for tag in HASHTAG_PATTERN.findall(text or "")))
+
+
+def bucket_start(moment):
+    return moment.replace(minute=moment.minute - moment.minute % BUCKET_MINUTES, second=0, microsecond=0)
+
+
+def sync_post_hashtags(posts, count_activity=True):
+    """
+    Bring the posting lists of `posts` in line with their content. With
+    `count_activity` off, new links do not count towards trending tags.
+
+    The current links are read in one query and changes are written with
+    bulk statements; counter updates take one statement per distinct amount,
+    which is a single one for a post saved on its own.
+    """
+    wanted = {post.pk: set(extract_hashtags(post.content)) for post in posts}
+    created_at = {post.pk: post.created_at for post in posts}
+    current = {}
+    for post_id, name in PostHashtag.objects.filter(post_id__in=wanted).values_list("post_id", "hashtag__name"):
+        current.setdefault(post_id, set()).add(name)
+
+    added = [(post_id, name) for post_id, names in wanted.items() for name in names - current.get(post_id, set())]
+    removed = [(post_id, name) for post_id, names in current.items() for name in names - wanted[post_id]]
+    if not added and not removed:
+        return
+
+    names = {name for _, name in added} | {name for _, name in removed}
+    with transaction.atomic():
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+        tag_ids = dict(Hashtag.objects.filter(name__in=names).values_list("name", "id"))
+
+        if added:
+            PostHashtag.objects.bulk_create([
+                PostHashtag(hashtag_id=tag_ids[name], post_id=post_id, created_at=created_at[post_id])
+                for post_id, name in added
+            ], ignore_conflicts=True)
+            bucket = bucket_start(timezone.now())
+            if count_activity:
+                HashtagActivity.objects.bulk_create(
+                    [HashtagActivity(hashtag_id=tag_ids[name], bucket=bucket) for name in {name for _, name in added}],
+                    ignore_conflicts=True,
+                )
+            for amount, ids in _tags_by_amount(added, tag_ids):
+                Hashtag.objects.filter(pk__in=ids).update(post_count=F("post_count") + amount)
+                if count_activity:
+                    HashtagActivity.objects.filter(hashtag_id__in=ids, bucket=bucket).update(uses=F("uses") + amount)
+        if removed:
+            links = Q()
+            for post_id, name in removed:
+                links |= Q(post_id=post_id, hashtag_id=tag_ids[name])
+            PostHashtag.objects.filter(links).delete()
+            for amount, ids in _tags_by_amount(removed, tag_ids):
+                # Never go below zero, even if the counter had already drifted
+                Hashtag.objects.filter(pk__in=ids, post_count__gte=amount).update(post_count=F("post_count") - amount)
+
+
+def _tags_by_amount(pairs, tag_ids):
+    """
+    Group `(post_id, name)` pairs into `(amount, [tag_id, ...])`, so every tag
+    that changes by the same amount is updated in one statement.
+    """
+    amounts = {}
+    for _, name in pairs:
+        amounts[tag_ids[name]] = amounts.get(tag_ids[name], 0) + 1
+    grouped = {}
+    for tag_id, amount in amounts.items():
+        grouped.setdefault(amount, []).append(tag_id)
+    return grouped.items()
+
+
+def forget_post_hashtags(post):
+    """
+    Release the tags of a post that is about to be deleted.
+    """
+    tag_ids = list(PostHashtag.objects.filter(post=post).values_list("hashtag_id", flat=True))
+    if tag_ids:
+        Hashtag.objects.filter(pk__in=tag_ids, post_count__gt=0).update(post_count=F("post_count") - 1)
+
+
+def prune_activity(now=None):
+    """
+    Delete activity buckets older than the longest trending window. Returns
+    the number of rows removed.
+    """
+    cutoff = bucket_start((now or timezone.now()) - timedelta(minutes=max(WINDOWS.values())))
+    deleted, _ = HashtagActivity.objects.filter(bucket__lt=cutoff).delete()
+    return deleted
+
+
+def trending_hashtags(window, limit, now=None):
+    """
+    Return `{'name', 'uses', 'post_count'}` for the tags used by the most new
+    posts in the last `window`, summed over at most one bucket row per tag
+    and bucket.
+    """
+    since = bucket_start((now or timezone.now()) - timedelta(minutes=WINDOWS[window] - BUCKET_MINUTES))
+    rows = (
+        HashtagActivity.objects.filter(bucket__gte=since)
+        .values("hashtag__name", "hashtag__post_count")
+        .annotate(uses=Sum("uses"))
+        .order_by("-uses", "hashtag__name")[:limit]
+    )
+    return [
+        {"name": row["hashtag__name"], "uses": row["uses"], "post_count": row["hashtag__post_count"]}
+        for row in rows
+    ]
@@ -0,0 +1,184 @@
+"""
+Streaming NDJSON import of posts.
+
+Each input line is a JSON object with `title`, `content`, an optional
+`author` username (defaults to the importing user) and an optional ISO 8601
+`created_at`. Lines are consumed one chunk at a time: parsed, checked with
+PostSerializer's validation rules, authors resolved with one query per chunk
+and the posts written with bulk_create in one transaction per chunk. Memory
+use depends on the chunk size, not on the size of the input.
+
+bulk_create skips post_save, so the search index, hashtags, follower
+timelines and the sync change log are updated here in batch. Imported posts do not notify mentioned
+users: they are old content, not new activity.
+
+A line that fails only adds an entry to the report, and the import goes on.
+"""
+import json
+import time
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db import DatabaseError, transaction
+from rest_framework import serializers
+
+from . import changelog, search
+from .hashtags import sync_post_hashtags
+from .models import Post
+from .serializers import PostSerializer
+from .timeline import fan_out_posts
+
+
+def _chunk_size():
+    return getattr(settings, "POST_IMPORT_CHUNK_SIZE", 500)
+
+
+def _max_errors():
+    return getattr(settings, "POST_IMPORT_MAX_ERRORS", 1000)
+
+
+class ImportReport:
+    """
+    Running totals of an import. Only the first `max_errors` line errors are
+    kept; `failed` counts all of them.
+    """
+
+    def __init__(self, max_errors=None):
+        self.max_errors = _max_errors() if max_errors is None else max_errors
+        self.lines = 0
+        self.imported = 0
+        self.failed = 0
+        self.errors = []
+        self.started = time.perf_counter()
+
+    def fail(self, line, errors):
+        self.failed += 1
+        if len(self.errors) < self.max_errors:
+            self.errors.append({"line": line, "errors": errors})
+
+    @property
+    def seconds(self):
+        return time.perf_counter() - self.started
+
+    @property
+    def posts_per_second(self):
+        seconds = self.seconds
+        return self.imported / seconds if seconds else 0.0
+
+    def as_dict(self):
+        return {
+            "lines": self.lines,
+            "imported": self.imported,
+            "failed": self.failed,
+            "seconds": round(self.seconds, 3),
+            "posts_per_second": round(self.posts_per_second, 1),
+            "errors": self.errors,
+            "errors_truncated": self.failed > len(self.errors),
+        }
+
+
+def import_posts(lines, default_author=None, chunk_size=None, report=None, on_chunk=None):
+    """
+    Import posts from an iterable of NDJSON lines (bytes or str).
+
+    `on_chunk(report)` is called after every chunk, e.g. to print progress.
+    Returns the ImportReport.
+    """
+    chunk_size = chunk_size or _chunk_size()
+    report = report or ImportReport()
+    validator = PostSerializer()
+    chunk = []
+    for number, line in enumerate(lines, start=1):
+        if not line.strip():
+            continue
+        report.lines += 1
+        chunk.append((number, line))
+        if len(chunk) >= chunk_size:
+            _import_chunk(chunk, default_author, validator, report)
+            chunk = []
+            if on_chunk is not None:
+                on_chunk(report)
+    if chunk:
+        _import_chunk(chunk, default_author, validator, report)
+        if on_chunk is not None:
+            on_chunk(report)
+    return report
+
+
+def _parse(chunk, report):
+    rows = []
+    for number, line in chunk:
+        try:
+            data = json.loads(line)
+        except ValueError as exc:
+            report.fail(number, {"non_field_errors": [f"Invalid JSON: {exc}"]})
+            continue
+        if not isinstance(data, dict):
+            report.fail(number, {"non_field_errors": ["Each line must be a JSON object."]})
+            continue
+        rows.append((number, data))
+    return rows
+
+
+def _import_chunk(chunk, default_author, validator, report):
+    rows = _parse(chunk, report)
+    usernames = {data["author"] for _, data in rows if isinstance(data.get("author"), str)}
+    authors = dict(
+        get_user_model().objects.filter(username__in=usernames).values_list("username", "id")
+    ) if usernames else {}
+
+    created_at_field = serializers.DateTimeField()
+    posts = []
+    numbers = []
+    for number, data in rows:
+        if "author" in data:
+            if not isinstance(data["author"], str):
+                report.fail(number, {"author": ["Must be a username."]})
+                continue
+            author_id = authors.get(data["author"])
+            if author_id is None:
+                report.fail(number, {"author": ["No user with this username."]})
+                continue
+        elif default_author is not None:
+            author_id = default_author.pk
+        else:
+            report.fail(number, {"author": ["This field is required."]})
+            continue
+        try:
+            validated = validator.run_validation(data)
+            created_at = created_at_field.run_validation(data["created_at"]) if data.get("created_at") else None
+        except serializers.ValidationError as exc:
+            detail = exc.detail if isinstance(exc.detail, dict) else {"created_at": exc.detail}
+            report.fail(number, detail)
+            continue
+        post = Post(author_id=author_id, **validated)
+        post.imported_created_at = created_at
+        posts.append(post)
+        numbers.append(number)
+
+    if not posts:
+        return
+    try:
+        with transaction.atomic():
+            _write(posts)
+    except DatabaseError as exc:
+        for number in numbers:
+            report.fail(number, {"non_field_errors": [f"Could not be written: {exc}"]})
+        return
+    report.imported += len(posts)
+
+
+def _write(posts):
+    Post.objects.bulk_create(posts)
+    # auto_now_add always stamps the insert time; put back the original dates
+    dated = [post for post in posts if post.imported_created_at is not None]
+    for post in dated:
+        post.created_at = post.updated_at = post.imported_created_at
+    if dated:
+        Post.objects.bulk_update(dated, ["created_at", "updated_at"])
+
+    search.index_posts(posts)
+    changelog.record_many(changelog.POST, changelog.UPSERT, [(post.author_id, post.pk) for post in posts])
+    # Old content is not a sign of what is trending now
+    sync_post_hashtags(posts, count_activity=False)
+    fan_out_posts(posts)
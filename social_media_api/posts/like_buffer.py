@@ -0,0 +1,116 @@
+"""
+Write-behind buffer for likes.
+
+When LIKE_WRITE_BEHIND is enabled, LikePostView and UnlikePostView record an
+intent here instead of touching the database. Intents are deduplicated per
+(user, post), the last one winning, and flushed in one transaction when the
+buffer reaches LIKE_BUFFER_MAX_SIZE or every LIKE_BUFFER_FLUSH_INTERVAL
+seconds.
+
+The buffer lives in the worker process: a user's own like state is
+read-your-writes consistent for requests served by the same process, which
+is what `state()` is for.
+"""
+import atexit
+import logging
+import threading
+
+from django.conf import settings
+from django.db import connection
+
+from . import metrics
+from .likes import LIKE, apply_intents
+
+logger = logging.getLogger(__name__)
+
+def write_behind_enabled():
+    return getattr(settings, "LIKE_WRITE_BEHIND", False)
+
+
+class LikeBuffer:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flush_lock = threading.Lock()
+        self._pending = {}
+        self._timer = None
+
+    def add(self, user_id, post_id, action):
+        with self._lock:
+            self._pending[(user_id, post_id)] = action
+            size = len(self._pending)
+            self._schedule()
+        metrics.incr(f"likes.buffer.{action}")
+        if size >= getattr(settings, "LIKE_BUFFER_MAX_SIZE", 500):
+            self._flush_quietly()
+
+    def state(self, user_id, post_id):
+        """
+        Return True/False if the user has a pending like/unlike for the post,
+        or None if the database is authoritative.
+        """
+        with self._lock:
+            action = self._pending.get((user_id, post_id))
+        return None if action is None else action == LIKE
+
+    def discard(self, user_id, post_ids):
+        """
+        Drop pending intents of the user for the given posts.
+        """
+        with self._lock:
+            for post_id in post_ids:
+                self._pending.pop((user_id, post_id), None)
+
+    def __len__(self):
+        with self._lock:
+            return len(self._pending)
+
+    def _schedule(self):
+        interval = getattr(settings, "LIKE_BUFFER_FLUSH_INTERVAL", 1.0)
+        if not interval or self._timer is not None:
+            return
+        self._timer = threading.Timer(interval, self._flush_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _flush_from_timer(self):
+        try:
+            self._flush_quietly()
+        finally:
+            connection.close()
+
+    def _flush_quietly(self):
+        try:
+            self.flush()
+        except Exception:
+            pass  # already logged; the intents stay buffered for the next flush
+
+    def flush(self):
+        """
+        Write every pending intent to the database. Returns the number of
+        intents applied.
+        """
+        with self._flush_lock:
+            with self._lock:
+                intents, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not intents:
+                return 0
+            try:
+                apply_intents(intents)
+            except Exception:
+                logger.exception("Failed to flush %d buffered like intents", len(intents))
+                with self._lock:
+                    # Put intents back unless a newer one arrived meanwhile
+                    for key, action in intents.items():
+                        self._pending.setdefault(key, action)
+                    self._schedule()
+                raise
+            metrics.incr("likes.buffer.flushes")
+            metrics.incr("likes.buffer.flushed_intents", len(intents))
+            return len(intents)
+
+
+like_buffer = LikeBuffer()
+atexit.register(like_buffer.flush)
@@ -0,0 +1,132 @@
+"""
+Bulk like/unlike writes shared by the write-behind buffer and the batch endpoint.
+"""
+from django.contrib.contenttypes.models import ContentType
+from django.db import IntegrityError, transaction
+from django.db.models import Case, F, Value, When
+from django.db.models.functions import Greatest
+
+from . import changelog
+from .models import Like, Post
+from .trending import record_like, record_unlikes
+from notifications.models import Notification
+
+LIKE = "like"
+UNLIKE = "unlike"
+
+# Per-intent outcomes returned by apply_intents
+LIKED = "liked"
+ALREADY_LIKED = "already_liked"
+UNLIKED = "unliked"
+NOT_LIKED = "not_liked"
+NOT_FOUND = "not_found"
+
+
+def _insert_likes(pairs):
+    """
+    Insert a like per `(user_id, post_id)` pair and return the pairs that
+    were written here. A pair liked meanwhile by a concurrent request fails
+    the whole INSERT; the pairs are then retried one by one so the ones
+    already present are left out instead of being counted twice.
+    """
+    try:
+        with transaction.atomic():
+            Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id) for user_id, post_id in pairs])
+        return pairs
+    except IntegrityError:
+        inserted = []
+        for user_id, post_id in pairs:
+            try:
+                with transaction.atomic():
+                    Like.objects.bulk_create([Like(user_id=user_id, post_id=post_id)])
+            except IntegrityError:
+                continue
+            inserted.append((user_id, post_id))
+        return inserted
+
+
+def apply_intents(intents):
+    """
+    Apply `{(user_id, post_id): LIKE | UNLIKE}` in one transaction.
+
+    Existing likes are looked up in one query, then new likes are inserted
+    with a single bulk_create, removed likes with a single DELETE, counters
+    with a single CASE update and notifications with a single bulk_create.
+    Counters, trending, the change log and notifications only see the likes
+    actually inserted. Returns `{(user_id, post_id): outcome}`.
+    """
+    post_ids = {post_id for _, post_id in intents}
+    user_ids = {user_id for user_id, _ in intents}
+
+    with transaction.atomic():
+        # Read inside the transaction so a post deleted meanwhile is not liked
+        authors = dict(Post.objects.filter(pk__in=post_ids).values_list("id", "author_id"))
+        existing = {
+            (user_id, post_id): (like_id, created_at)
+            for like_id, user_id, post_id, created_at in Like.objects.filter(
+                post_id__in=post_ids, user_id__in=user_ids
+            ).values_list("id", "user_id", "post_id", "created_at")
+        }
+
+        outcomes = {}
+        to_create = []
+        to_delete = {}
+        for key, action in intents.items():
+            if key[1] not in authors:
+                outcomes[key] = NOT_FOUND
+            elif action == LIKE:
+                if key in existing:
+                    outcomes[key] = ALREADY_LIKED
+                else:
+                    outcomes[key] = LIKED
+                    to_create.append(key)
+            elif key in existing:
+                outcomes[key] = UNLIKED
+                to_delete[key] = existing[key]
+            else:
+                outcomes[key] = NOT_LIKED
+
+        inserted = _insert_likes(to_create)
+        for key in set(to_create) - set(inserted):
+            outcomes[key] = ALREADY_LIKED
+        to_create = inserted
+        Like.objects.filter(pk__in=[like_id for like_id, _ in to_delete.values()]).delete()
+        # bulk_create skips post_save, so count trending likes and log the changes here
+        for _, post_id in to_create:
+            record_like(post_id)
+        record_unlikes([(post_id, created_at) for (_, post_id), (_, created_at) in to_delete.items()])
+        changelog.record_many(changelog.LIKE, changelog.UPSERT, to_create)
+        changelog.record_many(changelog.LIKE, changelog.DELETE, to_delete)
+
+        deltas = {}
+        for _, post_id in to_create:
+            deltas[post_id] = deltas.get(post_id, 0) + 1
+        for _, post_id in to_delete:
+            deltas[post_id] = deltas.get(post_id, 0) - 1
+        deltas = {post_id: delta for post_id, delta in deltas.items() if delta}
+        if deltas:
+            Post.objects.filter(pk__in=deltas).update(
+                like_count=Greatest(
+                    F("like_count") + Case(
+                        *[When(pk=post_id, then=Value(delta)) for post_id, delta in deltas.items()],
+                        default=Value(0),
+                    ),
+                    Value(0),
+                )
+            )
+
+        post_type = ContentType.objects.get_for_model(Post)
+        notifications = Notification.objects.bulk_create([
+            Notification(
+                recipient_id=authors[post_id],
+                actor_id=user_id,
+                verb="liked your post",
+                target_content_type=post_type,
+                target_object_id=post_id,
+            )
+            for user_id, post_id in to_create
+            if authors[post_id] != user_id
+        ])
+        changelog.record_many(changelog.NOTIFICATION, changelog.UPSERT,
+                              [(notification.recipient_id, notification.pk) for notification in notifications])
+    return outcomes
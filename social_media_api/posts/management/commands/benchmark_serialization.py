@@ -0,0 +1,69 @@
+import statistics
+import time
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+from django.test import override_settings
+from django.utils import timezone
+from rest_framework.renderers import JSONRenderer
+from rest_framework.request import Request
+from rest_framework.test import APIRequestFactory
+
+from posts.models import Comment, Post
+from posts.serializers import PostSerializer
+
+
+def make_page(size):
+    """
+    An in-memory page of `size` posts with a three-comment preview each,
+    shaped like a prefetched feed page; nothing touches the database.
+    """
+    author = get_user_model()(id=1, username="author")
+    created = timezone.now()
+    posts = []
+    for i in range(size):
+        post = Post(id=i + 1, author=author, title=f"Post {i}", content="..." * 20,
+                    created_at=created, updated_at=created, like_count=i, comment_count=3)
+        post.viewer_liked = bool(i % 2)
+        post.prefetched_comment_preview = [
+            Comment(id=i * 3 + j + 1, post=post, author=author, content=f"Comment {j}", path=f"{j:010d}",
+                    depth=0, created_at=created, updated_at=created)
+            for j in range(3)
+        ]
+        posts.append(post)
+    return posts
+
+
+def render_page(posts):
+    request = Request(APIRequestFactory().get("/posts/", {"comments": "preview"}))
+    request.user = get_user_model()(id=2, username="reader")
+    return JSONRenderer().render(PostSerializer(posts, many=True, context={"request": request}).data)
+
+
+class Command(BaseCommand):
+    help = "Time stock DRF against fast-path post serialization on pages of 10, 100 and 1000 posts."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[10, 100, 1000],
+                            help="Page sizes to render (default: 10 100 1000).")
+        parser.add_argument("--runs", type=int, default=7,
+                            help="Renders per page size and path; the median is reported (default: 7).")
+
+    def timed(self, posts, runs):
+        timings = []
+        for _ in range(runs):
+            started = time.perf_counter()
+            render_page(posts)
+            timings.append((time.perf_counter() - started) * 1000)
+        return statistics.median(timings)
+
+    def handle(self, *args, **options):
+        runs = max(options["runs"], 1)
+        self.stdout.write(f"{'posts':>6} {'stock ms':>10} {'fast ms':>10} {'speedup':>8}")
+        for size in options["sizes"]:
+            posts = make_page(size)
+            with override_settings(API_FAST_SERIALIZATION=False):
+                stock = self.timed(posts, runs)
+            with override_settings(API_FAST_SERIALIZATION=True):
+                fast = self.timed(posts, runs)
+            self.stdout.write(f"{size:>6} {stock:>10.2f} {fast:>10.2f} {stock / fast:>7.1f}x")
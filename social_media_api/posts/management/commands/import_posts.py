@@ -0,0 +1,50 @@
+import sys
+
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand, CommandError
+
+from posts.importer import import_posts
+
+
+class Command(BaseCommand):
+    help = "Import posts from an NDJSON file (one JSON object per line), streamed in chunks."
+
+    def add_arguments(self, parser):
+        parser.add_argument("path", help="NDJSON file to read, or - for standard input.")
+        parser.add_argument("--author", help="Username for lines without an author.")
+        parser.add_argument("--chunk-size", type=int, default=None,
+                            help="Lines per transaction (default: POST_IMPORT_CHUNK_SIZE).")
+
+    def handle(self, *args, **options):
+        author = None
+        if options["author"]:
+            try:
+                author = get_user_model().objects.get(username=options["author"])
+            except get_user_model().DoesNotExist:
+                raise CommandError(f"No user named {options['author']!r}.")
+
+        def progress(report):
+            if options["verbosity"] > 1:
+                self.stdout.write(
+                    f"{report.lines} lines read, {report.imported} imported, {report.failed} failed "
+                    f"({report.posts_per_second:.0f} posts/s)"
+                )
+
+        if options["path"] == "-":
+            report = import_posts(sys.stdin.buffer, author, options["chunk_size"], on_chunk=progress)
+        else:
+            try:
+                source = open(options["path"], "rb")
+            except OSError as exc:
+                raise CommandError(str(exc))
+            with source:
+                report = import_posts(source, author, options["chunk_size"], on_chunk=progress)
+
+        for error in report.errors:
+            self.stderr.write(f"Line {error['line']}: {error['errors']}")
+        if report.failed > len(report.errors):
+            self.stderr.write(f"... and {report.failed - len(report.errors)} more failed lines.")
+        self.stdout.write(self.style.SUCCESS(
+            f"Imported {report.imported} of {report.lines} posts in {report.seconds:.1f}s "
+            f"({report.posts_per_second:.0f} posts/s), {report.failed} failed."
+        ))
@@ -0,0 +1,15 @@
+from django.core.management.base import BaseCommand
+
+from posts.changelog import prune_changes
+
+
+class Command(BaseCommand):
+    help = "Delete change log rows older than SYNC_RETENTION_DAYS in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=1000,
+                            help="Rows deleted per transaction (default: 1000).")
+
+    def handle(self, *args, **options):
+        removed = prune_changes(batch_size=options["batch_size"])
+        self.stdout.write(self.style.SUCCESS(f"Pruned change log: {removed} rows removed."))
@@ -0,0 +1,11 @@
+from django.core.management.base import BaseCommand
+
+from posts.hashtags import prune_activity
+
+
+class Command(BaseCommand):
+    help = "Delete hashtag activity buckets that fell out of every trending window."
+
+    def handle(self, *args, **options):
+        deleted = prune_activity()
+        self.stdout.write(self.style.SUCCESS(f"Pruned {deleted} hashtag activity rows."))
@@ -0,0 +1,14 @@
+from django.core.management.base import BaseCommand
+
+from posts.search import rebuild_index, search_available
+
+
+class Command(BaseCommand):
+    help = "Repopulate the full-text search index from all posts and comments."
+
+    def handle(self, *args, **options):
+        if not search_available():
+            self.stderr.write("Full-text search needs the SQLite backend; nothing to do.")
+            return
+        rebuild_index()
+        self.stdout.write(self.style.SUCCESS("Search index rebuilt."))
@@ -0,0 +1,20 @@
+from django.contrib.auth import get_user_model
+from django.core.management.base import BaseCommand
+
+from posts.timeline import rebuild_timelines
+
+
+class Command(BaseCommand):
+    help = "Rebuild every user's materialized home timeline from the follow graph."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--user", type=int, action="append", dest="user_ids",
+                            help="Only rebuild the timeline of this user id (repeatable).")
+
+    def handle(self, *args, **options):
+        users = get_user_model().objects.all()
+        if options["user_ids"]:
+            users = users.filter(pk__in=options["user_ids"])
+
+        written = rebuild_timelines(users)
+        self.stdout.write(self.style.SUCCESS(f"Rebuilt timelines: {written} entries written."))
@@ -0,0 +1,16 @@
+from django.core.management.base import BaseCommand
+
+from posts.counters import reconcile_counters
+
+
+class Command(BaseCommand):
+    help = "Recount likes and comments per post and repair drifted counters in small batches."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--batch-size", type=int, default=500,
+                            help="Posts checked per transaction (default: 500).")
+
+    def handle(self, *args, **options):
+        stdout = self.stdout if options["verbosity"] > 1 else None
+        repaired = reconcile_counters(batch_size=options["batch_size"], stdout=stdout)
+        self.stdout.write(self.style.SUCCESS(f"Reconciled post counters: {repaired} posts repaired."))
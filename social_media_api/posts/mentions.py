@@ -0,0 +1,37 @@
+"""
+@mentions in posts and comments.
+
+Mentioned usernames are resolved with a single `username__in` query and the
+notifications written with notifications.utils.create_notifications, so a
+post mentioning fifty people costs the same few queries as one mentioning one.
+"""
+import re
+
+from django.contrib.auth import get_user_model
+
+from notifications.utils import create_notifications
+
+# "@" not preceded by a word character; usernames may contain . + - but not end with them
+MENTION_PATTERN = re.compile(r"(?<![\w@])@(\w(?:[\w.+-]*\w)?)")
+POST_VERB = "mentioned you in a post"
+COMMENT_VERB = "mentioned you in a comment"
+
+
+def extract_mentions(text):
+    """
+    Return the distinct usernames mentioned in `text`, in order of appearance.
+    """
+    return list(dict.fromkeys(MENTION_PATTERN.findall(text or "")))
+
+
+def notify_mentions(actor, target, verb, text, previous_text=""):
+    """
+    Notify users mentioned in `text` but not already in `previous_text`.
+    Returns the created notifications.
+    """
+    usernames = set(extract_mentions(text)) - set(extract_mentions(previous_text))
+    usernames.discard(actor.username)
+    if not usernames:
+        return []
+    recipient_ids = get_user_model().objects.filter(username__in=usernames).values_list("id", flat=True)
+    return create_notifications(list(recipient_ids), actor, verb, target)
@@ -0,0 +1,59 @@
+"""
+Small in-process metrics registry for the feed.
+
+Counters and timings are kept per worker process and exposed through the
+staff-only `/api/feed/metrics/` endpoint so thresholds can be tuned against
+real traffic without an external metrics backend.
+"""
+import threading
+from collections import OrderedDict, defaultdict
+
+MAX_TRACKED_AUTHORS = 10000
+
+_lock = threading.Lock()
+_counters = defaultdict(int)
+_timings = {}
+_author_modes = OrderedDict()
+
+
+def incr(name, value=1):
+    with _lock:
+        _counters[name] += value
+
+
+def observe(name, milliseconds):
+    with _lock:
+        timing = _timings.setdefault(name, {'count': 0, 'total_ms': 0.0, 'max_ms': 0.0})
+        timing['count'] += 1
+        timing['total_ms'] += milliseconds
+        timing['max_ms'] = max(timing['max_ms'], milliseconds)
+
+
+def record_author_mode(author_id, mode, follower_count):
+    """
+    Remember the last fan-out decision taken for an author.
+    """
+    with _lock:
+        _author_modes[author_id] = {'mode': mode, 'followers': follower_count}
+        _author_modes.move_to_end(author_id)
+        while len(_author_modes) > MAX_TRACKED_AUTHORS:
+            _author_modes.popitem(last=False)
+
+
+def snapshot():
+    with _lock:
+        return {
+            'counters': dict(_counters),
+            'timings': {
+                name: dict(timing, avg_ms=timing['total_ms'] / timing['count'])
+                for name, timing in _timings.items()
+            },
+            'author_modes': {str(author_id): dict(mode) for author_id, mode in _author_modes.items()},
+        }
+
+
+def reset():
+    with _lock:
+        _counters.clear()
+        _timings.clear()
+        _author_modes.clear()
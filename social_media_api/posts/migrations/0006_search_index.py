@@ -0,0 +1,39 @@
+from django.db import migrations
+
+# Frozen copy of the SQL in posts.search at the time of this migration
+CREATE_TABLE_SQL = (
+    "CREATE VIRTUAL TABLE IF NOT EXISTS posts_search USING fts5("
+    "title, content, kind UNINDEXED, post_id UNINDEXED, author_id UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+BACKFILL_SQL = [
+    "INSERT INTO posts_search (rowid, title, content, kind, post_id, author_id) "
+    "SELECT id * 2, title, content, 'post', id, author_id FROM posts_post",
+    "INSERT INTO posts_search (rowid, title, content, kind, post_id, author_id) "
+    "SELECT id * 2 + 1, '', content, 'comment', post_id, author_id FROM posts_comment",
+]
+DROP_TABLE_SQL = "DROP TABLE IF EXISTS posts_search"
+
+
+def create_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor != "sqlite":
+        return
+    schema_editor.execute(CREATE_TABLE_SQL)
+    for sql in BACKFILL_SQL:
+        schema_editor.execute(sql)
+
+
+def drop_search_index(apps, schema_editor):
+    if schema_editor.connection.vendor == "sqlite":
+        schema_editor.execute(DROP_TABLE_SQL)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0005_post_engagement_counters'),
+    ]
+
+    operations = [
+        migrations.RunPython(create_search_index, drop_search_index),
+    ]
@@ -0,0 +1,42 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:35
+
+import django.db.models.deletion
+from django.conf import settings
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0008_comment_post_created_index'),
+        migrations.swappable_dependency(settings.AUTH_USER_MODEL),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='TrendingCount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('minute', models.DateTimeField()),
+                ('score', models.PositiveIntegerField(default=0)),
+                ('snapshot_at', models.DateTimeField()),
+            ],
+        ),
+        migrations.AddIndex(
+            model_name='like',
+            index=models.Index(fields=['created_at'], name='like_created_idx'),
+        ),
+        migrations.AddField(
+            model_name='trendingcount',
+            name='post',
+            field=models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='trending_counts', to='posts.post'),
+        ),
+        migrations.AddIndex(
+            model_name='trendingcount',
+            index=models.Index(fields=['minute'], name='trending_minute_idx'),
+        ),
+        migrations.AlterUniqueTogether(
+            name='trendingcount',
+            unique_together={('post', 'minute')},
+        ),
+    ]
@@ -0,0 +1,94 @@
+# Generated by Django 5.2.18 on 2026-10-18 18:38
+
+import re
+
+import django.db.models.deletion
+from django.db import migrations, models
+from django.db.models.functions import Coalesce
+
+# Frozen copy of posts.hashtags.HASHTAG_PATTERN at the time of this migration
+HASHTAG_PATTERN = re.compile(r"(?<![\w#])#(\w{1,100})\b")
+BATCH_SIZE = 500
+
+
+def extract_hashtags(text):
+    return list(dict.fromkeys(tag.casefold() for tag in HASHTAG_PATTERN.findall(text or '')))
+
+
+def backfill_hashtags(apps, schema_editor):
+    Post = apps.get_model('posts', 'Post')
+    Hashtag = apps.get_model('posts', 'Hashtag')
+    PostHashtag = apps.get_model('posts', 'PostHashtag')
+
+    # Walk the posts in pk order, one chunk in memory at a time
+    last_pk = 0
+    while True:
+        chunk = list(
+            Post.objects.filter(pk__gt=last_pk).order_by('pk')
+            .values_list('id', 'created_at', 'content')[:BATCH_SIZE]
+        )
+        if not chunk:
+            break
+        last_pk = chunk[-1][0]
+        tagged = [(post_id, created_at, extract_hashtags(content)) for post_id, created_at, content in chunk]
+        names = {name for _, _, tags in tagged for name in tags}
+        if not names:
+            continue
+        Hashtag.objects.bulk_create([Hashtag(name=name) for name in names], ignore_conflicts=True)
+        tag_ids = dict(Hashtag.objects.filter(name__in=names).values_list('name', 'id'))
+        PostHashtag.objects.bulk_create([
+            PostHashtag(hashtag_id=tag_ids[name], post_id=post_id, created_at=created_at)
+            for post_id, created_at, tags in tagged
+            for name in tags
+        ], batch_size=BATCH_SIZE)
+
+    links = (
+        PostHashtag.objects.filter(hashtag=models.OuterRef('pk'))
+        .order_by().values('hashtag').annotate(total=models.Count('id')).values('total')
+    )
+    Hashtag.objects.update(post_count=Coalesce(models.Subquery(links), 0))
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('posts', '0009_trending_counts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Hashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('name', models.CharField(max_length=100, unique=True)),
+                ('post_count', models.PositiveIntegerField(default=0)),
+            ],
+        ),
+        migrations.CreateModel(
+            name='HashtagActivity',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('bucket', models.DateTimeField()),
+                ('uses', models.PositiveIntegerField(default=0)),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='activity', to='posts.hashtag')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['bucket'], name='hashtag_activity_bucket_idx')],
+                'unique_together': {('hashtag', 'bucket')},
+            },
+        ),
+        migrations.CreateModel(
+            name='PostHashtag',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('created_at', models.DateTimeField()),
+                ('hashtag', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='post_links', to='posts.hashtag')),
+                ('post', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='hashtag_links', to='posts.post')),
+            ],
+            options={
+                'indexes': [models.Index(fields=['hashtag', '-created_at', '-post'], name='hashtag_posting_idx')],
+                'unique_together': {('hashtag', 'post')},
+            },
+        ),
+        migrations.RunPython(backfill_hashtags, migrations.RunPython.noop),
+    ]
@@ -4,26 +4,128 @@ from django.conf import settings
 # Create your models here.
 User = settings.AUTH_USER_MODEL
 
+
+def comment_preview_size():
+    return getattr(settings, "POST_COMMENT_PREVIEW_SIZE", 3)
+
+
+def comment_preview_prefetch():
+    """
+    Prefetch the latest comments of every post in a single windowed query.
+    """
+    latest = Comment.objects.select_related("author").order_by("-created_at", "-id")
+    return models.Prefetch("comments", queryset=latest[:comment_preview_size()], to_attr="prefetched_comment_preview")
+
+
+def comment_list_prefetch():
+    """
+    Prefetch every comment of each post, oldest first, with its author.
+    """
+    return models.Prefetch("comments", queryset=Comment.objects.select_related("author").order_by("created_at", "id"))
+
+
+class PostQuerySet(models.QuerySet):
+    def with_viewer_state(self, user):
+        """
+        Annotate `viewer_liked` (whether `user` likes each post) as an EXISTS
+        subquery, so the page is read in the same statement.
+        """
+        likes = Like.objects.filter(post=models.OuterRef("pk"), user=user)
+        return self.annotate(viewer_liked=models.Exists(likes))
+
+
+class CommentQuerySet(models.QuerySet):
+    def thread(self, post_id, root=None, max_depth=None):
+        """
+        Comments of a post in depth-first thread order, optionally limited to
+        the subtree under `root` and to `max_depth` levels below it.
+        """
+        comments = self.filter(post_id=post_id)
+        base_depth = 0
+        if root is not None:
+            # Every descendant path starts with the root path; "~" sorts after all digits
+            comments = comments.filter(path__gte=root.path, path__lt=root.path + "~")
+            base_depth = root.depth
+        if max_depth is not None:
+            comments = comments.filter(depth__lte=base_depth + max_depth)
+        return comments.order_by("path")
+
+
 class Post(models.Model):
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='posts')
     title = models.CharField(max_length=255)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Denormalized counters, kept in sync by posts.counters
+    like_count = models.PositiveIntegerField(default=0)
+    comment_count = models.PositiveIntegerField(default=0)
+
+    objects = PostQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="post_created_idx"),
+            models.Index(fields=["author", "-created_at", "-id"], name="post_author_created_idx"),
+        ]
 
     def __str__(self):
         return self.title
 
+    @property
+    def comment_preview(self):
+        """
+        The most recent comments, newest first, capped at POST_COMMENT_PREVIEW_SIZE.
+        """
+        if hasattr(self, "prefetched_comment_preview"):
+            return self.prefetched_comment_preview
+        return list(self.comments.select_related("author").order_by("-created_at", "-id")[:comment_preview_size()])
+
+# Width of one materialized path segment: a zero-padded comment id
+PATH_SEGMENT_WIDTH = 10
+
+
 class Comment(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name='comments')
     author = models.ForeignKey(User, on_delete=models.CASCADE, related_name='comments')
+    parent = models.ForeignKey('self', on_delete=models.CASCADE, related_name='replies', null=True, blank=True)
     content = models.TextField()
     created_at = models.DateTimeField(auto_now_add=True)
     updated_at = models.DateTimeField(auto_now=True)
+    # Materialized path: the ids of all ancestors and of the comment itself,
+    # so sorting by path yields a whole thread in depth-first order
+    path = models.CharField(max_length=255, blank=True, editable=False)
+    depth = models.PositiveSmallIntegerField(default=0, editable=False)
+
+    objects = CommentQuerySet.as_manager()
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["-created_at", "-id"], name="comment_created_idx"),
+            models.Index(fields=["post", "path"], name="comment_thread_idx"),
+            models.Index(fields=["post", "-created_at", "-id"], name="comment_post_created_idx"),
+        ]
 
     def __str__(self):
         return f'Comment by {self.author} on {self.post}'
 
+    def save(self, *args, **kwargs):
+        creating = self._state.adding
+        if creating and self.parent_id:
+            self.depth = self.parent.depth + 1
+        super().save(*args, **kwargs)
+        if creating and not self.path:
+            prefix = self.parent.path if self.parent_id else ""
+            self.path = prefix + str(self.pk).zfill(PATH_SEGMENT_WIDTH)
+            Comment.objects.filter(pk=self.pk).update(path=self.path)
+
+    def subtree(self, max_depth=None):
+        """
+        This comment and its descendants in thread order, as one range scan
+        over the (post, path) index.
+        """
+        return Comment.objects.thread(self.post_id, root=self, max_depth=max_depth)
+
 
 class Like(models.Model):
     post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="likes")
@@ -33,7 +135,124 @@ class Like(models.Model):
 
     class Meta:
         unique_together = ("post", "user") #Prevent duplicate likes
+        indexes = [
+            models.Index(fields=["created_at"], name="like_created_idx"),
+        ]
 
     def __str__(self):
         return f"{self.user.username} liked {self.post.id}"
-    
\ No newline at end of file
+    
+
+class TimelineEntry(models.Model):
+    """
+    Materialized home timeline row: `post` shows up in `user`'s feed.
+
+    `created_at` is copied from the post so the feed can be read as a range
+    scan over the reader's own rows without touching the posts table.
+    """
+    user = models.ForeignKey(settings.AUTH_USER_MODEL, on_delete=models.CASCADE, related_name="timeline_entries")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="timeline_entries")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("user", "post")
+        indexes = [
+            models.Index(fields=["user", "-created_at", "-post"], name="timeline_user_created_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} in timeline of {self.user_id}"
+
+
+class TrendingCount(models.Model):
+    """
+    Snapshot of one bucket of the in-process trending counters: the
+    engagement `score` of `post` during the minute starting at `minute`,
+    summed over every process, last added to at `snapshot_at`.
+    """
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="trending_counts")
+    minute = models.DateTimeField()
+    score = models.PositiveIntegerField(default=0)
+    snapshot_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("post", "minute")
+        indexes = [
+            models.Index(fields=["minute"], name="trending_minute_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} scored {self.score} at {self.minute}"
+
+
+class Hashtag(models.Model):
+    # Lower-cased tag without the leading "#"
+    name = models.CharField(max_length=100, unique=True)
+    # Posts currently carrying the tag, kept in sync by posts.hashtags
+    post_count = models.PositiveIntegerField(default=0)
+
+    def __str__(self):
+        return f"#{self.name}"
+
+
+class PostHashtag(models.Model):
+    """
+    Posting-list row: `post` carries `hashtag`.
+
+    `created_at` is copied from the post so a tag's posts can be paged as a
+    range scan over (hashtag, created_at) without touching the posts table.
+    """
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="post_links")
+    post = models.ForeignKey(Post, on_delete=models.CASCADE, related_name="hashtag_links")
+    created_at = models.DateTimeField()
+
+    class Meta:
+        unique_together = ("hashtag", "post")
+        indexes = [
+            models.Index(fields=["hashtag", "-created_at", "-post"], name="hashtag_posting_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.post_id} tagged #{self.hashtag_id}"
+
+
+class HashtagActivity(models.Model):
+    """
+    How many posts started using `hashtag` during the bucket starting at `bucket`.
+    """
+    hashtag = models.ForeignKey(Hashtag, on_delete=models.CASCADE, related_name="activity")
+    bucket = models.DateTimeField()
+    uses = models.PositiveIntegerField(default=0)
+
+    class Meta:
+        unique_together = ("hashtag", "bucket")
+        indexes = [
+            models.Index(fields=["bucket"], name="hashtag_activity_bucket_idx"),
+        ]
+
+    def __str__(self):
+        return f"#{self.hashtag_id} used {self.uses} times from {self.bucket}"
+
+
+class Change(models.Model):
+    """
+    Append-only log entry read by the sync endpoint, see posts.changelog:
+    object `object_id` of `kind` was created or changed (`upsert`) or deleted.
+
+    `owner_id` is the user whose synced data the change belongs to: the post
+    author for posts and their comments, the liking or following user, the
+    notification recipient. It is not a foreign key so the log outlives users.
+    """
+    kind = models.CharField(max_length=16)
+    op = models.CharField(max_length=8)
+    object_id = models.PositiveBigIntegerField()
+    owner_id = models.PositiveBigIntegerField()
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        indexes = [
+            models.Index(fields=["owner_id", "id"], name="change_owner_idx"),
+        ]
+
+    def __str__(self):
+        return f"{self.op} {self.kind} {self.object_id}"
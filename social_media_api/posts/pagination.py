@@ -0,0 +1,212 @@
+import base64
+import binascii
+import heapq
+import json
+import math
+from datetime import datetime
+
+from django.core.exceptions import ValidationError
+from django.db import models
+from django.db.models import Q
+from rest_framework.exceptions import NotFound
+from rest_framework.pagination import BasePagination
+from rest_framework.response import Response
+from rest_framework.settings import api_settings
+from rest_framework.utils.urls import replace_query_param
+
+
+class KeysetPagination(BasePagination):
+    """
+    Cursor pagination keyed on a unique, ordered tuple of fields.
+
+    Pages are selected with a `WHERE (created_at, id) < (...)` style predicate
+    instead of OFFSET, and no COUNT is ever issued, so the cost of a page does
+    not depend on how deep it is. Views can change the key by setting
+    `cursor_ordering`; every field in it must sort in the same direction.
+    """
+    page_size = api_settings.PAGE_SIZE
+    page_size_query_param = 'page_size'
+    max_page_size = 100
+    cursor_query_param = 'cursor'
+    ordering = ('-created_at', '-id')
+    invalid_cursor_message = 'Invalid cursor'
+    # How cursor values are read back, per ordering field; names ending in
+    # "_at" are datetimes. Views can add to it with `cursor_parsers`.
+    cursor_parsers = {'id': 'int', 'rowid': 'int', 'score': 'float'}
+
+    def paginate_queryset(self, queryset, request, view=None):
+        return self.paginate_querysets([queryset], request, view=view)
+
+    def paginate_querysets(self, querysets, request, view=None):
+        """
+        Paginate the k-way merge of several querysets that share the cursor
+        ordering. Each source is read with its own keyset predicate and LIMIT,
+        so the cost is O(k * page size); rows present in more than one source
+        (same pk) are returned once.
+        """
+        def fetch(position, reverse, limit):
+            ordering = self._reversed_ordering() if reverse else self.ordering
+            sources = []
+            for queryset in querysets:
+                queryset = queryset.order_by(*ordering)
+                if position is not None:
+                    queryset = queryset.filter(self._position_filter(position, reverse))
+                sources.append(list(queryset[:limit]))
+            self.rows_fetched = sum(len(source) for source in sources)
+            if len(sources) == 1:
+                return sources[0]
+            return self._merge(sources, limit, descending=ordering[0].startswith('-'))
+
+        return self.paginate_rows(fetch, request, view=view)
+
+    def paginate_rows(self, fetch, request, view=None):
+        """
+        Paginate rows produced by `fetch(position, reverse, limit)`.
+
+        `fetch` must return up to `limit` rows strictly after `position` (or
+        from the start when it is None) in the cursor ordering, reversed when
+        `reverse` is true. Rows must expose the ordering fields as attributes.
+        """
+        self.request = request
+        self.ordering = tuple(getattr(view, 'cursor_ordering', self.ordering))
+        self.parsers = {**self.cursor_parsers, **getattr(view, 'cursor_parsers', {})}
+        self.page_size = self.get_page_size(request)
+        self.base_url = request.build_absolute_uri()
+
+        position, reverse = self.decode_cursor(request)
+        self.has_cursor = position is not None
+
+        # Fetch one extra row to find out whether there is another page
+        results = list(fetch(position, reverse, self.page_size + 1))
+        has_more = len(results) > self.page_size
+        results = results[:self.page_size]
+        if reverse:
+            results.reverse()
+
+        self.page = results
+        if reverse:
+            self.has_next = self.has_cursor
+            self.has_previous = has_more
+        else:
+            self.has_next = has_more
+            self.has_previous = self.has_cursor
+        return results
+
+    def _merge(self, sources, limit, descending):
+        results = []
+        seen = set()
+        key = lambda obj: tuple(self.position_of(obj))
+        for obj in heapq.merge(*sources, key=key, reverse=descending):
+            if obj.pk in seen:
+                continue
+            seen.add(obj.pk)
+            results.append(obj)
+            if len(results) >= limit:
+                break
+        return results
+
+    def get_page_size(self, request):
+        if self.page_size_query_param:
+            try:
+                size = int(request.query_params[self.page_size_query_param])
+                if size > 0:
+                    return min(size, self.max_page_size)
+            except (KeyError, ValueError):
+                pass
+        return self.page_size
+
+    def get_paginated_response(self, data):
+        return Response({
+            'next': self.get_next_link(),
+            'previous': self.get_previous_link(),
+            'results': data,
+        })
+
+    def get_paginated_response_schema(self, schema):
+        return {
+            'type': 'object',
+            'required': ['results'],
+            'properties': {
+                'next': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'previous': {'type': 'string', 'nullable': True, 'format': 'uri'},
+                'results': schema,
+            },
+        }
+
+    def get_next_link(self):
+        if not self.has_next or not self.page:
+            return None
+        return self.encode_cursor(self.position_of(self.page[-1]), reverse=False)
+
+    def get_previous_link(self):
+        if not self.has_previous or not self.page:
+            return None
+        return self.encode_cursor(self.position_of(self.page[0]), reverse=True)
+
+    def position_of(self, obj):
+        """
+        Return the key values of `obj` for the configured ordering.
+        """
+        return [getattr(obj, field.lstrip('-')) for field in self.ordering]
+
+    def encode_cursor(self, position, reverse):
+        payload = {
+            'p': [value.isoformat() if isinstance(value, datetime) else value for value in position],
+            'r': int(reverse),
+        }
+        token = base64.urlsafe_b64encode(json.dumps(payload, separators=(',', ':')).encode()).decode()
+        return replace_query_param(self.base_url, self.cursor_query_param, token)
+
+    def decode_cursor(self, request):
+        token = request.query_params.get(self.cursor_query_param)
+        if not token:
+            return None, False
+        try:
+            payload = json.loads(base64.urlsafe_b64decode(token.encode()).decode())
+            position, reverse = payload['p'], bool(payload['r'])
+        except (TypeError, ValueError, KeyError, binascii.Error, UnicodeDecodeError):
+            raise NotFound(self.invalid_cursor_message)
+        if not isinstance(position, list) or len(position) != len(self.ordering):
+            raise NotFound(self.invalid_cursor_message)
+        try:
+            position = [self._parse_value(field.lstrip('-'), value) for field, value in zip(self.ordering, position)]
+        except (ValidationError, TypeError, ValueError):
+            raise NotFound(self.invalid_cursor_message)
+        return position, reverse
+
+    def _parse_value(self, name, value):
+        """
+        Check a decoded cursor value against the type of its ordering field.
+        """
+        if value is None or isinstance(value, (bool, list, dict)):
+            raise TypeError(f'Unexpected cursor value for {name}')
+        kind = 'datetime' if name.endswith('_at') else self.parsers.get(name)
+        if kind == 'datetime':
+            if not isinstance(value, str):
+                raise TypeError(f'Unexpected cursor value for {name}')
+            parsed = models.DateTimeField().to_python(value)
+            if parsed is None:
+                raise ValueError(f'Unexpected cursor value for {name}')
+            return parsed
+        if kind == 'int':
+            return int(value)
+        if kind == 'float':
+            parsed = float(value)
+            if not math.isfinite(parsed):
+                raise ValueError(f'Unexpected cursor value for {name}')
+            return parsed
+        return value
+
+    def _reversed_ordering(self):
+        return tuple(field[1:] if field.startswith('-') else f'-{field}' for field in self.ordering)
+
+    def _position_filter(self, position, reverse):
+        # Expands (a, b) < (x, y) into (a < x) OR (a = x AND b < y)
+        condition = Q()
+        for index, field in enumerate(self.ordering):
+            name = field.lstrip('-')
+            descending = field.startswith('-') != reverse
+            lookup = 'lt' if descending else 'gt'
+            equal = {self.ordering[i].lstrip('-'): position[i] for i in range(index)}
+            condition |= Q(**equal, **{f'{name}__{lookup}': position[index]})
+        return condition
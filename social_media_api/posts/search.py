@@ -0,0 +1,181 @@
+"""
+Full-text search over posts and comments backed by an SQLite FTS5 table.
+
+`posts_search` mirrors Post.title/content and Comment.content. Each document
+uses a rowid derived from its primary key (posts even, comments odd), so a
+row can be replaced or removed without a lookup. The index is kept in sync by
+the signal handlers registered in PostsConfig.ready().
+"""
+import re
+from types import SimpleNamespace
+
+from django.contrib.auth import get_user_model
+from django.db import connection
+from django.utils.html import escape
+
+SEARCH_TABLE = "posts_search"
+POST = "post"
+COMMENT = "comment"
+
+# bm25() weights, in column order: title, content
+TITLE_WEIGHT = 10.0
+CONTENT_WEIGHT = 1.0
+
+CREATE_TABLE_SQL = (
+    f"CREATE VIRTUAL TABLE IF NOT EXISTS {SEARCH_TABLE} USING fts5("
+    "title, content, kind UNINDEXED, post_id UNINDEXED, author_id UNINDEXED, "
+    "tokenize = 'unicode61 remove_diacritics 2')"
+)
+DROP_TABLE_SQL = f"DROP TABLE IF EXISTS {SEARCH_TABLE}"
+
+_TOKEN = re.compile(r"\w+\*?")
+
+# Private-use characters FTS5 wraps around matches; swapped for <b> tags
+# only after the user's text has been HTML-escaped
+HIGHLIGHT_START = "\ue000"
+HIGHLIGHT_END = "\ue001"
+
+
+def search_available(using=None):
+    return (using or connection).vendor == "sqlite"
+
+
+def post_rowid(post_id):
+    return post_id * 2
+
+
+def comment_rowid(comment_id):
+    return comment_id * 2 + 1
+
+
+def build_match_query(text):
+    """
+    Turn free text into an FTS5 query: every word must match, `word*` is a
+    prefix search. Quoting each token keeps FTS5 operators out of user input.
+    """
+    terms = []
+    for token in _TOKEN.findall(text):
+        prefix = token.endswith("*")
+        word = token.rstrip("*")
+        if word:
+            terms.append(f'"{word}"*' if prefix else f'"{word}"')
+    return " ".join(terms)
+
+
+def _replace(rowid, title, content, kind, post_id, author_id):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [rowid])
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, content, kind, post_id, author_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [rowid, title, content, kind, post_id, author_id],
+        )
+
+
+def _delete(rowid):
+    with connection.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [rowid])
+
+
+def index_post(post):
+    if search_available():
+        _replace(post_rowid(post.pk), post.title, post.content, POST, post.pk, post.author_id)
+
+
+def index_posts(posts):
+    """
+    Index many posts with two executemany() statements, for bulk writes that
+    skip the post_save signal.
+    """
+    if not search_available() or not posts:
+        return
+    with connection.cursor() as cursor:
+        cursor.executemany(f"DELETE FROM {SEARCH_TABLE} WHERE rowid = %s", [[post_rowid(post.pk)] for post in posts])
+        cursor.executemany(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, content, kind, post_id, author_id) "
+            "VALUES (%s, %s, %s, %s, %s, %s)",
+            [[post_rowid(post.pk), post.title, post.content, POST, post.pk, post.author_id] for post in posts],
+        )
+
+
+def index_comment(comment):
+    if search_available():
+        _replace(comment_rowid(comment.pk), "", comment.content, COMMENT, comment.post_id, comment.author_id)
+
+
+def unindex_post(post):
+    if search_available():
+        _delete(post_rowid(post.pk))
+
+
+def unindex_comments(comment_ids):
+    if search_available() and comment_ids:
+        rowids = [comment_rowid(comment_id) for comment_id in comment_ids]
+        with connection.cursor() as cursor:
+            cursor.execute(
+                f"DELETE FROM {SEARCH_TABLE} WHERE rowid IN ({', '.join(['%s'] * len(rowids))})", rowids
+            )
+
+
+def rebuild_index(using=None):
+    """
+    Repopulate the whole index from posts_post and posts_comment.
+    """
+    conn = using or connection
+    if not search_available(conn):
+        return
+    with conn.cursor() as cursor:
+        cursor.execute(f"DELETE FROM {SEARCH_TABLE}")
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, content, kind, post_id, author_id) "
+            f"SELECT id * 2, title, content, '{POST}', id, author_id FROM posts_post"
+        )
+        cursor.execute(
+            f"INSERT INTO {SEARCH_TABLE} (rowid, title, content, kind, post_id, author_id) "
+            f"SELECT id * 2 + 1, '', content, '{COMMENT}', post_id, author_id FROM posts_comment"
+        )
+
+
+def highlight(snippet):
+    """
+    HTML-escape an FTS5 snippet, then turn its match markers into <b> tags.
+    """
+    return escape(snippet or "").replace(HIGHLIGHT_START, "<b>").replace(HIGHLIGHT_END, "</b>")
+
+
+def search(match, position=None, reverse=False, limit=10, following_of=None):
+    """
+    Return up to `limit` hits for an FTS5 `match` query, best BM25 score
+    first, strictly after the `(score, rowid)` keyset `position`.
+
+    Hits only cover authors followed by `following_of` when it is given.
+    """
+    params = [match]
+    author_filter = ""
+    if following_of is not None:
+        follows = get_user_model().following.through._meta.db_table
+        author_filter = f"AND author_id IN (SELECT to_customuser_id FROM {follows} WHERE from_customuser_id = %s)"
+        params.append(following_of.pk)
+
+    keyset = ""
+    if position is not None:
+        # bm25() is lower for better matches, so "after" means a larger score
+        op = "<" if reverse else ">"
+        keyset = f"WHERE score {op} %s OR (score = %s AND rowid {op} %s)"
+        params += [position[0], position[0], position[1]]
+    direction = "DESC" if reverse else "ASC"
+    params.append(limit)
+
+    sql = (
+        "SELECT rowid, kind, post_id, score, snippet FROM ("
+        f"  SELECT rowid, kind, post_id, bm25({SEARCH_TABLE}, %s, %s) AS score,"
+        f"         snippet({SEARCH_TABLE}, -1, '{HIGHLIGHT_START}', '{HIGHLIGHT_END}', '…', 12) AS snippet"
+        f"  FROM {SEARCH_TABLE} WHERE {SEARCH_TABLE} MATCH %s {author_filter}"
+        f") {keyset} ORDER BY score {direction}, rowid {direction} LIMIT %s"
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [TITLE_WEIGHT, CONTENT_WEIGHT] + params)
+        return [
+            SimpleNamespace(rowid=rowid, kind=kind, post_id=post_id, score=score, snippet=highlight(snippet))
+            for rowid, kind, post_id, score, snippet in cursor.fetchall()
+        ]
@@ -1,7 +1,13 @@
 from rest_framework import serializers
 from .models import Post, Comment, Like
+from .like_buffer import like_buffer
+from .likes import LIKE, UNLIKE
 from django.conf import settings
 
+from accounts.serializers import UserSummarySerializer
+from .fastpath import FastReadMixin
+from .fields import DynamicFieldsMixin
+
 User = settings.AUTH_USER_MODEL
 
 class PostSerializer(serializers.ModelSerializer):
@@ -9,32 +15,111 @@ class PostSerializer(serializers.ModelSerializer):
         model = Post
         fields = '__all__'
 
-class CommentSerializer(serializers.ModelSerializer):
+class CommentSerializer(FastReadMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     author_username = serializers.CharField(source='author.username', read_only=True)
 
     class Meta:
         model = Comment
-        fields = ['id', 'post', 'author', 'author_username', 'content', 'created_at', 'updated_at']
-        read_only_fields = ['id', 'author', 'author_username', 'created_at', 'updated_at']
+        fields = ['id', 'post', 'parent', 'depth', 'author', 'author_username', 'content', 'created_at', 'updated_at']
+        read_only_fields = ['id', 'depth', 'author', 'author_username', 'created_at', 'updated_at']
+        # ?expand=author_profile embeds the author instead of just their id
+        expandable_fields = {
+            'author_profile': lambda: UserSummarySerializer(source='author', read_only=True),
+        }
+
+    def validate(self, attrs):
+        post = attrs.get('post', getattr(self.instance, 'post', None))
+        parent = attrs.get('parent', getattr(self.instance, 'parent', None))
+        if self.instance is not None:
+            # The path of a comment and its replies is fixed once written
+            if post != self.instance.post or parent != self.instance.parent:
+                raise serializers.ValidationError("A comment cannot be moved to another post or parent.")
+            return attrs
+        if parent is not None:
+            if parent.post_id != post.pk:
+                raise serializers.ValidationError({'parent': "Reply must belong to the same post."})
+            if parent.depth + 1 > getattr(settings, 'COMMENT_MAX_DEPTH', 20):
+                raise serializers.ValidationError({'parent': "This thread is too deep to reply to."})
+        return attrs
 
     def create(self, validated_data):
         user = self.context['request'].user
         validated_data['author'] = user
         return super().create(validated_data)
 
-class PostSerializer(serializers.ModelSerializer):
+def nest_comments(comments):
+    """
+    Assemble serialized comments, given in thread (path) order, into a tree.
+
+    Each comment gets a `replies` list. Comments whose parent is not in the
+    input become roots. Runs in linear time because parents always come
+    before their replies in path order.
+    """
+    nodes = {}
+    roots = []
+    for comment in comments:
+        node = {**comment, 'replies': []}
+        nodes[node['id']] = node
+        parent = nodes.get(node['parent'])
+        if parent is None:
+            roots.append(node)
+        else:
+            parent['replies'].append(node)
+    return roots
+
+
+def wants_comment_preview(request):
+    """
+    Whether the request asked for `?comments=preview`: only the latest
+    POST_COMMENT_PREVIEW_SIZE comments of each post instead of all of them.
+    """
+    return getattr(request, 'query_params', {}).get('comments') == 'preview'
+
+
+class PostSerializer(FastReadMixin, DynamicFieldsMixin, serializers.ModelSerializer):
     author_username = serializers.CharField(source="author.username", read_only=True)
     comments = CommentSerializer(many=True, read_only=True)
+    liked_by_me = serializers.SerializerMethodField()
 
     class Meta:
         model = Post
-        fields = ['id', 'author_username', 'title', 'content', 'created_at', 'updated_at', 'comments']
-        read_only_fields = ['id', 'author_username', 'created_at', 'updated_at']
+        fields = ['id', 'author_username', 'title', 'content', 'created_at', 'updated_at', 'comments',
+                  'like_count', 'comment_count', 'liked_by_me']
+        read_only_fields = ['id', 'author_username', 'created_at', 'updated_at', 'like_count', 'comment_count']
+        expandable_fields = {
+            'author_profile': lambda: UserSummarySerializer(source='author', read_only=True),
+        }
+
+    def get_fields(self):
+        fields = super().get_fields()
+        if wants_comment_preview(self.context.get('request')):
+            # Page through the rest via the comments endpoint
+            fields['comments'] = CommentSerializer(many=True, read_only=True, source='comment_preview')
+        return fields
+
+    def get_liked_by_me(self, obj):
+        request = self.context.get('request')
+        if request is None or not request.user.is_authenticated:
+            return False
+        # The viewer's own buffered likes win over what is stored
+        pending = like_buffer.state(request.user.pk, obj.pk)
+        if pending is not None:
+            return pending
+        if hasattr(obj, 'viewer_liked'):
+            return obj.viewer_liked
+        return obj.likes.filter(user=request.user).exists()
 
     def create(self, validated_data):
         user = self.context['request'].user
         validated_data['author'] = user
         return super().create(validated_data)
+
+    def update(self, instance, validated_data):
+        for attr, value in validated_data.items():
+            setattr(instance, attr, value)
+        # Save only the edited columns so concurrent counter updates are not overwritten
+        instance.save(update_fields=[*validated_data, 'updated_at'])
+        return instance
     
 class LikeSerializer(serializers.ModelSerializer):
     user = serializers.StringRelatedField(read_only=True)  # Shows username instead of ID
@@ -42,4 +127,19 @@ class LikeSerializer(serializers.ModelSerializer):
 
     class Meta:
         model = Like
-        fields = ['id', 'user', 'post', 'created_at'] 
\ No newline at end of file
+        fields = ['id', 'user', 'post', 'created_at']
+
+
+class LikeActionSerializer(serializers.Serializer):
+    post = serializers.IntegerField(min_value=1)
+    action = serializers.ChoiceField(choices=[LIKE, UNLIKE])
+
+
+class LikeBatchSerializer(serializers.Serializer):
+    actions = LikeActionSerializer(many=True, allow_empty=False)
+
+    def validate_actions(self, value):
+        limit = getattr(settings, 'LIKE_BATCH_MAX_ACTIONS', 100)
+        if len(value) > limit:
+            raise serializers.ValidationError(f"At most {limit} actions per batch.")
+        return value
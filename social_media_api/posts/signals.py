@@ -0,0 +1,102 @@
+from django.contrib.auth import get_user_model
+from django.db.models.signals import m2m_changed, post_delete, post_save, pre_delete
+from django.dispatch import receiver
+
+from notifications.models import Notification
+from notifications.utils import delete_target_notifications
+
+from . import changelog, hashtags, search, trending
+from .models import Comment, Like, Post
+
+Follow = get_user_model().following.through
+
+
+def _post_author_id(comment):
+    try:
+        return comment.post.author_id
+    except Post.DoesNotExist:
+        return None
+
+
+def forget_comments(comments):
+    """
+    Unindex, log and drop the notifications of the comments about to be
+    deleted, given as `(comment_id, post_author_id)` pairs.
+
+    Comments, likes and notifications have no delete receivers, which keeps
+    their bulk deletes at a few queries; code that deletes comments calls
+    this first.
+    """
+    comment_ids = [comment_id for comment_id, _ in comments]
+    search.unindex_comments(comment_ids)
+    delete_target_notifications(Comment, comment_ids)
+    changelog.record_many(changelog.COMMENT, changelog.DELETE,
+                          [(author_id, comment_id) for comment_id, author_id in comments])
+
+
+@receiver(post_save, sender=Post)
+def index_saved_post(sender, instance, update_fields=None, **kwargs):
+    search.index_post(instance)
+    if update_fields is None or 'content' in update_fields:
+        hashtags.sync_post_hashtags([instance])
+    changelog.record(changelog.POST, changelog.UPSERT, instance.author_id, instance.pk)
+
+
+@receiver(pre_delete, sender=Post)
+def release_post_hashtags(sender, instance, **kwargs):
+    # The posting-list rows go with the post, so adjust the tag counters first
+    hashtags.forget_post_hashtags(instance)
+
+
+@receiver(pre_delete, sender=Post)
+def log_cascaded_deletes(sender, instance, **kwargs):
+    # Comments and likes cascade with the post; log them in bulk, not per row
+    forget_comments([(comment_id, instance.author_id)
+                     for comment_id in instance.comments.values_list("pk", flat=True)])
+    changelog.record_many(changelog.LIKE, changelog.DELETE,
+                          [(user_id, instance.pk) for user_id in instance.likes.values_list("user_id", flat=True)])
+
+
+@receiver(post_delete, sender=Post)
+def unindex_deleted_post(sender, instance, **kwargs):
+    search.unindex_post(instance)
+    trending.trending_counters.forget(instance.pk)
+    delete_target_notifications(Post, [instance.pk])
+    changelog.record(changelog.POST, changelog.DELETE, instance.author_id, instance.pk)
+
+
+@receiver(post_save, sender=Comment)
+def index_saved_comment(sender, instance, created, **kwargs):
+    search.index_comment(instance)
+    if created:
+        trending.record_comment(instance.post_id)
+    author_id = _post_author_id(instance)
+    if author_id is not None:
+        changelog.record(changelog.COMMENT, changelog.UPSERT, author_id, instance.pk)
+
+
+@receiver(post_save, sender=Like)
+def count_trending_like(sender, instance, created, **kwargs):
+    if created:
+        trending.record_like(instance.post_id)
+        # A user likes a post at most once, so likes are keyed by post
+        changelog.record(changelog.LIKE, changelog.UPSERT, instance.user_id, instance.post_id)
+
+
+@receiver(m2m_changed, sender=Follow)
+def log_follow_changes(sender, instance, action, reverse, pk_set, **kwargs):
+    # Follows are keyed by the followed user; `reverse` means `instance` is the one followed
+    if action == "pre_clear":
+        pairs = (
+            Follow.objects.filter(to_customuser=instance) if reverse else Follow.objects.filter(from_customuser=instance)
+        ).values_list("from_customuser_id", "to_customuser_id")
+        changelog.record_many(changelog.FOLLOW, changelog.DELETE, list(pairs))
+    elif action in ("post_add", "post_remove") and pk_set:
+        op = changelog.UPSERT if action == "post_add" else changelog.DELETE
+        pairs = [(pk, instance.pk) if reverse else (instance.pk, pk) for pk in pk_set]
+        changelog.record_many(changelog.FOLLOW, op, pairs)
+
+
+@receiver(post_save, sender=Notification)
+def log_saved_notification(sender, instance, **kwargs):
+    changelog.record(changelog.NOTIFICATION, changelog.UPSERT, instance.recipient_id, instance.pk)
@@ -1,3 +1,1398 @@
-from django.test import TestCase
+import base64
+import json
+import statistics
+import tempfile
+import time
+from datetime import timedelta
+from io import StringIO
+from unittest import mock
+
+import numpy as np
+
+from django.contrib.auth import get_user_model
+from django.contrib.contenttypes.models import ContentType
+from django.core.cache import cache
+from django.core.management import call_command
+from django.db import DatabaseError, connection
+from django.db.models import Sum
+from django.test import TestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from django.urls import reverse
+from django.utils import timezone
+from rest_framework import status
+from rest_framework.test import APITestCase
+
+from . import changelog, metrics
+from notifications.models import Notification
+from .hashtags import extract_hashtags
+from .importer import import_posts
+from .models import Change, Comment, Hashtag, Like, Post, TimelineEntry, TrendingCount
+from .mentions import POST_VERB, extract_mentions, notify_mentions
+from .ranking import budget_ms, load_affinity, load_candidates, rank_candidates, rank_feed, top_k
+from .counters import reconcile_counters
+from .like_buffer import like_buffer
+from .management.commands.benchmark_serialization import make_page, render_page
+from .likes import ALREADY_LIKED, LIKE, LIKED, apply_intents
+from .timeline import rebuild_timelines
+from .views import UserPostsView
+from .trending import DAY, HOUR, TrendingCounters, trending_counters
+
+User = get_user_model()
+
+
+class TimelineTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader', password='testpass')
+        self.author = User.objects.create_user(username='author', password='testpass')
+        self.other = User.objects.create_user(username='other', password='testpass')
+
+    def feed_titles(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse('feed'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['title'] for post in response.data['results']]
+
+    def test_new_post_is_fanned_out_to_followers(self):
+        self.reader.following.add(self.author)
+        self.client.force_authenticate(self.author)
+        response = self.client.post(reverse('post-list'), {'title': 'Hello', 'content': 'World'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post_id=response.data['id']).exists())
+        self.assertFalse(TimelineEntry.objects.filter(user=self.other).exists())
+        self.assertEqual(self.feed_titles(), ['Hello'])
+
+    def test_follow_backfills_and_unfollow_trims(self):
+        Post.objects.create(author=self.author, title='Old', content='...')
+        self.client.force_authenticate(self.reader)
+
+        response = self.client.post(reverse('follow_user', args=[self.author.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.feed_titles(), ['Old'])
+
+        response = self.client.post(reverse('unfollow_user', args=[self.author.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(self.feed_titles(), [])
+
+    def test_rebuild_timelines_command(self):
+        self.reader.following.add(self.author)
+        Post.objects.create(author=self.author, title='First', content='...')
+        stale = Post.objects.create(author=self.other, title='Unfollowed', content='...')
+        TimelineEntry.objects.create(user=self.reader, post=stale, created_at=stale.created_at)
+
+        call_command('rebuild_timelines', stdout=StringIO())
+
+        self.assertEqual(self.feed_titles(), ['First'])
+
+
+@override_settings(FEED_CELEBRITY_FOLLOWER_THRESHOLD=2)
+class HybridFeedTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        metrics.reset()
+        self.reader = User.objects.create_user(username='reader', password='testpass')
+        self.fan = User.objects.create_user(username='fan', password='testpass')
+        self.celebrity = User.objects.create_user(username='celebrity', password='testpass')
+        self.friend = User.objects.create_user(username='friend', password='testpass')
+        self.reader.following.add(self.celebrity, self.friend)
+        self.fan.following.add(self.celebrity)
+
+    def create_post(self, author, title):
+        self.client.force_authenticate(author)
+        response = self.client.post(reverse('post-list'), {'title': title, 'content': '...'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+
+    def test_celebrity_posts_are_merged_at_read_time(self):
+        self.create_post(self.friend, 'friend 1')
+        self.create_post(self.celebrity, 'celebrity 1')
+        self.create_post(self.friend, 'friend 2')
+        self.create_post(self.celebrity, 'celebrity 2')
+
+        self.assertFalse(TimelineEntry.objects.filter(post__author=self.celebrity).exists())
+
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse('feed'), {'page_size': 3})
+        titles = [post['title'] for post in response.data['results']]
+        response = self.client.get(response.data['next'])
+        titles += [post['title'] for post in response.data['results']]
+        self.assertEqual(titles, ['celebrity 2', 'friend 2', 'celebrity 1', 'friend 1'])
+
+    def test_posts_return_to_timelines_when_an_author_drops_below_the_threshold(self):
+        self.create_post(self.celebrity, 'celebrity 1')
+        self.create_post(self.friend, 'friend 1')
+
+        self.client.force_authenticate(self.fan)
+        self.client.post(reverse('unfollow_user', args=[self.celebrity.pk]))
+        cache.clear()
+
+        self.assertTrue(TimelineEntry.objects.filter(user=self.reader, post__author=self.celebrity).exists())
+        self.client.force_authenticate(self.reader)
+        titles = [post['title'] for post in self.client.get(reverse('feed')).data['results']]
+        self.assertEqual(titles, ['friend 1', 'celebrity 1'])
+
+    def test_metrics_expose_author_mode_and_merge_cost(self):
+        self.create_post(self.celebrity, 'celebrity 1')
+        self.create_post(self.friend, 'friend 1')
+        self.client.force_authenticate(self.reader)
+        self.client.get(reverse('feed'))
+
+        admin = User.objects.create_superuser(username='admin', password='testpass')
+        self.client.force_authenticate(admin)
+        response = self.client.get(reverse('feed-metrics'))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(response.data['author_modes'][str(self.celebrity.pk)], {'mode': 'pull', 'followers': 2})
+        self.assertEqual(response.data['author_modes'][str(self.friend.pk)], {'mode': 'push', 'followers': 1})
+        self.assertEqual(response.data['counters']['feed.merge.requests'], 1)
+        self.assertEqual(response.data['timings']['feed.merge']['count'], 1)
+
+    def test_metrics_are_staff_only(self):
+        self.client.force_authenticate(self.reader)
+        response = self.client.get(reverse('feed-metrics'))
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+
+class RankedFeedTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader', password='testpass')
+        self.author = User.objects.create_user(username='author', password='testpass')
+        self.reader.following.add(self.author)
+        self.quiet = Post.objects.create(author=self.author, title='quiet', content='...')
+        self.popular = Post.objects.create(author=self.author, title='popular', content='...')
+        self.fresh = Post.objects.create(author=self.author, title='fresh', content='...')
+        Post.objects.filter(pk__in=[self.quiet.pk, self.popular.pk]).update(
+            created_at=self.fresh.created_at - timedelta(hours=2)
+        )
+        call_command('rebuild_timelines', stdout=StringIO())
+        for i in range(20):
+            fan = User.objects.create(username=f'fan{i}')
+            Like.objects.create(user=fan, post=self.popular)
+        Comment.objects.create(author=self.reader, post=self.popular, content='nice')
+        reconcile_counters()
+        self.client.force_authenticate(self.reader)
+
+    def test_engagement_ranking_orders_by_score(self):
+        response = self.client.get(reverse('feed'), {'ranking': 'engagement'})
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([post['title'] for post in response.data['results']], ['popular', 'fresh', 'quiet'])
+
+    def test_default_ordering_is_chronological(self):
+        response = self.client.get(reverse('feed'))
+        self.assertEqual(response.data['results'][0]['title'], 'fresh')
+
+    def test_unknown_ranking(self):
+        response = self.client.get(reverse('feed'), {'ranking': 'random'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class RankingBenchmarkTestCase(TestCase):
+    candidates = 2000
+
+    @classmethod
+    def setUpTestData(cls):
+        rng = np.random.default_rng(0)
+        cls.reader = User.objects.create(username='reader')
+        authors = User.objects.bulk_create([User(username=f'author{i}') for i in range(50)])
+        now = timezone.now()
+        posts = Post.objects.bulk_create([
+            Post(author=authors[i % len(authors)], title=f'Post {i}', content='...',
+                 like_count=int(rng.integers(0, 10000)), comment_count=int(rng.integers(0, 500)))
+            for i in range(cls.candidates)
+        ])
+        TimelineEntry.objects.bulk_create([
+            TimelineEntry(user=cls.reader, post=post, created_at=now - timedelta(hours=float(rng.uniform(0, 72))))
+            for post in posts
+        ])
+        Like.objects.bulk_create([Like(user=cls.reader, post=post) for post in posts[::7]])
+        Comment.objects.bulk_create([
+            Comment(author=cls.reader, post=post, content='hi', path=f'{i:010d}') for i, post in enumerate(posts[::11])
+        ])
+
+    def test_scoring_stays_within_latency_budget(self):
+        # The budget covers the NumPy step; the queries before it are timed apart
+        candidates = load_candidates(self.reader)
+        affinity = load_affinity(self.reader, candidates[1])
+        self.assertEqual(len(candidates[0]), self.candidates)
+        timings = []
+        for _ in range(9):
+            started = time.perf_counter()
+            ranked = rank_candidates(candidates, affinity, 100)
+            timings.append((time.perf_counter() - started) * 1000)
+        self.assertEqual(ranked, rank_feed(self.reader, 100))
+        self.assertLess(statistics.median(timings), budget_ms())
+
+    def test_top_k_matches_full_sort(self):
+        scores = np.random.default_rng(1).random(1000)
+        self.assertEqual(top_k(scores, 10).tolist(), np.argsort(-scores)[:10].tolist())
+
+
+class SerializationFastPathTestCase(APITestCase):
+    # Timings: python manage.py benchmark_serialization
+    page_sizes = [10, 100, 1000]
+
+    def test_fast_path_renders_identical_json(self):
+        for size in self.page_sizes:
+            posts = make_page(size)
+            with override_settings(API_FAST_SERIALIZATION=False):
+                slow = render_page(posts)
+            with self.subTest(page_size=size):
+                self.assertEqual(render_page(posts), slow)
+
+    def test_responses_match_the_stock_serializers(self):
+        user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(user)
+        post = Post.objects.create(author=user, title='Hello', content='...')
+        parent = Comment.objects.create(author=user, post=post, content='First')
+        Comment.objects.create(author=user, post=post, parent=parent, content='Reply')
+        Like.objects.create(user=user, post=post)
+
+        requests = [
+            (reverse('post-list'), {}),
+            (reverse('post-list'), {'expand': 'author_profile', 'fields': 'id,comments.parent'}),
+            (reverse('comment-list'), {}),
+            (reverse('feed'), {}),
+        ]
+        for url, params in requests:
+            with self.subTest(url=url, params=params):
+                fast = self.client.get(url, params).content
+                with override_settings(API_FAST_SERIALIZATION=False):
+                    slow = self.client.get(url, params).content
+                self.assertEqual(fast, slow)
+
+
+@override_settings(POST_COMMENT_PREVIEW_SIZE=2)
+class CommentPreviewTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.viral = Post.objects.create(author=self.user, title='viral', content='...')
+        self.quiet = Post.objects.create(author=self.user, title='quiet', content='...')
+        for i in range(5):
+            Comment.objects.create(author=self.user, post=self.viral, content=f'comment {i}')
+        reconcile_counters()
+
+    def test_list_embeds_every_comment_by_default(self):
+        response = self.client.get(reverse('post-list'))
+        posts = {post['title']: post for post in response.data['results']}
+        self.assertEqual([comment['content'] for comment in posts['viral']['comments']],
+                         [f'comment {i}' for i in range(5)])
+        self.assertEqual(posts['quiet']['comments'], [])
+
+    def test_preview_embeds_latest_comments_and_count(self):
+        response = self.client.get(reverse('post-list'), {'comments': 'preview'})
+        posts = {post['title']: post for post in response.data['results']}
+        self.assertEqual([comment['content'] for comment in posts['viral']['comments']], ['comment 4', 'comment 3'])
+        self.assertEqual(posts['viral']['comment_count'], 5)
+        self.assertEqual(posts['quiet']['comments'], [])
+        self.assertEqual(posts['quiet']['comment_count'], 0)
+
+    def test_comments_are_loaded_in_one_query_for_the_page(self):
+        for params in [{}, {'comments': 'preview'}]:
+            with self.subTest(**params), CaptureQueriesContext(connection) as queries:
+                self.client.get(reverse('post-list'), params)
+            comment_queries = [query for query in queries.captured_queries
+                               if '"posts_comment"."post_id" IN' in query['sql']]
+            self.assertEqual(len(comment_queries), 1)
+
+    def test_retrieve_preview_is_capped_too(self):
+        response = self.client.get(reverse('post-detail', args=[self.viral.pk]), {'comments': 'preview'})
+        self.assertEqual(len(response.data['comments']), 2)
+        self.assertEqual(response.data['comment_count'], 5)
+
+
+class EngagementCounterTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.post = Post.objects.create(author=self.user, title='Post', content='...')
+        self.client.force_authenticate(self.user)
+
+    def test_like_and_unlike_update_like_count(self):
+        self.client.post(reverse('like-post', args=[self.post.pk]))
+        self.client.post(reverse('like-post', args=[self.post.pk]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+
+        self.client.post(reverse('unlike-post', args=[self.post.pk]))
+        response = self.client.post(reverse('unlike-post', args=[self.post.pk]))
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_comment_create_and_delete_update_comment_count(self):
+        response = self.client.post(reverse('comment-list'), {'post': self.post.pk, 'content': 'Hi'})
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 1)
+
+        self.client.delete(reverse('comment-detail', args=[response.data['id']]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+
+    def test_post_edit_does_not_overwrite_counters(self):
+        Post.objects.filter(pk=self.post.pk).update(like_count=7)
+        self.client.patch(reverse('post-detail', args=[self.post.pk]), {'title': 'Edited'})
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.title, self.post.like_count), ('Edited', 7))
+
+    def test_reconcile_command_repairs_drift(self):
+        Like.objects.create(user=self.user, post=self.post)
+        Comment.objects.create(author=self.user, post=self.post, content='Hi')
+        healthy = Post.objects.create(author=self.user, title='Healthy', content='...')
+
+        out = StringIO()
+        call_command('reconcile_post_counters', '--batch-size', '1', stdout=out)
+
+        self.assertIn('1 posts repaired', out.getvalue())
+        self.post.refresh_from_db()
+        self.assertEqual((self.post.like_count, self.post.comment_count), (1, 1))
+        healthy.refresh_from_db()
+        self.assertEqual((healthy.like_count, healthy.comment_count), (0, 0))
+
+
+@override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_FLUSH_INTERVAL=None, LIKE_BUFFER_MAX_SIZE=100)
+class LikeWriteBehindTestCase(APITestCase):
+    def setUp(self):
+        like_buffer.flush()
+        self.author = User.objects.create_user(username='author', password='testpass')
+        self.fan = User.objects.create_user(username='fan', password='testpass')
+        self.post = Post.objects.create(author=self.author, title='Post', content='...')
+        self.client.force_authenticate(self.fan)
+
+    def test_likes_are_buffered_until_flush(self):
+        response = self.client.post(reverse('like-post', args=[self.post.pk]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+        self.assertFalse(Like.objects.exists())
+
+        # The liking user sees their own pending like
+        response = self.client.post(reverse('like-post', args=[self.post.pk]))
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+        self.assertEqual(like_buffer.flush(), 1)
+        self.assertTrue(Like.objects.filter(user=self.fan, post=self.post).exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 1)
+        self.assertEqual(Notification.objects.filter(recipient=self.author, verb='liked your post').count(), 1)
+
+    def test_intents_are_deduplicated_per_user_and_post(self):
+        self.client.post(reverse('like-post', args=[self.post.pk]))
+        self.client.post(reverse('unlike-post', args=[self.post.pk]))
+        self.assertEqual(len(like_buffer), 1)
+
+        like_buffer.flush()
+        self.assertFalse(Like.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+    def test_flush_writes_in_a_constant_number_of_queries(self):
+        posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='...') for i in range(20)]
+        for post in posts:
+            like_buffer.add(self.fan.pk, post.pk, 'like')
+        ContentType.objects.get_for_model(Post)  # warm the content type cache
+        with self.assertNumQueries(11):  # including change log inserts and a savepoint around the like INSERT
+            like_buffer.flush()
+        self.assertEqual(Like.objects.count(), 20)
+        self.assertEqual(set(Post.objects.filter(pk__in=[p.pk for p in posts]).values_list('like_count', flat=True)), {1})
+
+    def test_size_threshold_triggers_flush(self):
+        with override_settings(LIKE_BUFFER_MAX_SIZE=1):
+            self.client.post(reverse('like-post', args=[self.post.pk]))
+        self.assertEqual(len(like_buffer), 0)
+        self.assertTrue(Like.objects.exists())
+
+    def test_unlike_existing_like(self):
+        Like.objects.create(user=self.fan, post=self.post)
+        Post.objects.filter(pk=self.post.pk).update(like_count=1)
+        response = self.client.post(reverse('unlike-post', args=[self.post.pk]))
+        self.assertEqual(response.status_code, status.HTTP_202_ACCEPTED)
+
+        like_buffer.flush()
+        self.assertFalse(Like.objects.exists())
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.like_count, 0)
+
+
+class LikeBatchTestCase(APITestCase):
+    def setUp(self):
+        self.author = User.objects.create_user(username='author', password='testpass')
+        self.fan = User.objects.create_user(username='fan', password='testpass')
+        self.posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='...') for i in range(3)]
+        Like.objects.create(user=self.fan, post=self.posts[1])
+        reconcile_counters()
+        self.client.force_authenticate(self.fan)
+
+    def test_batch_reports_per_item_results(self):
+        actions = [
+            {'post': self.posts[0].pk, 'action': 'like'},
+            {'post': self.posts[1].pk, 'action': 'like'},
+            {'post': self.posts[2].pk, 'action': 'unlike'},
+            {'post': 999999, 'action': 'like'},
+            {'post': self.posts[1].pk, 'action': 'unlike'},
+        ]
+        response = self.client.post(reverse('like-batch'), {'actions': actions}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual(
+            [item['result'] for item in response.data['results']],
+            ['liked', 'superseded', 'not_liked', 'not_found', 'unliked'],
+        )
+        self.assertEqual(
+            list(Post.objects.filter(pk__in=[p.pk for p in self.posts]).order_by('pk').values_list('like_count', flat=True)),
+            [1, 0, 0],
+        )
+        self.assertEqual(set(Like.objects.values_list('post_id', flat=True)), {self.posts[0].pk})
+
+    def test_query_count_does_not_grow_with_batch_size(self):
+        posts = [Post.objects.create(author=self.author, title=f'Bulk {i}', content='...') for i in range(50)]
+        actions = [{'post': post.pk, 'action': 'like'} for post in posts]
+        ContentType.objects.get_for_model(Post)  # warm the content type cache
+        with self.assertNumQueries(11):  # including change log inserts and a savepoint around the like INSERT
+            self.client.post(reverse('like-batch'), {'actions': actions}, format='json')
+        self.assertEqual(Like.objects.filter(user=self.fan).count(), 51)
+
+    def test_likes_written_concurrently_are_not_counted_twice(self):
+        Like.objects.create(user=self.fan, post=self.posts[0])
+        reconcile_counters()
+        real_filter = Like.objects.filter
+
+        def stale_filter(*args, **kwargs):
+            # The existing likes are read before the like above was committed
+            return Like.objects.none() if 'user_id__in' in kwargs else real_filter(*args, **kwargs)
+
+        with mock.patch.object(Like.objects, 'filter', side_effect=stale_filter):
+            outcomes = apply_intents({(self.fan.pk, self.posts[0].pk): LIKE, (self.fan.pk, self.posts[2].pk): LIKE})
+        self.assertEqual(outcomes[(self.fan.pk, self.posts[0].pk)], ALREADY_LIKED)
+        self.assertEqual(outcomes[(self.fan.pk, self.posts[2].pk)], LIKED)
+        self.assertEqual(
+            list(Post.objects.filter(pk__in=[p.pk for p in self.posts]).order_by('pk').values_list('like_count', flat=True)),
+            [1, 1, 1],
+        )
+        self.assertEqual(list(Notification.objects.values_list('target_object_id', flat=True)), [self.posts[2].pk])
+
+    def test_invalid_action(self):
+        response = self.client.post(reverse('like-batch'), {'actions': [{'post': 1, 'action': 'love'}]}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(LIKE_BATCH_MAX_ACTIONS=2)
+    def test_batch_size_limit(self):
+        actions = [{'post': post.pk, 'action': 'like'} for post in self.posts]
+        response = self.client.post(reverse('like-batch'), {'actions': actions}, format='json')
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class ViewerStateTestCase(APITestCase):
+    def setUp(self):
+        cache.clear()
+        self.reader = User.objects.create_user(username='reader', password='testpass')
+        self.author = User.objects.create_user(username='author', password='testpass')
+        self.reader.following.add(self.author)
+        self.liked = Post.objects.create(author=self.author, title='liked', content='...')
+        self.other = Post.objects.create(author=self.author, title='other', content='...')
+        Like.objects.create(user=self.reader, post=self.liked)
+        Like.objects.create(user=self.author, post=self.other)
+        reconcile_counters()
+        rebuild_timelines()
+        self.client.force_authenticate(self.reader)
+
+    def assert_viewer_state(self, response):
+        posts = {post['title']: post for post in response.data['results']}
+        self.assertEqual((posts['liked']['liked_by_me'], posts['liked']['like_count']), (True, 1))
+        self.assertEqual((posts['other']['liked_by_me'], posts['other']['like_count']), (False, 1))
+
+    def test_post_list_and_feed_annotate_viewer_state(self):
+        self.assert_viewer_state(self.client.get(reverse('post-list')))
+        self.assert_viewer_state(self.client.get(reverse('feed')))
+        self.assert_viewer_state(self.client.get(reverse('feed'), {'ranking': 'engagement'}))
+
+    def test_viewer_state_is_read_in_the_page_query(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('post-list'))
+        self.assertFalse(any(query['sql'].startswith('SELECT 1 AS "a" FROM "posts_like"') for query in queries.captured_queries))
+
+    @override_settings(LIKE_WRITE_BEHIND=True, LIKE_BUFFER_FLUSH_INTERVAL=None)
+    def test_pending_likes_are_visible_to_the_viewer(self):
+        self.client.post(reverse('like-post', args=[self.other.pk]))
+        try:
+            response = self.client.get(reverse('post-detail', args=[self.other.pk]))
+            self.assertTrue(response.data['liked_by_me'])
+        finally:
+            like_buffer.flush()
+
+
+class SearchTestCase(APITestCase):
+    def setUp(self):
+        self.reader = User.objects.create_user(username='reader', password='testpass')
+        self.friend = User.objects.create_user(username='friend', password='testpass')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass')
+        self.reader.following.add(self.friend)
+        self.client.force_authenticate(self.reader)
+
+    def search(self, **params):
+        response = self.client.get(reverse('search'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return response
+
+    def test_posts_and_comments_are_indexed_on_save_and_delete(self):
+        post = Post.objects.create(author=self.friend, title='Django tips', content='Use select_related')
+        comment = Comment.objects.create(author=self.stranger, post=post, content='Great django advice')
+
+        results = self.search(q='django').data['results']
+        self.assertEqual([(item['type'], item['id']) for item in results], [('post', post.pk), ('comment', comment.pk)])
+        self.assertIn('<b>', results[0]['snippet'])
+
+        post.title = 'Python tips'
+        post.save()
+        comment.delete()
+        self.assertEqual(self.search(q='django').data['results'], [])
+        self.assertEqual(len(self.search(q='pyth*').data['results']), 1)
+
+    def test_snippets_escape_user_content(self):
+        Post.objects.create(author=self.friend, title='Note', content='hello <script>x</script> world')
+        snippet = self.search(q='hello').data['results'][0]['snippet']
+        self.assertEqual(snippet, '<b>hello</b> &lt;script&gt;x&lt;/script&gt; world')
+
+    def test_title_matches_rank_above_content_matches(self):
+        body = Post.objects.create(author=self.friend, title='Weekend', content='some notes on caching and more')
+        title = Post.objects.create(author=self.friend, title='Caching', content='notes')
+        results = self.search(q='caching').data['results']
+        self.assertEqual([item['id'] for item in results], [title.pk, body.pk])
+
+    def test_following_filter(self):
+        Post.objects.create(author=self.friend, title='Cats', content='...')
+        Post.objects.create(author=self.stranger, title='Cats', content='...')
+        self.assertEqual(len(self.search(q='cats').data['results']), 2)
+        results = self.search(q='cats', following='true').data['results']
+        self.assertEqual([item['author_username'] for item in results], ['friend'])
+
+    def test_results_are_cursor_paginated(self):
+        for i in range(5):
+            Post.objects.create(author=self.friend, title=f'Search {i}', content='search ' * i)
+        response = self.search(q='search', page_size=2)
+        seen = [item['id'] for item in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            seen += [item['id'] for item in response.data['results']]
+        self.assertEqual(sorted(seen), sorted(Post.objects.values_list('id', flat=True)))
+
+    def test_operators_in_user_input_are_neutralised(self):
+        Post.objects.create(author=self.friend, title='AND OR NOT', content='...')
+        self.assertEqual(len(self.search(q='NOT "( AND').data['results']), 1)
+
+    def test_empty_query(self):
+        response = self.client.get(reverse('search'), {'q': '  '})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+
+class CommentThreadTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.user, title='Post', content='...')
+
+    def reply(self, content, parent=None, post=None):
+        data = {'post': (post or self.post).pk, 'content': content}
+        if parent is not None:
+            data['parent'] = parent['id']
+        response = self.client.post(reverse('comment-list'), data)
+        return response
+
+    def test_thread_is_nested_in_reply_order(self):
+        first = self.reply('first').data
+        second = self.reply('second').data
+        child = self.reply('child', first).data
+        self.reply('grandchild', child)
+        self.reply('second child', first)
+
+        response = self.client.get(reverse('post-thread', args=[self.post.pk]))
+        tree = response.data['comments']
+        self.assertEqual([node['content'] for node in tree], ['first', 'second'])
+        self.assertEqual([node['content'] for node in tree[0]['replies']], ['child', 'second child'])
+        self.assertEqual(tree[0]['replies'][0]['replies'][0]['content'], 'grandchild')
+        self.assertEqual(tree[0]['replies'][0]['replies'][0]['depth'], 2)
+        self.assertEqual(tree[1]['replies'], [])
+        self.assertFalse(response.data['truncated'])
+        self.assertEqual(second['depth'], 0)
+
+    def test_subtree_with_depth_limit_in_constant_queries(self):
+        root = self.reply('root').data
+        parent = root
+        for i in range(10):
+            parent = self.reply(f'level {i + 1}', parent).data
+        self.reply('sibling')
+
+        with self.assertNumQueries(2):
+            response = self.client.get(reverse('comment-thread', args=[root['id']]), {'depth': 3})
+        tree = response.data['comments']
+        self.assertEqual(len(tree), 1)
+        depth = 0
+        node = tree[0]
+        while node['replies']:
+            node = node['replies'][0]
+            depth += 1
+        self.assertEqual(depth, 3)
+
+    def test_reply_must_stay_on_the_same_post(self):
+        other = Post.objects.create(author=self.user, title='Other', content='...')
+        parent = self.reply('parent').data
+        response = self.reply('stray', parent, post=other)
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    @override_settings(COMMENT_MAX_DEPTH=1)
+    def test_depth_limit(self):
+        parent = self.reply('root').data
+        child = self.reply('child', parent).data
+        self.assertEqual(self.reply('too deep', child).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_deleting_a_comment_removes_its_replies_from_the_count(self):
+        root = self.reply('root').data
+        self.reply('reply', self.reply('child', root).data)
+        self.client.delete(reverse('comment-detail', args=[root['id']]))
+        self.post.refresh_from_db()
+        self.assertEqual(self.post.comment_count, 0)
+        self.assertFalse(Comment.objects.exists())
+
+
+class PostCommentsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.user, title='Post', content='...')
+        other = Post.objects.create(author=self.user, title='Other', content='...')
+        self.comments = [Comment.objects.create(author=self.user, post=self.post, content=f'{i}') for i in range(7)]
+        Comment.objects.create(author=self.user, post=other, content='elsewhere')
+
+    def test_pages_through_one_posts_comments_newest_first(self):
+        response = self.client.get(reverse('post-comments', args=[self.post.pk]), {'page_size': 3})
+        contents = [comment['content'] for comment in response.data['results']]
+        while response.data['next']:
+            response = self.client.get(response.data['next'])
+            contents += [comment['content'] for comment in response.data['results']]
+        self.assertEqual(contents, [str(i) for i in reversed(range(7))])
+
+    def test_missing_post(self):
+        response = self.client.get(reverse('post-comments', args=[999999]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+
+class QueryBudgetTestCase(APITestCase):
+    """
+    Every endpoint must run a fixed number of queries, whatever the page size.
+    Raise a budget only together with the change that needs it.
+    """
+    page_sizes = [1, 10, 50]
+    list_budgets = {
+        'post-list': 2,     # posts page with authors, counter columns and the viewer's like; comments with authors
+        'comment-list': 1,  # comments with authors
+        'feed': 4,          # followed ids, author follower counts (cache miss), timeline page, comments
+    }
+    post_list_budgets = {
+        'post-comments': 2,  # post exists, comments with authors
+    }
+    user_list_budgets = {
+        'user-posts': 3,  # user exists, posts with authors and the viewer's like, comments
+    }
+    detail_budgets = {
+        'post-detail': 2,
+        'comment-detail': 1,
+    }
+
+    @classmethod
+    def setUpTestData(cls):
+        cache.clear()
+        cls.reader = User.objects.create(username='reader')
+        authors = [User.objects.create(username=f'author{i}') for i in range(5)]
+        cls.reader.following.add(*authors)
+        for i in range(60):
+            post = Post.objects.create(author=authors[i % 5], title=f'Post {i}', content='...')
+            for j in range(4):
+                Comment.objects.create(author=authors[j], post=post, content=f'Comment {j}')
+        rebuild_timelines()
+        cls.post = post
+        cls.comment = Comment.objects.filter(post=post).first()
+        cls.author = authors[0]
+
+    def setUp(self):
+        cache.clear()
+        self.client.force_authenticate(self.reader)
+
+    def test_list_endpoints(self):
+        for name, budget in self.list_budgets.items():
+            for page_size in self.page_sizes:
+                cache.clear()
+                with self.subTest(endpoint=name, page_size=page_size), self.assertNumQueries(budget):
+                    response = self.client.get(reverse(name), {'page_size': page_size})
+                    self.assertEqual(len(response.data['results']), page_size)
+
+    def test_multi_get(self):
+        ids = list(Post.objects.order_by('?').values_list('pk', flat=True))
+        for count in self.page_sizes:
+            with self.subTest(count=count), self.assertNumQueries(self.detail_budgets['post-detail']):
+                response = self.client.get(reverse('post-list'), {'ids': ','.join(map(str, ids[:count]))})
+            self.assertEqual([item['id'] for item in response.data['results']], ids[:count])
+
+    def test_per_post_list_endpoints(self):
+        for name, budget in self.post_list_budgets.items():
+            for page_size in [1, 4]:
+                with self.subTest(endpoint=name, page_size=page_size), self.assertNumQueries(budget):
+                    response = self.client.get(reverse(name, args=[self.post.pk]), {'page_size': page_size})
+                    self.assertEqual(len(response.data['results']), page_size)
+
+    def test_per_user_list_endpoints(self):
+        for name, budget in self.user_list_budgets.items():
+            for page_size in self.page_sizes[:2]:
+                with self.subTest(endpoint=name, page_size=page_size), self.assertNumQueries(budget):
+                    response = self.client.get(reverse(name, args=[self.author.pk]), {'page_size': page_size})
+                    self.assertEqual(len(response.data['results']), page_size)
+
+    def test_detail_endpoints(self):
+        for name, budget in self.detail_budgets.items():
+            pk = self.post.pk if name == 'post-detail' else self.comment.pk
+            with self.subTest(endpoint=name), self.assertNumQueries(budget):
+                response = self.client.get(reverse(name, args=[pk]))
+                self.assertEqual(response.status_code, status.HTTP_200_OK)
+
+
+class KeysetPaginationTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.posts = [
+            Post.objects.create(author=self.user, title=f'Post {i}', content='...') for i in range(25)
+        ]
+        # Give half of the posts the same timestamp so ties have to be broken by id
+        Post.objects.filter(pk__in=[post.pk for post in self.posts[:12]]).update(created_at=self.posts[0].created_at)
+
+    def walk(self, url, link='next'):
+        ids = []
+        while url:
+            response = self.client.get(url)
+            self.assertEqual(response.status_code, status.HTTP_200_OK)
+            self.assertNotIn('count', response.data)
+            ids.extend(post['id'] for post in response.data['results'])
+            url = response.data[link]
+        return ids
+
+    def test_next_links_visit_every_post_once_in_order(self):
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk(reverse('post-list')), expected)
+
+    def test_feed_pages_over_the_timeline(self):
+        reader = User.objects.create_user(username='follower', password='testpass')
+        reader.following.add(self.user)
+        call_command('rebuild_timelines', stdout=StringIO())
+        self.client.force_authenticate(reader)
+
+        expected = list(Post.objects.order_by('-created_at', '-id').values_list('id', flat=True))
+        self.assertEqual(self.walk(reverse('feed')), expected)
+
+    def test_previous_link_returns_the_previous_page(self):
+        first = self.client.get(reverse('post-list'))
+        second = self.client.get(first.data['next'])
+        back = self.client.get(second.data['previous'])
+        self.assertEqual(
+            [post['id'] for post in back.data['results']],
+            [post['id'] for post in first.data['results']],
+        )
+
+    def test_pages_do_not_count_or_offset(self):
+        first = self.client.get(reverse('post-list'))
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(first.data['next'])
+        sql = ' '.join(query['sql'] for query in queries.captured_queries).upper()
+        self.assertNotIn('COUNT(*)', sql)
+        self.assertNotIn('OFFSET', sql)
+
+    def test_invalid_cursor(self):
+        response = self.client.get(reverse('post-list'), {'cursor': 'not-a-cursor'})
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_well_formed_cursor_with_bad_values(self):
+        def cursor(position):
+            return base64.urlsafe_b64encode(json.dumps({'p': position, 'r': 0}).encode()).decode()
+
+        bad = [['garbage', 1], [{'a': 1}, 1], [None, 1], ['2024-01-01T00:00:00Z', 'x'], ['2024-01-01T00:00:00Z', [1]]]
+        for name in ['post-list', 'feed']:
+            for position in bad:
+                with self.subTest(endpoint=name, position=position):
+                    response = self.client.get(reverse(name), {'cursor': cursor(position)})
+                    self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+        good = self.client.get(reverse('post-list'), {'cursor': cursor(['2999-01-01T00:00:00+00:00', 1])})
+        self.assertEqual(good.status_code, status.HTTP_200_OK)
+
+
+class SparseFieldsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.post = Post.objects.create(author=self.user, title='Hello', content='...')
+        Comment.objects.create(author=self.user, post=self.post, content='First')
+
+    def test_fields_prune_the_response(self):
+        response = self.client.get(reverse('post-list'), {'fields': 'id,title'})
+        self.assertEqual(response.data['results'], [{'id': self.post.pk, 'title': 'Hello'}])
+
+    def test_unrequested_relations_are_not_queried(self):
+        with CaptureQueriesContext(connection) as queries:
+            self.client.get(reverse('post-list'), {'fields': 'id,title'})
+        self.assertEqual(len(queries.captured_queries), 1)
+        sql = queries.captured_queries[0]['sql']
+        self.assertNotIn('JOIN', sql)
+        self.assertNotIn('posts_like', sql)
+
+    def test_dotted_fields_prune_nested_comments(self):
+        response = self.client.get(reverse('post-detail', args=[self.post.pk]), {'fields': 'id,comments.content'})
+        self.assertEqual(response.data, {'id': self.post.pk, 'comments': [{'content': 'First'}]})
+
+    def test_expand_embeds_the_author(self):
+        response = self.client.get(reverse('comment-list'), {'fields': 'id', 'expand': 'author_profile'})
+        self.assertEqual(response.data['results'][0]['author_profile']['username'], 'reader')
+        self.assertEqual(set(response.data['results'][0]), {'id', 'author_profile'})
+
+    def test_fields_do_not_apply_to_writes(self):
+        response = self.client.post(
+            reverse('post-list') + '?fields=id', {'title': 'New', 'content': '...'}, format='json'
+        )
+        self.assertEqual(response.status_code, status.HTTP_201_CREATED)
+        self.assertEqual(response.data['title'], 'New')
+
+
+@override_settings(TRENDING_SNAPSHOT_INTERVAL=None, TRENDING_COMMENT_WEIGHT=2)
+class TrendingTestCase(APITestCase):
+    def setUp(self):
+        trending_counters.reset()
+        self.addCleanup(trending_counters.reset)
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.quiet = Post.objects.create(author=self.user, title='Quiet', content='...')
+        self.busy = Post.objects.create(author=self.user, title='Busy', content='...')
+
+    def trending_ids(self, **params):
+        response = self.client.get(reverse('trending'), params)
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        return [post['id'] for post in response.data['results']]
+
+    def test_likes_and_comments_rank_posts(self):
+        other = User.objects.create_user(username='other', password='testpass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.post(reverse('like-post', args=[self.quiet.pk]))
+            self.client.post(reverse('comment-list'), {'post': self.busy.pk, 'content': 'Hi'})
+        self.assertEqual(self.trending_ids(), [self.busy.pk, self.quiet.pk])
+
+        third = User.objects.create_user(username='third', password='testpass')
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.force_authenticate(other)
+            self.client.post(reverse('like-batch'), {'actions': [{'post': self.quiet.pk, 'action': 'like'}]}, format='json')
+            self.client.force_authenticate(third)
+            self.client.post(reverse('like-post', args=[self.quiet.pk]))
+        self.assertEqual(self.trending_ids(window='day'), [self.quiet.pk, self.busy.pk])
+
+    def test_invalid_window(self):
+        response = self.client.get(reverse('trending'), {'window': 'week'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_old_buckets_slide_out_of_the_window(self):
+        now = timezone.now()
+        likers = [User.objects.create_user(username=f'liker{i}', password='testpass') for i in range(3)]
+        Like.objects.bulk_create([Like(user=liker, post=self.quiet) for liker in likers])
+        Like.objects.filter(post=self.quiet).update(created_at=now - timedelta(minutes=90))
+        counters = TrendingCounters()
+        counters.add(self.busy.pk, 1)
+        self.assertEqual(counters.top(HOUR, 10), [(self.busy.pk, 1)])
+        self.assertEqual(counters.top(DAY, 10), [(self.quiet.pk, 3), (self.busy.pk, 1)])
+        self.assertEqual(counters.top(HOUR, 10, now=now + timedelta(hours=2)), [])
+        self.assertEqual(counters.top(DAY, 10, now=now + timedelta(hours=23)), [(self.busy.pk, 1)])
+
+    def test_top_k_after_many_updates(self):
+        counters = TrendingCounters()
+        posts = [self.quiet, self.busy] + [
+            Post.objects.create(author=self.user, title=f'Post {i}', content='...') for i in range(8)
+        ]
+        for score, post in enumerate(posts, start=1):
+            for _ in range(score):
+                counters.add(post.pk)
+        self.assertEqual(counters.top(HOUR, 3), [(post.pk, score) for score, post in reversed(list(enumerate(posts, 1)))][:3])
+
+    def test_deleted_posts_leave_the_ranking(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.user, post=self.quiet)
+        self.quiet.delete()
+        self.assertEqual(self.trending_ids(), [])
+
+    def test_counters_rebuild_from_snapshots_and_recent_rows(self):
+        with self.captureOnCommitCallbacks(execute=True):
+            Like.objects.create(user=self.user, post=self.quiet)
+        self.assertEqual(trending_counters.snapshot(), 1)
+        self.assertEqual(TrendingCount.objects.get().score, 1)
+
+        # Written after the snapshot and never counted in memory
+        other = User.objects.create_user(username='other', password='testpass')
+        Like.objects.bulk_create([Like(user=other, post=self.busy)])
+        Comment.objects.bulk_create([Comment(author=other, post=self.busy, content='Hi', path='x')])
+
+        restarted = TrendingCounters()
+        with self.assertNumQueries(4):  # snapshot time, snapshot rows, recent likes, recent comments
+            self.assertEqual(restarted.top(DAY, 10), [(self.busy.pk, 3), (self.quiet.pk, 1)])
+
+    def test_unlikes_and_comment_deletes_take_their_score_back(self):
+        other = User.objects.create_user(username='other', password='testpass')
+        self.client.force_authenticate(other)
+        trending_counters.top(HOUR, 10)  # rebuild before the writes, so they are counted live
+        for action in ['like-post', 'unlike-post'] * 5 + ['like-post']:
+            with self.captureOnCommitCallbacks(execute=True):
+                self.client.post(reverse(action, args=[self.quiet.pk]))
+        with self.captureOnCommitCallbacks(execute=True):
+            response = self.client.post(reverse('comment-list'), {'post': self.busy.pk, 'content': 'Hi'})
+        with self.captureOnCommitCallbacks(execute=True):
+            self.client.delete(reverse('comment-detail', args=[response.data['id']]))
+        self.assertEqual(trending_counters.top(HOUR, 10), [(self.quiet.pk, 1)])
+
+        trending_counters.snapshot()
+        self.assertEqual(list(TrendingCount.objects.values_list('post_id', 'score')), [(self.quiet.pk, 1)])
+        # A restart reads the same score back
+        self.assertEqual(TrendingCounters().top(HOUR, 10), [(self.quiet.pk, 1)])
+
+    def test_removals_stop_at_zero(self):
+        counters = TrendingCounters()
+        now = timezone.now()
+        counters.add(self.quiet.pk, 1)
+        counters.remove(self.quiet.pk, 1, now, now + timedelta(seconds=1))
+        counters.remove(self.busy.pk, 2, now, now + timedelta(seconds=1))
+        self.assertEqual(counters.top(HOUR, 10), [])
+        counters.snapshot()
+        self.assertFalse(TrendingCount.objects.exists())
+
+    def test_snapshots_from_several_processes_add_up(self):
+        first, second = TrendingCounters(), TrendingCounters()
+        self.addCleanup(first.reset)
+        self.addCleanup(second.reset)
+        first.add(self.quiet.pk, 2)
+        second.add(self.quiet.pk, 3)
+        first.snapshot()
+        second.snapshot()
+        # Only what was counted since the previous snapshot is added again
+        first.add(self.quiet.pk, 1)
+        first.snapshot()
+        self.assertEqual(TrendingCount.objects.aggregate(total=Sum('score'))['total'], 6)
+
+
+class HashtagTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.client.force_authenticate(self.user)
+
+    def create(self, content):
+        response = self.client.post(reverse('post-list'), {'title': 'Post', 'content': content}, format='json')
+        return Post.objects.get(pk=response.data['id'])
+
+    def test_extract_hashtags(self):
+        self.assertEqual(
+            extract_hashtags('#Django and #python, again #django; not a#tag or ##double #café'),
+            ['django', 'python', 'café'],
+        )
+
+    def test_posts_by_hashtag(self):
+        first = self.create('Hello #Django')
+        self.create('Nothing to see')
+        second = self.create('More #django and #python')
+
+        response = self.client.get(reverse('hashtag-posts', args=['DJANGO']), {'page_size': 1})
+        self.assertEqual([post['id'] for post in response.data['results']], [second.pk])
+        response = self.client.get(response.data['next'])
+        self.assertEqual([post['id'] for post in response.data['results']], [first.pk])
+        self.assertIsNone(response.data['next'])
+
+        response = self.client.get(reverse('hashtag-posts', args=['unknown']))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_edits_and_deletes_update_the_counts(self):
+        post = self.create('#one #two')
+        self.client.patch(reverse('post-detail', args=[post.pk]), {'content': '#two #three'}, format='json')
+        counts = dict(Hashtag.objects.values_list('name', 'post_count'))
+        self.assertEqual(counts, {'one': 0, 'two': 1, 'three': 1})
+        self.assertEqual(list(post.hashtag_links.values_list('hashtag__name', flat=True).order_by('hashtag__name')),
+                         ['three', 'two'])
+
+        self.client.delete(reverse('post-detail', args=[post.pk]))
+        self.assertEqual(set(Hashtag.objects.values_list('post_count', flat=True)), {0})
+
+    def test_trending_hashtags(self):
+        self.create('#a #b')
+        self.create('#b')
+        self.create('#b #c')
+        response = self.client.get(reverse('trending-hashtags'), {'window': 'day'})
+        self.assertEqual(
+            [(tag['name'], tag['uses']) for tag in response.data['results']],
+            [('b', 3), ('a', 1), ('c', 1)],
+        )
+        response = self.client.get(reverse('trending-hashtags'), {'window': 'year'})
+        self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+        with mock.patch('django.utils.timezone.now', return_value=timezone.now() + timedelta(days=2)):
+            call_command('prune_hashtag_activity', stdout=StringIO())
+            response = self.client.get(reverse('trending-hashtags'), {'window': 'day'})
+        self.assertEqual(response.data['results'], [])
+        self.assertEqual(Hashtag.objects.get(name='b').post_count, 3)
+
+
+class MentionTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='author', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.bob = User.objects.create_user(username='bob', password='testpass')
+        self.carol = User.objects.create_user(username='carol.b', password='testpass')
+        ContentType.objects.get_for_model(Post)  # warm the content type cache
+
+    def mentioned(self, verb=POST_VERB):
+        return sorted(Notification.objects.filter(verb=verb).values_list('recipient__username', flat=True))
+
+    def test_extract_mentions(self):
+        self.assertEqual(
+            extract_mentions('Hi @bob, @carol.b. and @bob again; mail a@b.com or @@x'),
+            ['bob', 'carol.b'],
+        )
+
+    def test_post_mentions_notify_once(self):
+        response = self.client.post(
+            reverse('post-list'), {'title': 'Hi', 'content': '@bob @carol.b @author @nobody'}, format='json'
+        )
+        self.assertEqual(self.mentioned(), ['bob', 'carol.b'])
+
+        # Editing only notifies people who were not mentioned before
+        dave = User.objects.create_user(username='dave', password='testpass')
+        self.client.patch(reverse('post-detail', args=[response.data['id']]), {'content': '@bob @dave'}, format='json')
+        self.assertEqual(self.mentioned(), ['bob', 'carol.b', 'dave'])
+
+    def test_comment_mentions(self):
+        post = Post.objects.create(author=self.user, title='Hi', content='...')
+        self.client.post(reverse('comment-list'), {'post': post.pk, 'content': 'cc @bob'})
+        self.assertEqual(self.mentioned('mentioned you in a comment'), ['bob'])
+
+    def test_query_count_does_not_grow_with_mentions(self):
+        users = User.objects.bulk_create([User(username=f'user{i}') for i in range(50)])
+        post = Post.objects.create(author=self.user, title='Hi', content='...')
+        with self.assertNumQueries(4):  # mentioned users, recent notifications, bulk insert, change log
+            created = notify_mentions(self.user, post, POST_VERB, ' '.join(f'@{user.username}' for user in users))
+        self.assertEqual(len(created), 50)
+        with self.assertNumQueries(2):
+            self.assertEqual(notify_mentions(self.user, post, POST_VERB, '@user0 @user1'), [])
+
+
+class UserPostsTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.author = User.objects.create_user(username='author', password='testpass')
+        self.client.force_authenticate(self.user)
+        self.posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='...') for i in range(5)]
+        Post.objects.create(author=self.user, title='Not theirs', content='...')
+
+    def test_pages_through_the_users_posts(self):
+        url = reverse('user-posts', args=[self.author.pk])
+        ids = []
+        while url:
+            response = self.client.get(url, {'page_size': 2} if not ids else None)
+            ids.extend(post['id'] for post in response.data['results'])
+            url = response.data['next']
+        self.assertEqual(ids, [post.pk for post in reversed(self.posts)])
+
+    def test_unknown_user(self):
+        response = self.client.get(reverse('user-posts', args=[0]))
+        self.assertEqual(response.status_code, status.HTTP_404_NOT_FOUND)
+
+    def test_page_is_read_from_the_author_index(self):
+        queryset = Post.objects.filter(author=self.author).order_by('-created_at', '-id')[:10]
+        plan = queryset.explain()
+        self.assertIn('post_author_created_idx', plan)
+        self.assertNotIn('TEMP B-TREE', plan)
+
+
+@override_settings(POST_IMPORT_CHUNK_SIZE=2)
+class PostImportTestCase(APITestCase):
+    def setUp(self):
+        self.admin = User.objects.create_user(username='admin', password='testpass', is_staff=True)
+        self.alice = User.objects.create_user(username='alice', password='testpass')
+        self.follower = User.objects.create_user(username='follower', password='testpass')
+        self.follower.following.add(self.alice)
+        self.client.force_authenticate(self.admin)
+
+    def ndjson(self, *rows):
+        return '\n'.join(row if isinstance(row, str) else json.dumps(row) for row in rows).encode()
+
+    def test_import_reports_per_line_errors_and_keeps_going(self):
+        body = self.ndjson(
+            {'author': 'alice', 'title': 'Old news', 'content': 'From the #archive', 'created_at': '2015-03-01T12:00:00Z'},
+            'not json',
+            '',
+            {'title': 'Mine', 'content': 'By the importer'},
+            {'author': 'nobody', 'title': 'Lost', 'content': '...'},
+            {'author': 'alice', 'content': 'No title'},
+            {'author': 'alice', 'title': 'Bad date', 'content': '...', 'created_at': 'yesterday'},
+        )
+        response = self.client.post(reverse('post-bulk-import'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['lines'], response.data['imported'], response.data['failed']), (6, 2, 4))
+        self.assertEqual([error['line'] for error in response.data['errors']], [2, 5, 6, 7])
+        self.assertIn('title', response.data['errors'][2]['errors'])
+
+        old = Post.objects.get(title='Old news')
+        self.assertEqual(old.created_at.year, 2015)
+        self.assertEqual(Post.objects.get(title='Mine').author, self.admin)
+        # Everything post_save would have done for a single post
+        self.assertTrue(TimelineEntry.objects.filter(user=self.follower, post=old, created_at=old.created_at).exists())
+        self.assertEqual(Hashtag.objects.get(name='archive').post_count, 1)
+        hits = self.client.get(reverse('search'), {'q': 'archive'}).data['results']
+        self.assertEqual([hit['id'] for hit in hits], [old.pk])
+
+    def test_non_string_author_fails_only_its_line(self):
+        body = self.ndjson(
+            {'author': ['alice'], 'title': 'List', 'content': '...'},
+            {'author': {'name': 'alice'}, 'title': 'Dict', 'content': '...'},
+            {'author': 'alice', 'title': 'Fine', 'content': '...'},
+        )
+        response = self.client.post(reverse('post-bulk-import'), body, content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual((response.data['imported'], response.data['failed']), (1, 2))
+        self.assertEqual(response.data['errors'][0], {'line': 1, 'errors': {'author': ['Must be a username.']}})
+        self.assertEqual(list(Post.objects.values_list('title', flat=True)), ['Fine'])
+
+    def test_only_staff_can_import(self):
+        self.client.force_authenticate(self.alice)
+        response = self.client.post(reverse('post-bulk-import'), self.ndjson({'title': 'x', 'content': 'y'}),
+                                    content_type='application/x-ndjson')
+        self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
+    def test_input_is_consumed_chunk_by_chunk(self):
+        def lines():
+            for i in range(10):
+                # Earlier chunks are already written when later lines are read
+                self.assertEqual(Post.objects.count(), i - i % 4)
+                yield json.dumps({'title': f'Post {i}', 'content': '...'})
+
+        report = import_posts(lines(), default_author=self.alice, chunk_size=4)
+        self.assertEqual((report.imported, report.failed), (10, 0))
+
+    def test_management_command(self):
+        with tempfile.NamedTemporaryFile('wb', suffix='.ndjson') as source:
+            source.write(self.ndjson({'title': 'A', 'content': '...'}, {'title': 'B'}))
+            source.flush()
+            stdout, stderr = StringIO(), StringIO()
+            call_command('import_posts', source.name, '--author', 'alice', stdout=stdout, stderr=stderr)
+        self.assertIn('Imported 1 of 2 posts', stdout.getvalue())
+        self.assertIn('Line 2:', stderr.getvalue())
+        self.assertEqual(list(Post.objects.values_list('title', 'author__username')), [('A', 'alice')])
+
+
+class SyncTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.author = User.objects.create_user(username='author', password='testpass')
+        self.stranger = User.objects.create_user(username='stranger', password='testpass')
+        self.user.following.add(self.author)
+        self.client.force_authenticate(self.user)
+        self.cursor = self.client.get(reverse('sync')).data['cursor']
+
+    def sync(self, cursor=None, **params):
+        return self.client.get(reverse('sync'), {'since': cursor or self.cursor, **params})
+
+    def test_returns_compacted_changes_after_the_cursor(self):
+        post = Post.objects.create(author=self.author, title='First', content='...')
+        post.title = 'Edited'
+        post.save()
+        Post.objects.create(author=self.stranger, title='Unrelated', content='...')
+        comment = Comment.objects.create(post=post, author=self.stranger, content='hi')
+        comment_id = comment.pk
+        comment.delete()
+        Like.objects.create(post=post, user=self.user)
+        Notification.objects.create(recipient=self.user, actor=self.author, verb='waved at you')
+        newcomer = User.objects.create_user(username='newcomer', password='testpass')
+        self.user.following.add(newcomer)
+
+        response = self.sync()
+        self.assertFalse(response.data['has_more'])
+        changes = [(item['kind'], item['id'], item['op']) for item in response.data['changes']]
+        notification = Notification.objects.get()
+        self.assertEqual(changes, [
+            ('post', post.pk, 'upsert'),
+            ('comment', comment_id, 'delete'),
+            ('like', post.pk, 'upsert'),
+            ('notification', notification.pk, 'upsert'),
+            ('follow', newcomer.pk, 'upsert'),
+        ])
+        self.assertEqual(response.data['changes'][0]['data']['title'], 'Edited')
+        self.assertEqual(response.data['changes'][3]['data']['verb'], 'waved at you')
+
+        # Nothing new: the cursor moves past other users' changes and the page is empty
+        again = self.sync(response.data['cursor'])
+        self.assertEqual(again.data['changes'], [])
+
+    def test_delete_wins_over_earlier_upserts(self):
+        post = Post.objects.create(author=self.author, title='Gone', content='...')
+        Like.objects.create(post=post, user=self.user)
+        self.client.post(reverse('unlike-post', args=[post.pk]))
+        post.delete()
+        changes = [(item['kind'], item['op'], item['data']) for item in self.sync().data['changes']]
+        self.assertEqual(changes, [('like', 'delete', None), ('post', 'delete', None)])
+
+    def test_unfollow_and_bulk_writes_are_logged(self):
+        posts = [Post.objects.create(author=self.author, title=f'Post {i}', content='...') for i in range(3)]
+        self.client.post(reverse('like-batch'), {'actions': [{'post': p.pk, 'action': 'like'} for p in posts]},
+                         format='json')
+        self.user.following.remove(self.author)
+        # Posts of authors no longer followed leave the feed
+        changes = {(item['kind'], item['op']) for item in self.sync().data['changes']}
+        self.assertEqual(changes, {('like', 'upsert'), ('post', 'delete'), ('follow', 'delete')})
+
+    @override_settings(FEED_BACKFILL_LIMIT=2)
+    def test_follow_and_unfollow_bring_posts_into_and_out_of_scope(self):
+        older, newer, newest = [Post.objects.create(author=self.stranger, title=f'Post {i}', content='...')
+                                for i in range(3)]
+        self.cursor = self.client.get(reverse('sync')).data['cursor']
+        self.client.post(reverse('follow_user', args=[self.stranger.pk]))
+        response = self.sync()
+        changes = [(item['kind'], item['id'], item['op']) for item in response.data['changes']]
+        self.assertEqual(changes, [
+            ('post', newest.pk, 'upsert'),
+            ('post', newer.pk, 'upsert'),
+            ('follow', self.stranger.pk, 'upsert'),
+        ])
+        self.assertEqual(response.data['changes'][0]['data']['title'], 'Post 2')
+
+        self.client.post(reverse('unfollow_user', args=[self.stranger.pk]))
+        changes = [(item['kind'], item['id'], item['op']) for item in self.sync(response.data['cursor']).data['changes']]
+        self.assertEqual(changes, [
+            ('post', older.pk, 'delete'),
+            ('post', newer.pk, 'delete'),
+            ('post', newest.pk, 'delete'),
+            ('follow', self.stranger.pk, 'delete'),
+        ])
+
+    def test_cascaded_deletes_are_logged_in_bulk(self):
+        def busy_post(count):
+            post = Post.objects.create(author=self.author, title='Busy', content='...')
+            for i in range(count):
+                fan = User.objects.create(username=f'fan{count}-{i}')
+                Like.objects.create(post=post, user=fan)
+                Comment.objects.create(post=post, author=fan, content='hi')
+            return post
+
+        small, large = busy_post(1), busy_post(5)
+        ContentType.objects.get_for_models(Post, Comment)
+        with CaptureQueriesContext(connection) as small_queries:
+            small.delete()
+        with CaptureQueriesContext(connection) as large_queries:
+            large.delete()
+        self.assertEqual(len(large_queries), len(small_queries))
+        self.assertEqual(Change.objects.filter(kind='comment', op='delete').count(), 6)
+        self.assertEqual(Change.objects.filter(kind='like', op='delete').count(), 6)
+
+    def test_failed_log_insert_rolls_back_the_mutation(self):
+        record = changelog.record
+
+        def failing_record(kind, *args):
+            if kind in failing:
+                raise DatabaseError('change log unavailable')
+            return record(kind, *args)
+
+        post = Post.objects.create(author=self.author, title='Post', content='...')
+        writes = [
+            (self.author, {changelog.POST}, lambda: self.client.post(reverse('post-list'), {'title': 'New', 'content': '...'})),
+            (self.author, {changelog.POST}, lambda: self.client.patch(reverse('post-detail', args=[post.pk]), {'title': 'Edited'})),
+            (self.user, {changelog.COMMENT}, lambda: self.client.post(reverse('comment-list'), {'post': post.pk, 'content': 'hi'})),
+            # The like itself is logged; only its notification fails
+            (self.user, {changelog.NOTIFICATION}, lambda: self.client.post(reverse('like-post', args=[post.pk]))),
+        ]
+        for user, failing, write in writes:
+            self.client.force_authenticate(user)
+            with mock.patch('posts.changelog.record', side_effect=failing_record):
+                with self.assertRaises(DatabaseError):
+                    write()
+
+        post.refresh_from_db()
+        self.assertEqual(post.title, 'Post')
+        self.assertEqual(Post.objects.count(), 1)
+        self.assertFalse(Comment.objects.exists())
+        self.assertFalse(Like.objects.exists())
+        self.assertFalse(Notification.objects.exists())
+        self.assertEqual(post.like_count, 0)
+
+    @override_settings(SYNC_PAGE_SIZE=2)
+    def test_pages_through_the_log(self):
+        for i in range(3):
+            Post.objects.create(author=self.author, title=f'Post {i}', content='...')
+        first = self.sync()
+        self.assertTrue(first.data['has_more'])
+        self.assertEqual(len(first.data['changes']), 2)
+        second = self.sync(first.data['cursor'])
+        self.assertFalse(second.data['has_more'])
+        self.assertEqual([item['data']['title'] for item in second.data['changes']], ['Post 2'])
+
+    def test_sparse_fields_apply_to_posts(self):
+        Post.objects.create(author=self.author, title='Sparse', content='...')
+        data = self.sync(fields='id,title').data['changes'][0]['data']
+        self.assertEqual(set(data), {'id', 'title'})
+
+    def test_invalid_and_expired_cursors(self):
+        self.assertEqual(self.sync('soon').status_code, status.HTTP_400_BAD_REQUEST)
+        for i in range(3):
+            Post.objects.create(author=self.author, title=f'Post {i}', content='...')
+        Change.objects.update(created_at=timezone.now() - timedelta(days=60))
+        self.assertEqual(changelog.prune_changes(), 3)  # all but the newest row
+        self.assertEqual(self.sync().status_code, status.HTTP_410_GONE)
+        self.assertEqual(self.sync(self.client.get(reverse('sync')).data['cursor']).status_code, status.HTTP_200_OK)
+
+
+class BatchTestCase(APITestCase):
+    def setUp(self):
+        self.user = User.objects.create_user(username='reader', password='testpass')
+        self.post = Post.objects.create(author=self.user, title='Hello', content='...')
+        self.client.force_authenticate(self.user)
+
+    def batch(self, paths):
+        return self.client.post(reverse('batch'), {'requests': paths}, format='json')
+
+    def test_runs_sub_requests_in_order(self):
+        response = self.batch([
+            f'/api/posts/{self.post.pk}/?fields=id,title',
+            f'/api/accounts/user/{self.user.pk}/?fields=username',
+            '/api/notifications/',
+            '/api/posts/0/',
+        ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        statuses = [item['status'] for item in response.data['responses']]
+        self.assertEqual(statuses, [200, 200, 200, 404])
+        self.assertEqual(response.data['responses'][0]['body'], {'id': self.post.pk, 'title': 'Hello'})
+        self.assertEqual(response.data['responses'][1]['body'], {'username': 'reader'})
+
+    def test_sub_requests_share_the_authenticated_user(self):
+        self.client.force_authenticate(None)
+        self.client.credentials(HTTP_AUTHORIZATION='Basic ' + base64.b64encode(b'reader:testpass').decode())
+        with CaptureQueriesContext(connection) as queries:
+            response = self.batch([f'/api/posts/{self.post.pk}/'] * 3)
+        self.assertEqual([item['status'] for item in response.data['responses']], [200] * 3)
+        # Credentials are checked once, for the batch request itself
+        logins = [query for query in queries if '"accounts_customuser"."username" =' in query['sql']]
+        self.assertEqual(len(logins), 1)
+
+    def test_rejects_nested_batches_and_foreign_paths(self):
+        response = self.batch(['/api/batch/', '/admin/', '/api/nowhere/'])
+        self.assertEqual([item['status'] for item in response.data['responses']], [400, 400, 404])
+        self.assertEqual(self.batch([]).status_code, status.HTTP_400_BAD_REQUEST)
+        with override_settings(BATCH_MAX_REQUESTS=2):
+            self.assertEqual(self.batch(['/api/feed/'] * 3).status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_invalid_ids(self):
+        for ids in ['1,two', '0', '99999999999999999999999']:
+            with self.subTest(ids=ids):
+                response = self.client.get(reverse('post-list'), {'ids': ids})
+                self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+
+    def test_failures_stay_in_their_own_entry(self):
+        with mock.patch.object(UserPostsView, 'get_queryset', side_effect=RuntimeError('boom')), \
+                self.assertLogs('posts.batch', 'ERROR'):
+            response = self.batch([
+                f'/api/posts/{self.post.pk}/',
+                '/api/posts/?ids=99999999999999999999999',
+                f'/api/users/{self.user.pk}/posts/',
+                '/api/accounts/export/',
+            ])
+        self.assertEqual(response.status_code, status.HTTP_200_OK)
+        self.assertEqual([item['status'] for item in response.data['responses']], [200, 400, 500, 400])
 
-# Create your tests here.
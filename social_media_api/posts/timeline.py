@@ -0,0 +1,269 @@
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.core.cache import cache
+from django.db import transaction
+from django.db.models import Count, Exists, OuterRef
+
+from . import metrics
+from .models import Post, TimelineEntry
+
+# Posts are either pushed into follower timelines on write, or, for authors
+# with more followers than FEED_CELEBRITY_FOLLOWER_THRESHOLD, pulled and
+# merged into the feed at read time.
+PUSH = "push"
+PULL = "pull"
+
+
+def _batch_size():
+    return getattr(settings, "FEED_FANOUT_BATCH_SIZE", 1000)
+
+
+def _backfill_limit():
+    return getattr(settings, "FEED_BACKFILL_LIMIT", 500)
+
+
+def _follower_threshold():
+    return getattr(settings, "FEED_CELEBRITY_FOLLOWER_THRESHOLD", 10000)
+
+
+def _mode_cache_timeout():
+    return getattr(settings, "FEED_AUTHOR_MODE_CACHE_TIMEOUT", 300)
+
+
+def _mode_cache_key(author_id):
+    return f"feed:author-mode:{author_id}"
+
+
+def _mode_for(follower_count):
+    return PULL if follower_count >= _follower_threshold() else PUSH
+
+
+def _bulk_insert(entries):
+    TimelineEntry.objects.bulk_create(entries, batch_size=_batch_size(), ignore_conflicts=True)
+
+
+def author_modes(author_ids):
+    """
+    Return `{author_id: PUSH | PULL}` for the given authors.
+
+    Modes are cached for FEED_AUTHOR_MODE_CACHE_TIMEOUT seconds; misses are
+    resolved with a single grouped count over the follow table.
+    """
+    author_ids = list(author_ids)
+    cached = cache.get_many([_mode_cache_key(author_id) for author_id in author_ids])
+    modes = {}
+    missing = []
+    for author_id in author_ids:
+        mode = cached.get(_mode_cache_key(author_id))
+        if mode is None:
+            missing.append(author_id)
+        else:
+            modes[author_id] = mode
+
+    if missing:
+        modes.update(_refresh_modes(missing))
+    return modes
+
+
+def _refresh_modes(author_ids):
+    # One grouped count over the follow table, written back to the cache
+    Follow = get_user_model().following.through
+    counts = dict(
+        Follow.objects.filter(to_customuser_id__in=author_ids)
+        .values("to_customuser_id")
+        .annotate(total=Count("id"))
+        .values_list("to_customuser_id", "total")
+    )
+    fresh = {author_id: _mode_for(counts.get(author_id, 0)) for author_id in author_ids}
+    cache.set_many({_mode_cache_key(author_id): mode for author_id, mode in fresh.items()},
+                   _mode_cache_timeout())
+    return fresh
+
+
+def pull_author_ids(user):
+    """
+    Ids of the authors `user` follows whose posts are merged at read time.
+    """
+    modes = author_modes(user.following.values_list("id", flat=True))
+    return sorted(author_id for author_id, mode in modes.items() if mode == PULL)
+
+
+def fan_out_post(post):
+    """
+    Push a freshly created post into the timeline of every follower of its author.
+
+    Posts by authors above the follower threshold are not fanned out; readers
+    pull them in FeedView instead. Returns the number of timeline rows written.
+    """
+    follower_count = post.author.followers.count()
+    mode = _mode_for(follower_count)
+    cache.set(_mode_cache_key(post.author_id), mode, _mode_cache_timeout())
+    metrics.record_author_mode(post.author_id, mode, follower_count)
+    if mode == PULL:
+        metrics.incr("feed.fanout.pull_posts")
+        return 0
+
+    follower_ids = post.author.followers.values_list("id", flat=True).iterator(chunk_size=_batch_size())
+    batch = []
+    written = 0
+    with transaction.atomic():
+        for follower_id in follower_ids:
+            batch.append(TimelineEntry(user_id=follower_id, post=post, created_at=post.created_at))
+            if len(batch) >= _batch_size():
+                _bulk_insert(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            _bulk_insert(batch)
+            written += len(batch)
+    metrics.incr("feed.fanout.push_posts")
+    metrics.incr("feed.fanout.rows", written)
+    return written
+
+
+def fan_out_posts(posts):
+    """
+    Push many new posts at once, e.g. after a bulk import: followers are read
+    once per push-mode author rather than once per post. Returns the number
+    of timeline rows written.
+    """
+    by_author = {}
+    for post in posts:
+        by_author.setdefault(post.author_id, []).append(post)
+    modes = author_modes(by_author)
+
+    Follow = get_user_model().following.through
+    written = 0
+    for author_id, author_posts in by_author.items():
+        if modes[author_id] == PULL:
+            metrics.incr("feed.fanout.pull_posts", len(author_posts))
+            continue
+        follower_ids = (
+            Follow.objects.filter(to_customuser_id=author_id)
+            .values_list("from_customuser_id", flat=True)
+            .iterator(chunk_size=_batch_size())
+        )
+        batch = []
+        for follower_id in follower_ids:
+            batch.extend(
+                TimelineEntry(user_id=follower_id, post_id=post.pk, created_at=post.created_at)
+                for post in author_posts
+            )
+            if len(batch) >= _batch_size():
+                _bulk_insert(batch)
+                written += len(batch)
+                batch = []
+        if batch:
+            _bulk_insert(batch)
+            written += len(batch)
+        metrics.incr("feed.fanout.push_posts", len(author_posts))
+    metrics.incr("feed.fanout.rows", written)
+    return written
+
+
+def backfill_timeline(user, author):
+    """
+    Copy the most recent posts of `author` into `user`'s timeline after a follow.
+    """
+    if author_modes([author.pk])[author.pk] == PULL:
+        return
+    posts = (
+        Post.objects.filter(author=author)
+        .order_by("-created_at", "-id")
+        .values_list("id", "created_at")[:_backfill_limit()]
+    )
+    _bulk_insert([
+        TimelineEntry(user=user, post_id=post_id, created_at=created_at)
+        for post_id, created_at in posts
+    ])
+
+
+def backfill_followers(author_ids):
+    """
+    Push the recent posts that were never fanned out into the timelines of
+    the followers of every author in `author_ids` that is in push mode.
+
+    Call it after an author loses followers: posts written while they were
+    above the follower threshold were only merged at read time, and would
+    vanish from feeds once readers see the author in push mode again. Recent
+    posts that already have timeline rows are skipped, so this writes
+    nothing for authors that never were in pull mode. Returns the number of
+    timeline rows written.
+    """
+    Follow = get_user_model().following.through
+    written = 0
+    for author_id, mode in _refresh_modes(list(author_ids)).items():
+        if mode == PULL:
+            continue
+        recent = (
+            Post.objects.filter(author_id=author_id)
+            .order_by("-created_at", "-id")
+            .values("id")[:_backfill_limit()]
+        )
+        missed = list(
+            Post.objects.filter(pk__in=recent)
+            .exclude(Exists(TimelineEntry.objects.filter(post=OuterRef("pk"))))
+            .values_list("id", "created_at")
+        )
+        if not missed:
+            continue
+        follower_ids = (
+            Follow.objects.filter(to_customuser_id=author_id)
+            .values_list("from_customuser_id", flat=True)
+            .iterator(chunk_size=_batch_size())
+        )
+        batch = []
+        with transaction.atomic():
+            for follower_id in follower_ids:
+                batch.extend(
+                    TimelineEntry(user_id=follower_id, post_id=post_id, created_at=created_at)
+                    for post_id, created_at in missed
+                )
+                if len(batch) >= _batch_size():
+                    _bulk_insert(batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                _bulk_insert(batch)
+                written += len(batch)
+    metrics.incr("feed.fanout.rows", written)
+    return written
+
+
+def trim_timeline(user, author):
+    """
+    Drop every post of `author` from `user`'s timeline after an unfollow.
+    """
+    TimelineEntry.objects.filter(user=user, post__author=author).delete()
+
+
+def rebuild_timelines(users=None):
+    """
+    Recompute timelines from the follow graph, replacing whatever is stored.
+
+    Posts by pull-mode authors are left out. Returns the number of timeline
+    rows written.
+    """
+    User = get_user_model()
+    if users is None:
+        users = User.objects.all()
+
+    written = 0
+    for user in users.iterator(chunk_size=_batch_size()):
+        with transaction.atomic():
+            TimelineEntry.objects.filter(user=user).delete()
+            pushed = user.following.exclude(pk__in=pull_author_ids(user))
+            posts = Post.objects.filter(
+                author__in=pushed
+            ).values_list("id", "created_at").iterator(chunk_size=_batch_size())
+            batch = []
+            for post_id, created_at in posts:
+                batch.append(TimelineEntry(user=user, post_id=post_id, created_at=created_at))
+                if len(batch) >= _batch_size():
+                    _bulk_insert(batch)
+                    written += len(batch)
+                    batch = []
+            if batch:
+                _bulk_insert(batch)
+                written += len(batch)
+    return written
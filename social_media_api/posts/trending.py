@@ -0,0 +1,355 @@
+"""
+"Trending now": sliding-window engagement counters kept in process.
+
+Every like and comment adds to a ring of one-minute buckets covering the last
+day. Each window (hour, day) keeps a running total per post, adjusted as
+events arrive and as buckets fall out of the window, plus a lazily cleaned
+max-heap of those totals, so a top-K read costs O(K log N) instead of a
+GROUP BY over likes and comments.
+
+Every TRENDING_SNAPSHOT_INTERVAL seconds the engagement counted since the
+previous snapshot is added onto the matching TrendingCount rows, so processes
+sharing the database sum up their counts instead of overwriting each other's.
+A new process rebuilds its counters from those rows plus the likes and
+comments written after the last snapshot, and adds the latter at its own
+next snapshot; if another process counted some of them and has not
+snapshotted yet, they are added twice, at most once per process start.
+
+An unlike or a deleted comment takes its score back out of the bucket the
+like or comment was counted in, so liking and unliking a post over and over
+does not move it, and the counts match what a rebuild reads from the rows
+that still exist. A bucket never drops below zero, in memory or in
+TrendingCount. A deleted post leaves every window.
+"""
+import atexit
+import heapq
+import logging
+import threading
+from datetime import datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import connection, transaction
+from django.db.models import Case, Count, F, Max, Value, When
+from django.db.models.functions import Greatest, TruncMinute
+from django.utils import timezone
+
+from . import metrics
+from .models import Comment, Like, Post, TrendingCount
+
+logger = logging.getLogger(__name__)
+
+HOUR = "hour"
+DAY = "day"
+# Window length in one-minute buckets
+WINDOWS = {HOUR: 60, DAY: 24 * 60}
+RING_SIZE = WINDOWS[DAY]
+
+
+def comment_weight():
+    return getattr(settings, "TRENDING_COMMENT_WEIGHT", 2)
+
+
+def to_minute(moment):
+    return int(moment.timestamp() // 60)
+
+
+def from_minute(minute):
+    return datetime.fromtimestamp(minute * 60, tz=dt_timezone.utc)
+
+
+class Window:
+    """
+    Running per-post totals over the last `minutes` buckets.
+
+    Every change pushes the new total onto a max-heap; entries that no longer
+    match `totals` are dropped when they surface, and the heap is rebuilt
+    once stale entries outnumber live ones.
+    """
+
+    def __init__(self, minutes):
+        self.minutes = minutes
+        self.oldest = None  # first minute still inside the window
+        self.totals = {}
+        self._heap = []
+
+    def bump(self, post_id, amount):
+        total = self.totals.get(post_id, 0) + amount
+        if total > 0:
+            self.totals[post_id] = total
+            heapq.heappush(self._heap, (-total, -post_id))
+        else:
+            self.totals.pop(post_id, None)
+        if len(self._heap) > 4 * len(self.totals) + 64:
+            self._heap = [(-total, -post_id) for post_id, total in self.totals.items()]
+            heapq.heapify(self._heap)
+
+    def forget(self, post_id):
+        self.totals.pop(post_id, None)
+
+    def top(self, k):
+        """
+        Return up to `k` `(post_id, score)` pairs, best first; ties go to the newer post.
+        """
+        found = []
+        seen = set()
+        while self._heap and len(found) < k:
+            neg_total, neg_post_id = heapq.heappop(self._heap)
+            post_id = -neg_post_id
+            if self.totals.get(post_id) == -neg_total and post_id not in seen:
+                seen.add(post_id)
+                found.append((post_id, -neg_total))
+        for post_id, total in found:
+            heapq.heappush(self._heap, (-total, -post_id))
+        return found
+
+
+class TrendingCounters:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._snapshot_lock = threading.Lock()
+        self._timer = None
+        self.reset()
+
+    def reset(self):
+        """
+        Drop all in-memory state; the next access rebuilds it from the database.
+        """
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._ring = [None] * RING_SIZE  # (minute, {post_id: score}) per slot
+        self._windows = {name: Window(minutes) for name, minutes in WINDOWS.items()}
+        self._pending = {}  # (minute, post_id) -> score added since the last snapshot
+        self._now = None
+        self._loaded_at = None
+
+    def add(self, post_id, score=1, at=None):
+        """
+        Count engagement that happened `at` (default: now). Events at or
+        before the rebuild are skipped, the rebuild already read their rows.
+        """
+        now = to_minute(timezone.now())
+        with self._lock:
+            self._ensure_loaded(now)
+            if at is not None and at <= self._loaded_at:
+                return
+            self._add(post_id, score, now if at is None else to_minute(at), now)
+            self._schedule()
+
+    def remove(self, post_id, score, created_at, at):
+        """
+        Uncount engagement created at `created_at` and deleted `at`, from the
+        bucket it was counted in. Skipped when the rebuild ran after the
+        delete, as it never read the row.
+        """
+        now = to_minute(timezone.now())
+        with self._lock:
+            self._ensure_loaded(now)
+            if at <= self._loaded_at:
+                return
+            self._add(post_id, -score, to_minute(created_at), now)
+            self._schedule()
+
+    def top(self, window, k, now=None):
+        now = to_minute(now or timezone.now())
+        with self._lock:
+            self._ensure_loaded(now)
+            self._advance(now)
+            return self._windows[window].top(k)
+
+    def forget(self, post_id):
+        with self._lock:
+            for window in self._windows.values():
+                window.forget(post_id)
+
+    def _slot(self, minute, create=False):
+        entry = self._ring[minute % RING_SIZE]
+        if entry is None or entry[0] != minute:
+            if not create:
+                return None
+            entry = self._ring[minute % RING_SIZE] = (minute, {})
+        return entry[1]
+
+    def _advance(self, now):
+        """
+        Slide every window so that it ends at minute `now`.
+        """
+        if self._now is not None and now <= self._now:
+            return
+        for window in self._windows.values():
+            start = now - window.minutes + 1
+            if window.oldest is not None:
+                # Anything older than the ring is already gone
+                for expired in range(max(window.oldest, start - RING_SIZE), start):
+                    for post_id, score in (self._slot(expired) or {}).items():
+                        window.bump(post_id, -score)
+                    if window.minutes == RING_SIZE:
+                        self._ring[expired % RING_SIZE] = None
+            window.oldest = start
+        self._now = now
+
+    def _add(self, post_id, score, minute, now, dirty=True):
+        self._advance(now)
+        if minute > now or minute < now - RING_SIZE + 1:
+            return
+        counts = self._slot(minute, create=True)
+        # The stored row may hold engagement another process counted, so the
+        # full delta is written while the bucket here stops at zero
+        if dirty:
+            self._pending[(minute, post_id)] = self._pending.get((minute, post_id), 0) + score
+        score = max(score, -counts.get(post_id, 0))
+        if not score:
+            return
+        counts[post_id] = counts.get(post_id, 0) + score
+        for window in self._windows.values():
+            if minute >= window.oldest:
+                window.bump(post_id, score)
+
+    def _ensure_loaded(self, now):
+        if self._loaded_at is not None:
+            return
+        loaded_at = timezone.now()
+        since = from_minute(now - RING_SIZE + 1)
+        snapshots = TrendingCount.objects.filter(minute__gte=since)
+        last_snapshot = snapshots.aggregate(last=Max("snapshot_at"))["last"]
+        for post_id, minute, score in snapshots.values_list("post_id", "minute", "score"):
+            self._add(post_id, score, to_minute(minute), now, dirty=False)
+
+        # Engagement written after the last snapshot, one grouped query per kind
+        for model, weight in ((Like, 1), (Comment, comment_weight())):
+            recent = model.objects.filter(created_at__gte=since)
+            if last_snapshot is not None:
+                recent = recent.filter(created_at__gt=last_snapshot)
+            rows = (
+                recent.annotate(bucket=TruncMinute("created_at"))
+                .order_by()
+                .values("bucket", "post_id")
+                .annotate(total=Count("id"))
+                .values_list("post_id", "bucket", "total")
+            )
+            for post_id, bucket, total in rows:
+                self._add(post_id, total * weight, to_minute(bucket), now)
+        self._loaded_at = loaded_at
+        metrics.incr("trending.rebuilds")
+
+    def _schedule(self):
+        interval = getattr(settings, "TRENDING_SNAPSHOT_INTERVAL", 60)
+        if not interval or self._timer is not None:
+            return
+        self._timer = threading.Timer(interval, self._snapshot_from_timer)
+        self._timer.daemon = True
+        self._timer.start()
+
+    def _snapshot_from_timer(self):
+        try:
+            self.snapshot()
+        except Exception:
+            pass  # already logged; the counts are kept for the next snapshot
+        finally:
+            connection.close()
+
+    def snapshot(self):
+        """
+        Add the engagement counted since the last snapshot to TrendingCount
+        and drop rows that fell out of the day window. Returns the number of
+        rows written.
+        """
+        with self._snapshot_lock:
+            with self._lock:
+                taken_at = timezone.now()
+                pending, self._pending = self._pending, {}
+                if self._timer is not None:
+                    self._timer.cancel()
+                    self._timer = None
+            if not pending:
+                return 0
+            try:
+                written = self._write(pending, taken_at)
+            except Exception:
+                logger.exception("Failed to snapshot %d trending buckets", len(pending))
+                with self._lock:
+                    for key, score in pending.items():
+                        self._pending[key] = self._pending.get(key, 0) + score
+                    self._schedule()
+                raise
+            metrics.incr("trending.snapshots")
+            return written
+
+    def _write(self, pending, taken_at):
+        """
+        Insert-or-increment: rows that exist get `score + delta`, floored at
+        zero, in one UPDATE per batch; the others are inserted when the delta
+        is positive. A row inserted concurrently by
+        another process fails the unique constraint and rolls the whole
+        snapshot back, so its counts are retried rather than counted twice.
+        """
+        post_ids = {post_id for _, post_id in pending}
+        existing = set(Post.objects.filter(pk__in=post_ids).values_list("pk", flat=True))
+        deltas = {key: score for key, score in pending.items() if key[1] in existing and score}
+        with transaction.atomic():
+            stored = {
+                (to_minute(minute), post_id): pk
+                for pk, post_id, minute in TrendingCount.objects.filter(
+                    post_id__in=existing, minute__in={from_minute(minute) for minute, _ in deltas}
+                ).values_list("pk", "post_id", "minute")
+            }
+            updates = [(stored[key], score) for key, score in deltas.items() if key in stored]
+            for start in range(0, len(updates), 500):
+                batch = updates[start:start + 500]
+                TrendingCount.objects.filter(pk__in=[pk for pk, _ in batch]).update(
+                    score=Greatest(
+                        F("score") + Case(
+                            *[When(pk=pk, then=Value(score)) for pk, score in batch],
+                            default=Value(0),
+                        ),
+                        Value(0),
+                    ),
+                    snapshot_at=taken_at,
+                )
+            TrendingCount.objects.bulk_create([
+                TrendingCount(post_id=post_id, minute=from_minute(minute), score=score, snapshot_at=taken_at)
+                for (minute, post_id), score in deltas.items()
+                if (minute, post_id) not in stored and score > 0
+            ], batch_size=500)
+            TrendingCount.objects.filter(minute__lt=from_minute(to_minute(taken_at) - RING_SIZE + 1)).delete()
+        return len(deltas)
+
+
+trending_counters = TrendingCounters()
+atexit.register(trending_counters.snapshot)
+
+
+def record_like(post_id):
+    """
+    Count a like once the surrounding transaction commits.
+    """
+    at = timezone.now()
+    transaction.on_commit(lambda: trending_counters.add(post_id, 1, at=at), robust=True)
+
+
+def record_comment(post_id):
+    at = timezone.now()
+    transaction.on_commit(lambda: trending_counters.add(post_id, comment_weight(), at=at), robust=True)
+
+
+def _remove_on_commit(post_id, score, created_at, at):
+    transaction.on_commit(lambda: trending_counters.remove(post_id, score, created_at, at), robust=True)
+
+
+def record_unlikes(likes):
+    """
+    Uncount deleted likes, given as `(post_id, created_at)` pairs, once the
+    surrounding transaction commits.
+    """
+    at = timezone.now()
+    for post_id, created_at in likes:
+        _remove_on_commit(post_id, 1, created_at, at)
+
+
+def record_comment_deletes(comments):
+    """
+    Uncount deleted comments, given as `(post_id, created_at)` pairs.
+    """
+    at = timezone.now()
+    for post_id, created_at in comments:
+        _remove_on_commit(post_id, comment_weight(), created_at, at)
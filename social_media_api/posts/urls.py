@@ -1,6 +1,9 @@
 from django.urls import path, include
 from rest_framework.routers import DefaultRouter
-from .views import PostViewSet, CommentViewSet, feed, LikePostView, UnlikePostView
+from .views import (
+    PostViewSet, CommentViewSet, FeedView, FeedMetricsView, LikePostView, UnlikePostView, LikeBatchView, SearchView,
+    TrendingView, HashtagPostsView, TrendingHashtagsView, UserPostsView, SyncView, BatchView,
+)
 
 
 router = DefaultRouter()
@@ -9,7 +12,16 @@ router.register(r'comments', CommentViewSet, basename='comment')
 
 urlpatterns = [
     path('', include(router.urls)),
-    path('feed/', feed, name='feed'),
+    path('feed/', FeedView.as_view(), name='feed'),
+    path('feed/metrics/', FeedMetricsView.as_view(), name='feed-metrics'),
     path('<int:pk>/like/', LikePostView.as_view(), name="like-post"),
     path('<int:pk>/unlike/', UnlikePostView.as_view(), name="unlike-post"),
+    path('likes/batch/', LikeBatchView.as_view(), name="like-batch"),
+    path('search/', SearchView.as_view(), name="search"),
+    path('trending/', TrendingView.as_view(), name="trending"),
+    path('trending/hashtags/', TrendingHashtagsView.as_view(), name="trending-hashtags"),
+    path('hashtags/<str:tag>/', HashtagPostsView.as_view(), name="hashtag-posts"),
+    path('users/<int:pk>/posts/', UserPostsView.as_view(), name="user-posts"),
+    path('sync/', SyncView.as_view(), name="sync"),
+    path('batch/', BatchView.as_view(), name="batch"),
 ]
\ No newline at end of file
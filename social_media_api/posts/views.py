@@ -1,12 +1,33 @@
+import time
+
+from django.conf import settings
+from django.db import transaction
+from django.db.models import F, prefetch_related_objects
+from django.contrib.auth import get_user_model
 from django.shortcuts import render, get_object_or_404
-from rest_framework import viewsets, permissions, status, generics
+from rest_framework import viewsets, permissions, serializers, status, generics
 from rest_framework.permissions import IsAuthenticated
-from rest_framework.decorators import api_view, permission_classes
+from rest_framework.decorators import action, api_view, permission_classes
+from rest_framework.exceptions import ValidationError
 from rest_framework.response import Response
 
-from .models import Post, Comment, Like
-from .serializers import PostSerializer, CommentSerializer
+from .batch import MultiGetMixin, run_batch
+from .fields import SparseFieldsViewMixin
+from .hashtags import normalize, trending_hashtags
+from .importer import import_posts
+from .models import Post, Comment, Hashtag, Like, comment_list_prefetch, comment_preview_prefetch
+from .like_buffer import like_buffer, write_behind_enabled
+from .likes import LIKE, UNLIKE, apply_intents
+from .mentions import COMMENT_VERB, POST_VERB, notify_mentions
+from .pagination import KeysetPagination
+from .serializers import PostSerializer, CommentSerializer, LikeBatchSerializer, nest_comments, wants_comment_preview
+from .signals import forget_comments
+from .ranking import rank_feed
+from .timeline import fan_out_post, pull_author_ids
+from .trending import WINDOWS, HOUR, record_comment_deletes, record_unlikes, trending_counters
+from . import changelog, counters, metrics, search
 from notifications.models import Notification
+from notifications.serializers import NotificationSerializer
 
 
 class IsAuthorOrReadOnly(permissions.BasePermission):
@@ -22,66 +43,524 @@ class IsAuthorOrReadOnly(permissions.BasePermission):
         return obj.author == request.user
 
 
-class PostViewSet(viewsets.ModelViewSet):
-    queryset = Post.objects.all().order_by('-created_at')
+def select_post_relations(view, queryset):
+    """
+    Join and annotate only what the view's (possibly pruned) PostSerializer renders.
+    """
+    if view.wants('author_username', 'author_profile'):
+        queryset = queryset.select_related('author')
+    if view.wants('liked_by_me'):
+        queryset = queryset.with_viewer_state(view.request.user)
+    return queryset
+
+
+def comments_prefetch(view):
+    # Every comment by default, the latest few for ?comments=preview
+    if wants_comment_preview(view.request):
+        return comment_preview_prefetch()
+    return comment_list_prefetch()
+
+
+def prefetch_comments(view, posts):
+    if view.wants('comments'):
+        prefetch_related_objects(posts, comments_prefetch(view))
+
+
+class PostViewSet(MultiGetMixin, SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = Post.objects.all().order_by('-created_at', '-id')
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated, IsAuthorOrReadOnly]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = select_post_relations(self, super().get_queryset())
+        if self.wants('comments'):
+            queryset = queryset.prefetch_related(comments_prefetch(self))
+        return queryset
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        # One transaction, so the post never commits without its change log row
+        with transaction.atomic():
+            post = serializer.save(author=self.request.user)
+            fan_out_post(post)
+            notify_mentions(self.request.user, post, POST_VERB, post.content)
+
+    def perform_update(self, serializer):
+        previous = serializer.instance.content
+        with transaction.atomic():
+            post = serializer.save()
+            notify_mentions(self.request.user, post, POST_VERB, post.content, previous)
+
+    @action(detail=False, methods=['post'], url_path='import', permission_classes=[permissions.IsAdminUser])
+    def bulk_import(self, request):
+        """
+        Import posts from an NDJSON request body, streamed in chunks. Lines
+        without an `author` are attributed to the requesting user.
+        """
+        report = import_posts(request.stream or [], default_author=request.user)
+        return Response(report.as_dict(), status=status.HTTP_200_OK)
+
+    @action(detail=True)
+    def thread(self, request, pk=None):
+        """
+        All comments of the post as a nested tree, `?depth=` levels deep.
+        """
+        post = self.get_object()
+        return thread_response(Comment.objects.thread(post.pk, max_depth=thread_depth(request)))
 
+    @action(detail=True, url_path='comments')
+    def comments(self, request, pk=None):
+        """
+        The post's comments, newest first, cursor paginated over the
+        (post, created_at, id) index with authors joined in.
+        """
+        post = get_object_or_404(Post.objects.only('id'), pk=pk)
+        comments = Comment.objects.filter(post=post).select_related('author')
+        page = self.paginate_queryset(comments)
+        serializer = CommentSerializer(page, many=True, context=self.get_serializer_context())
+        return self.get_paginated_response(serializer.data)
 
-class CommentViewSet(viewsets.ModelViewSet):
-    queryset = Comment.objects.all().order_by('-created_at')
+
+def thread_depth(request):
+    try:
+        depth = int(request.query_params.get('depth', ''))
+    except ValueError:
+        return None
+    return max(depth, 0)
+
+
+def thread_response(comments):
+    # One indexed range query, capped so a viral thread cannot blow up the response
+    limit = getattr(settings, 'COMMENT_THREAD_MAX_COMMENTS', 500)
+    rows = list(comments.select_related('author')[:limit + 1])
+    data = CommentSerializer(rows[:limit], many=True).data
+    return Response({'truncated': len(rows) > limit, 'comments': nest_comments(data)})
+
+
+class CommentViewSet(SparseFieldsViewMixin, viewsets.ModelViewSet):
+    queryset = Comment.objects.order_by('-created_at', '-id')
     serializer_class = CommentSerializer
     permission_classes = [permissions.IsAuthenticated, IsAuthorOrReadOnly]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        queryset = super().get_queryset()
+        if self.wants('author_username', 'author_profile'):
+            queryset = queryset.select_related('author')
+        return queryset
 
     def perform_create(self, serializer):
-        serializer.save(author=self.request.user)
+        with transaction.atomic():
+            comment = serializer.save(author=self.request.user)
+            counters.increment(comment.post_id, 'comment_count')
+            notify_mentions(self.request.user, comment, COMMENT_VERB, comment.content)
 
+    def perform_update(self, serializer):
+        previous = serializer.instance.content
+        with transaction.atomic():
+            comment = serializer.save()
+            notify_mentions(self.request.user, comment, COMMENT_VERB, comment.content, previous)
 
-class FeedView(generics.ListAPIView):
+    def perform_destroy(self, instance):
+        with transaction.atomic():
+            # Replies go with the comment, so count and forget the whole subtree
+            subtree = list(instance.subtree().values_list('pk', 'created_at'))
+            forget_comments([(comment_id, instance.post.author_id) for comment_id, _ in subtree])
+            record_comment_deletes([(instance.post_id, created_at) for _, created_at in subtree])
+            instance.delete()
+            counters.decrement(instance.post_id, 'comment_count', len(subtree))
+
+    @action(detail=True)
+    def thread(self, request, pk=None):
+        """
+        The comment and its replies as a nested tree, `?depth=` levels deep.
+        """
+        comment = self.get_object()
+        return thread_response(comment.subtree(max_depth=thread_depth(request)))
+
+
+class FeedView(SparseFieldsViewMixin, generics.ListAPIView):
     serializer_class = PostSerializer
     permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    # Page over the timeline row's own (user, created_at, post) index
+    cursor_ordering = ('-feed_created_at', '-id')
 
     def get_queryset(self):
+        # Read the materialized timeline instead of joining over every followed author's posts
         user = self.request.user
-        following_users = user.following.all()  
-        return Post.objects.filter(author__in=following_users).order_by('-created_at')
+        return select_post_relations(self, (
+            Post.objects.filter(timeline_entries__user=user)
+            .annotate(feed_created_at=F('timeline_entries__created_at'))
+            .order_by('-feed_created_at', '-id')
+        ))
+
+    def paginate_queryset(self, queryset):
+        # Prefetch comments for the page rows only, not for every merged source
+        page = super().paginate_queryset(queryset)
+        prefetch_comments(self, page)
+        return page
+
+    def list(self, request, *args, **kwargs):
+        ranking = request.query_params.get('ranking')
+        if ranking == 'engagement':
+            return self.ranked_list(request)
+        if ranking not in (None, '', 'latest'):
+            raise ValidationError({'ranking': "Must be 'latest' or 'engagement'."})
+
+        pull_ids = pull_author_ids(request.user)
+        if not pull_ids:
+            return super().list(request, *args, **kwargs)
+
+        # Posts of high-follower authors were never fanned out: merge each
+        # author's recent posts with the precomputed timeline at read time
+        sources = [self.get_queryset()] + [
+            select_post_relations(self, Post.objects.filter(author_id=author_id).annotate(feed_created_at=F('created_at')))
+            for author_id in pull_ids
+        ]
+        started = time.perf_counter()
+        page = self.paginator.paginate_querysets(sources, request, view=self)
+        prefetch_comments(self, page)
+        metrics.observe('feed.merge', (time.perf_counter() - started) * 1000)
+        metrics.incr('feed.merge.requests')
+        metrics.incr('feed.merge.sources', len(sources))
+        metrics.incr('feed.merge.rows_fetched', self.paginator.rows_fetched)
+
+        serializer = self.get_serializer(page, many=True)
+        return self.get_paginated_response(serializer.data)
+
+    def ranked_list(self, request):
+        # Ranked results are a single page of the best-scored recent candidates;
+        # rank_feed records its own fetch/scoring timings and budget overruns
+        limit = self.paginator.get_page_size(request)
+        started = time.perf_counter()
+        post_ids = rank_feed(request.user, limit, pull_author_ids(request.user))
+        metrics.observe('feed.ranking', (time.perf_counter() - started) * 1000)
+
+        posts = select_post_relations(self, Post.objects.all()).in_bulk(post_ids)
+        prefetch_comments(self, list(posts.values()))
+        serializer = self.get_serializer([posts[post_id] for post_id in post_ids if post_id in posts], many=True)
+        return Response({'next': None, 'previous': None, 'results': serializer.data})
+
+
+class UserPostsView(SparseFieldsViewMixin, generics.ListAPIView):
+    """
+    A user's posts, newest first, paged over the (author, created_at, id) index.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get_queryset(self):
+        author = get_object_or_404(get_user_model().objects.only('id'), pk=self.kwargs['pk'])
+        return select_post_relations(self, Post.objects.filter(author=author).order_by('-created_at', '-id'))
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        prefetch_comments(self, page)
+        return page
+
+
+class TrendingView(SparseFieldsViewMixin, generics.GenericAPIView):
+    """
+    Posts with the most likes and comments in the last `?window=hour|day`,
+    served from the in-process sliding-window counters.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get(self, request, *args, **kwargs):
+        window = request.query_params.get('window') or HOUR
+        if window not in WINDOWS:
+            raise ValidationError({'window': f"Must be one of: {', '.join(WINDOWS)}."})
+        ranked = trending_counters.top(window, self.paginator.get_page_size(request))
+
+        posts = select_post_relations(self, Post.objects.all()).in_bulk([post_id for post_id, _ in ranked])
+        prefetch_comments(self, list(posts.values()))
+        serializer = self.get_serializer([posts[post_id] for post_id, _ in ranked if post_id in posts], many=True)
+        return Response({'next': None, 'previous': None, 'results': serializer.data})
+
+
+class HashtagPostsView(SparseFieldsViewMixin, generics.ListAPIView):
+    """
+    Posts carrying a hashtag, newest first, paged over its posting list.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('-tagged_at', '-id')
+
+    def get_queryset(self):
+        hashtag = get_object_or_404(Hashtag.objects.only('id'), name=normalize(self.kwargs['tag']))
+        return select_post_relations(self, (
+            Post.objects.filter(hashtag_links__hashtag=hashtag)
+            .annotate(tagged_at=F('hashtag_links__created_at'))
+            .order_by('-tagged_at', '-id')
+        ))
+
+    def paginate_queryset(self, queryset):
+        page = super().paginate_queryset(queryset)
+        prefetch_comments(self, page)
+        return page
+
+
+class TrendingHashtagsView(generics.GenericAPIView):
+    """
+    Hashtags picked up by the most new posts in the last `?window=hour|day`.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+
+    def get(self, request, *args, **kwargs):
+        window = request.query_params.get('window') or HOUR
+        if window not in WINDOWS:
+            raise ValidationError({'window': f"Must be one of: {', '.join(WINDOWS)}."})
+        results = trending_hashtags(window, self.paginator.get_page_size(request))
+        return Response({'window': window, 'results': results})
+
+
+class SyncView(SparseFieldsViewMixin, generics.GenericAPIView):
+    """
+    What changed in the user's feed, likes, follows and notifications after
+    `?since=<cursor>`, one entry per object, read from the change log.
+    Without `since` only the current cursor is returned.
+    """
+    serializer_class = PostSerializer
+    permission_classes = [permissions.IsAuthenticated]
+
+    def get(self, request, *args, **kwargs):
+        since = request.query_params.get('since')
+        if since in (None, ''):
+            return Response({'cursor': str(changelog.latest_cursor()), 'has_more': False, 'changes': []})
+        if not since.isdigit():
+            raise ValidationError({'since': 'Must be a cursor returned by a previous sync.'})
+        since = int(since)
+        if changelog.cursor_expired(since):
+            return Response({'detail': 'This cursor has expired; reload and sync from a fresh cursor.'},
+                            status=status.HTTP_410_GONE)
+
+        changes, cursor, has_more = changelog.changes_since(request.user, since)
+        return Response({'cursor': str(cursor), 'has_more': has_more, 'changes': self.render(changes)})
+
+    def render(self, changes):
+        upserts = {}
+        for kind, object_id, op in changes:
+            if op == changelog.UPSERT:
+                upserts.setdefault(kind, []).append(object_id)
+
+        # One query per kind for the objects that still exist
+        data = {}
+        if upserts.get(changelog.POST):
+            posts = select_post_relations(self, Post.objects.all()).in_bulk(upserts[changelog.POST])
+            prefetch_comments(self, list(posts.values()))
+            rendered = self.get_serializer(list(posts.values()), many=True).data
+            data[changelog.POST] = dict(zip(posts, rendered))
+        if upserts.get(changelog.COMMENT):
+            comments = Comment.objects.select_related('author').in_bulk(upserts[changelog.COMMENT])
+            rendered = CommentSerializer(list(comments.values()), many=True, context=self.get_serializer_context()).data
+            data[changelog.COMMENT] = dict(zip(comments, rendered))
+        if upserts.get(changelog.NOTIFICATION):
+            notifications = (
+                Notification.objects.select_related('actor').prefetch_related('target')
+                .in_bulk(upserts[changelog.NOTIFICATION])
+            )
+            rendered = NotificationSerializer(list(notifications.values()), many=True).data
+            data[changelog.NOTIFICATION] = dict(zip(notifications, rendered))
+
+        results = []
+        for kind, object_id, op in changes:
+            item = {'kind': kind, 'id': object_id, 'op': op, 'data': None}
+            if op == changelog.UPSERT and kind in data:
+                item['data'] = data[kind].get(object_id)
+                if item['data'] is None:
+                    # Deleted after the last log row read here
+                    item['op'] = changelog.DELETE
+            results.append(item)
+        return results
+
+
+class BatchView(generics.GenericAPIView):
+    """
+    Serve several GET requests in one round trip:
+    `{"requests": ["/api/posts/1/", "/api/notifications/", ...]}` returns
+    `{"responses": [{"path", "status", "body"}, ...]}` in the same order.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+
+    def post(self, request, *args, **kwargs):
+        paths = request.data.get('requests') if hasattr(request.data, 'get') else None
+        responses = run_batch(request, paths, forbidden=(BatchView,))
+        return Response({'responses': responses})
+
+
+class FeedMetricsView(generics.GenericAPIView):
+    permission_classes = [permissions.IsAdminUser]
+
+    def get(self, request, *args, **kwargs):
+        return Response(metrics.snapshot())
 
 
 class LikePostView(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk, *args, **kwargs):
+        if write_behind_enabled():
+            return self.buffered_post(request, pk)
+
         post = generics.get_object_or_404(Post, pk=pk)
 
         # Ensure one like per user
-        like, created = Like.objects.get_or_create(user=request.user, post=post)
+        with transaction.atomic():
+            like, created = Like.objects.get_or_create(user=request.user, post=post)
+            if created:
+                counters.increment(post.pk, 'like_count')
+                # Create notification if liking someone else's post
+                if post.author != request.user:
+                    Notification.objects.create(
+                        recipient=post.author,
+                        actor=request.user,
+                        verb="liked your post",
+                        target=post
+                    )
 
         if created:
-            # Create notification if liking someone else's post
-            if post.author != request.user:
-                Notification.objects.create(
-                    recipient=post.author,
-                    actor=request.user,
-                    verb="liked your post",
-                    target=post
-                )
             return Response({"detail": "Post liked!"}, status=status.HTTP_201_CREATED)
 
         return Response({"detail": "You already liked this post."}, status=status.HTTP_200_OK)
 
+    def buffered_post(self, request, pk):
+        # Likes of missing posts are dropped when the buffer is flushed
+        if liked_by(request.user, pk):
+            return Response({"detail": "You already liked this post."}, status=status.HTTP_200_OK)
+        like_buffer.add(request.user.pk, pk, LIKE)
+        return Response({"detail": "Post liked!"}, status=status.HTTP_202_ACCEPTED)
+
 
 class UnlikePostView(generics.GenericAPIView):
     permission_classes = [permissions.IsAuthenticated]
 
     def post(self, request, pk, *args, **kwargs):
+        if write_behind_enabled():
+            return self.buffered_post(request, pk)
+
         post = generics.get_object_or_404(Post, pk=pk)
-        like = Like.objects.filter(user=request.user, post=post).first()
+        with transaction.atomic():
+            likes = list(Like.objects.filter(user=request.user, post=post).values_list('pk', 'created_at'))
+            deleted, _ = Like.objects.filter(pk__in=[pk for pk, _ in likes]).delete()
+            if deleted:
+                counters.decrement(post.pk, 'like_count')
+                changelog.record(changelog.LIKE, changelog.DELETE, request.user.pk, post.pk)
+                record_unlikes([(post.pk, created_at) for _, created_at in likes])
 
-        if like:
-            like.delete()
+        if deleted:
             return Response({"detail": "Like removed!"}, status=status.HTTP_200_OK)
 
         return Response({"detail": "You haven't liked this post."}, status=status.HTTP_400_BAD_REQUEST)
+
+    def buffered_post(self, request, pk):
+        if not liked_by(request.user, pk):
+            return Response({"detail": "You haven't liked this post."}, status=status.HTTP_400_BAD_REQUEST)
+        like_buffer.add(request.user.pk, pk, UNLIKE)
+        return Response({"detail": "Like removed!"}, status=status.HTTP_202_ACCEPTED)
+
+
+class LikeBatchView(generics.GenericAPIView):
+    """
+    Apply many like/unlike actions of the current user in one request.
+
+    When a post appears more than once, the last action wins and the earlier
+    ones are reported as "superseded".
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    serializer_class = LikeBatchSerializer
+
+    def post(self, request, *args, **kwargs):
+        serializer = self.get_serializer(data=request.data)
+        serializer.is_valid(raise_exception=True)
+        actions = serializer.validated_data['actions']
+
+        intents = {}
+        for item in actions:
+            intents[(request.user.pk, item['post'])] = item['action']
+        # Direct writes win over anything still buffered for these posts
+        like_buffer.discard(request.user.pk, [post_id for _, post_id in intents])
+        outcomes = apply_intents(intents)
+
+        last_index = {item['post']: index for index, item in enumerate(actions)}
+        results = [
+            {
+                'post': item['post'],
+                'action': item['action'],
+                'result': outcomes[(request.user.pk, item['post'])] if last_index[item['post']] == index else 'superseded',
+            }
+            for index, item in enumerate(actions)
+        ]
+        return Response({'results': results}, status=status.HTTP_200_OK)
+
+
+class SearchView(generics.GenericAPIView):
+    """
+    BM25-ranked full-text search over post titles/content and comments.
+
+    `?q=` is required; words are ANDed and `word*` matches a prefix.
+    `?following=true` limits hits to authors the viewer follows.
+    """
+    permission_classes = [permissions.IsAuthenticated]
+    pagination_class = KeysetPagination
+    cursor_ordering = ('score', 'rowid')
+
+    def get(self, request, *args, **kwargs):
+        if not search.search_available():
+            return Response({"detail": "Search is not available."}, status=status.HTTP_503_SERVICE_UNAVAILABLE)
+        match = search.build_match_query(request.query_params.get('q', ''))
+        if not match:
+            raise ValidationError({'q': 'Enter at least one word to search for.'})
+        following_only = request.query_params.get('following', '').lower() in ('1', 'true', 'yes')
+
+        def fetch(position, reverse, limit):
+            return search.search(match, position, reverse, limit,
+                                 following_of=request.user if following_only else None)
+
+        hits = self.paginator.paginate_rows(fetch, request, view=self)
+        return self.paginator.get_paginated_response(self.serialize_hits(hits))
+
+    def serialize_hits(self, hits):
+        post_ids = [hit.post_id for hit in hits if hit.kind == search.POST]
+        comment_ids = [(hit.rowid - 1) // 2 for hit in hits if hit.kind == search.COMMENT]
+        posts = {
+            row['id']: row for row in Post.objects.filter(pk__in=post_ids)
+            .values('id', 'title', 'author__username', 'created_at')
+        }
+        comments = {
+            row['id']: row for row in Comment.objects.filter(pk__in=comment_ids)
+            .values('id', 'post_id', 'post__title', 'author__username', 'created_at')
+        }
+
+        results = []
+        for hit in hits:
+            if hit.kind == search.POST:
+                row = posts.get(hit.post_id)
+                item = row and {'type': search.POST, 'id': row['id'], 'post': row['id'], 'title': row['title']}
+            else:
+                row = comments.get((hit.rowid - 1) // 2)
+                item = row and {'type': search.COMMENT, 'id': row['id'], 'post': row['post_id'], 'title': row['post__title']}
+            if item:
+                item.update({
+                    'author_username': row['author__username'],
+                    'created_at': serializers.DateTimeField().to_representation(row['created_at']),
+                    'snippet': hit.snippet,
+                    'score': hit.score,
+                })
+                results.append(item)
+        return results
+
+
+def liked_by(user, post_id):
+    """
+    Whether `user` likes the post, counting their own not yet flushed intents.
+    """
+    pending = like_buffer.state(user.pk, post_id)
+    if pending is not None:
+        return pending
+    return Like.objects.filter(user=user, post_id=post_id).exists()
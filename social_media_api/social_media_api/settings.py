@@ -132,3 +132,55 @@ REST_FRAMEWORK = {
     'DEFAULT_PAGINATION_CLASS': 'rest_framework.pagination.PageNumberPagination',
     'PAGE_SIZE': 10,  # adjust number of items per page
 }
+# Feed, post and comment lists override this with posts.pagination.KeysetPagination
+
+POST_COMMENT_PREVIEW_SIZE = 3  # latest comments embedded in each serialized post with ?comments=preview
+COMMENT_MAX_DEPTH = 20  # deepest reply level accepted (the materialized path holds 25 levels)
+COMMENT_THREAD_MAX_COMMENTS = 500  # comments returned by one thread request
+
+# Write-behind likes: buffer like/unlike intents in-process and write them in batches
+LIKE_WRITE_BEHIND = False
+LIKE_BUFFER_MAX_SIZE = 500  # flush as soon as this many intents are pending
+LIKE_BUFFER_FLUSH_INTERVAL = 1.0  # seconds between timed flushes
+LIKE_BATCH_MAX_ACTIONS = 100  # actions accepted by /likes/batch/ per request
+
+# Trending posts: in-process sliding-window counters, snapshotted to posts_trendingcount
+TRENDING_SNAPSHOT_INTERVAL = 60  # seconds between snapshots; None disables the timer
+TRENDING_COMMENT_WEIGHT = 2  # a comment counts as this many likes
+
+# Skip a notification when the recipient got an identical one this many seconds ago
+NOTIFICATION_DEDUPE_WINDOW = 3600
+
+# Bulk NDJSON import of posts (POST /api/posts/import/, manage.py import_posts)
+POST_IMPORT_CHUNK_SIZE = 500  # lines validated and written per transaction
+POST_IMPORT_MAX_ERRORS = 1000  # line errors kept in the report
+
+# Rows read per query while streaming a personal data export (GET /api/accounts/export/)
+EXPORT_CHUNK_SIZE = 1000
+
+# Account deletion (DELETE /api/accounts/delete/): owned rows are removed in batches after deactivation
+ACCOUNT_DELETION_BATCH_SIZE = 200  # rows deleted per transaction
+ACCOUNT_DELETION_PAUSE = 0.05  # seconds between batches, so other writers get the database
+ACCOUNT_DELETION_BACKGROUND = True  # False leaves deletions to manage.py run_account_deletions
+
+# Delta sync (GET /api/sync/?since=<cursor>) over the append-only change log
+SYNC_PAGE_SIZE = 500  # log rows read per request before compaction
+SYNC_RETENTION_DAYS = 30  # manage.py prune_changes drops older rows; older cursors get 410 Gone
+
+# Fewer round trips: ?ids= multi-get on posts and users, POST /api/batch/ for several GETs at once
+MULTI_GET_MAX_IDS = 100
+BATCH_MAX_REQUESTS = 20
+
+# Render posts and comments through precompiled field readers instead of DRF's generic field lookups
+API_FAST_SERIALIZATION = True
+
+# Home timeline fan-out
+FEED_FANOUT_BATCH_SIZE = 1000  # timeline rows written per INSERT
+FEED_BACKFILL_LIMIT = 500  # most recent posts copied into a timeline on follow, or when an author returns to push mode
+FEED_CELEBRITY_FOLLOWER_THRESHOLD = 10000  # authors with this many followers are merged at read time instead
+FEED_AUTHOR_MODE_CACHE_TIMEOUT = 300  # seconds an author's push/pull mode is cached
+
+# Ranked feed (?ranking=engagement)
+FEED_RANKING_CANDIDATES = 2000  # most recent feed posts scored per request
+FEED_RANKING_HALF_LIFE_HOURS = 12.0  # recency decay halves a post's score every N hours
+FEED_RANKING_BUDGET_MS = 25  # scoring latency budget; overruns are counted in metrics, not cut short